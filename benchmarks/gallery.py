@@ -0,0 +1,196 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Generation of synthetic galleries.
+
+A synthetic gallery consists of:
+
+- `gallery/`: the images, spread evenly over a directory tree of configurable
+  depth. Every image shows a random number of persons and its file name
+  contains random words of a small vocabulary.
+- `albums/`: one album per configured album. Album `i` is trained with images
+  of person `i` and gets name rules matching words of the vocabulary.
+- `training/`: the training images.
+
+The images are synthetic files for the `fake` face backend (see
+`cutyx.backends`), the generation is deterministic for a given configuration.
+"""
+
+import os
+import os.path
+import random
+from dataclasses import dataclass
+from typing import Any
+
+from cutyx import backends, lib
+from cutyx.faces import DetectionOptions
+
+WORDS = [
+    "beach",
+    "birthday",
+    "city",
+    "concert",
+    "dinner",
+    "forest",
+    "garden",
+    "hiking",
+    "holiday",
+    "lake",
+    "mountain",
+    "party",
+    "portrait",
+    "river",
+    "snow",
+    "sunset",
+    "trip",
+    "wedding",
+]
+"""The vocabulary of the image names and name rules."""
+
+FAKE_DETECTION = DetectionOptions(backend="fake")
+"""The face detection options of synthetic galleries."""
+
+
+@dataclass(frozen=True)
+class GalleryConfig:
+    """The size and shape of a synthetic gallery."""
+
+    images: int = 1000
+    """Number of images in the gallery."""
+
+    albums: int = 10
+    """Number of albums."""
+
+    training_faces: int = 3
+    """Number of training images per album."""
+
+    name_rules: int = 10
+    """Total number of name rules, distributed over the albums. Every third
+    rule is a regex rule and every fifth rule a fuzzy rule."""
+
+    depth: int = 2
+    """Depth of the directory tree containing the images."""
+
+    fanout: int = 4
+    """Number of subdirectories per directory."""
+
+    persons: int = 20
+    """Number of different persons in the gallery (the first `albums` persons
+    have an album)."""
+
+    max_faces: int = 3
+    """Maximum number of persons shown in an image."""
+
+    image_size: int = 4096
+    """Size of each image file in bytes."""
+
+    seed: int = 0
+    """Seed of the random generator."""
+
+
+@dataclass(frozen=True)
+class SyntheticGallery:
+    """The paths of a generated gallery."""
+
+    root_dir: str
+    """The directory containing the gallery, albums and training data."""
+
+    gallery_dir: str
+    """The root directory of the images."""
+
+    albums_root_dir: str
+    """The root directory of the albums."""
+
+    images: list[str]
+    """All images of the gallery."""
+
+
+def image_dirs(gallery_dir: str, depth: int, fanout: int) -> list[str]:
+    """Returns the leaf directories of a directory tree."""
+    dirs = [gallery_dir]
+    for level in range(depth):
+        dirs = [
+            os.path.join(d, f"d{level}-{i}")
+            for d in dirs
+            for i in range(fanout)
+        ]
+    return dirs
+
+
+def name_rule(index: int, word: str) -> dict[str, Any]:
+    """Returns the arguments of `lib.match_names` for the `index`th rule."""
+    if index % 3 == 2:
+        return {"text": f"_{word}(?![a-z])", "use_regex": True}
+    if index % 5 == 4:
+        # A misspelling which only matches fuzzily
+        return {"text": word[:-1] + "x", "use_fuzzy": True}
+    return {"text": word}
+
+
+def generate(root_dir: str, config: GalleryConfig) -> SyntheticGallery:
+    """Generates a synthetic gallery.
+
+    :param root_dir: The (empty) directory to generate the gallery in.
+
+    :param config: The size and shape of the gallery.
+
+    :return: The paths of the generated gallery.
+    """
+    rng = random.Random(config.seed)
+    root_dir = os.path.abspath(root_dir)
+    gallery_dir = os.path.join(root_dir, "gallery")
+    albums_root_dir = os.path.join(root_dir, "albums")
+    training_dir = os.path.join(root_dir, "training")
+
+    # Images
+    dirs = image_dirs(gallery_dir, config.depth, config.fanout)
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+    images: list[str] = []
+    for i in range(config.images):
+        words = rng.sample(WORDS, rng.randint(1, 2))
+        path = os.path.join(
+            dirs[i % len(dirs)], f"img_{i:07d}_{'_'.join(words)}.jpg"
+        )
+        persons = rng.sample(
+            range(config.persons),
+            rng.randint(0, min(config.max_faces, config.persons)),
+        )
+        backends.write_fake_image(path, persons, config.image_size)
+        images.append(path)
+
+    # Albums with their training data and name rules
+    os.makedirs(training_dir, exist_ok=True)
+    album_dirs = [
+        os.path.join(albums_root_dir, f"album-{i:04d}")
+        for i in range(config.albums)
+    ]
+    for i, album_dir in enumerate(album_dirs):
+        for j in range(config.training_faces):
+            training_image = os.path.join(training_dir, f"person{i}-{j}.jpg")
+            backends.write_fake_image(training_image, [i])
+            lib.match_faces(
+                album_dir, training_image, quiet=True, detection=FAKE_DETECTION
+            )
+    if album_dirs:
+        for i in range(config.name_rules):
+            lib.match_names(
+                album_dirs[i % len(album_dirs)],
+                quiet=True,
+                **name_rule(i, WORDS[i % len(WORDS)]),
+            )
+
+    return SyntheticGallery(root_dir, gallery_dir, albums_root_dir, images)
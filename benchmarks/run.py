@@ -0,0 +1,324 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Runs the benchmarks on a synthetic gallery.
+
+The stages of a run of **CutyX** are timed separately on a generated gallery
+using the fake face backend, so the results only depend on **CutyX** itself
+and no real images or face recognition models are needed:
+
+- `generate`: generation of the gallery and training of the albums.
+- `scan`: scanning the gallery for images.
+- `hash`: hashing all images for the fingerprint index.
+- `encode`: calculating (fake) face encodings and writing them to the cache.
+- `match-names`: matching all image names against all name rules.
+- `process`: classifying all images and adding them to the albums.
+- `process-unchanged`: the same run again without any changes.
+- `process-changed`: a run after 1% of the images were modified.
+
+For every stage the duration, the peak resident memory of the process so far
+and optionally the peak memory allocated during the stage (traced with
+`tracemalloc`, which slows down the stage) are reported.
+"""
+
+import contextlib
+import json
+import os
+import os.path
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Iterator, Optional
+
+import typer
+from rich import print
+from rich.table import Table
+
+from benchmarks.gallery import FAKE_DETECTION, GalleryConfig, generate
+from cutyx import albums, backends, cache, lib, scanner
+from cutyx.fingerprints import FingerprintIndex
+from cutyx.names import NameMatcher
+
+CHANGED_IMAGES_RATIO = 0.01
+"""Ratio of images modified before the `process-changed` stage."""
+
+
+@dataclass
+class StageResult:
+    """The measurements of a single stage."""
+
+    name: str
+    """The name of the stage."""
+
+    items: int
+    """The number of processed items (usually images)."""
+
+    seconds: float
+    """The duration of the stage."""
+
+    max_rss_mib: float
+    """The peak resident memory of the process up to the end of the stage."""
+
+    traced_peak_mib: float | None = None
+    """The peak memory allocated during the stage if traced."""
+
+
+def max_rss_mib() -> float:
+    """Returns the peak resident memory of the process in MiB."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in KiB elsewhere
+    return max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class Benchmark:
+    """Measures the stages of a benchmark run."""
+
+    def __init__(self, trace_memory: bool = False) -> None:
+        """
+        :param trace_memory: Whether the memory allocated during every stage is
+            traced.
+        """
+        self.trace_memory = trace_memory
+        self.results: list[StageResult] = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str, items: int) -> Iterator[None]:
+        """Measures the enclosed code as stage `name`."""
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            traced_peak_mib = None
+            if self.trace_memory:
+                traced_peak_mib = tracemalloc.get_traced_memory()[1] / 2**20
+                tracemalloc.stop()
+            self.results.append(
+                StageResult(
+                    name, items, seconds, max_rss_mib(), traced_peak_mib
+                )
+            )
+
+
+def modify_images(images: list[str], ratio: float) -> list[str]:
+    """Modifies a ratio of the images (evenly spread) by swapping the persons
+    shown.
+
+    :return: The modified images.
+    """
+    count = int(len(images) * ratio)
+    if count == 0:
+        return []
+    modified = images[:: len(images) // count][:count]
+    for image in modified:
+        persons = backends.read_fake_persons(image)
+        backends.write_fake_image(
+            image, [p + 1 for p in persons] or [0], os.path.getsize(image)
+        )
+    return modified
+
+
+def run_benchmark(
+    root_dir: str,
+    config: GalleryConfig,
+    link_mode: str = "symlink",
+    trace_memory: bool = False,
+    cache_store: str = cache.DEFAULT_CACHE_STORE,
+) -> list[StageResult]:
+    """Runs all benchmark stages on a newly generated gallery.
+
+    :param root_dir: An empty directory to generate the gallery in.
+
+    :param config: The size and shape of the gallery.
+
+    :param link_mode: How images are added to the albums (see `lib.LINK_MODES`).
+
+    :param trace_memory: Whether the memory allocated during every stage is
+        traced.
+
+    :param cache_store: How the cache entries are stored (see
+        `cache.CACHE_STORES`).
+
+    :return: The measurements of all stages.
+    """
+    benchmark = Benchmark(trace_memory)
+
+    with benchmark.stage("generate", config.images):
+        gallery = generate(root_dir, config)
+
+    if cache_store != cache.DEFAULT_CACHE_STORE:
+        lib.convert_cache(gallery.gallery_dir, cache_store, quiet=True)
+
+    with benchmark.stage("scan", config.images):
+        snapshot = scanner.scan(gallery.gallery_dir)
+
+    with benchmark.stage("hash", len(snapshot.images)):
+        fingerprints = FingerprintIndex.load(gallery.gallery_dir)
+        for image in snapshot.images:
+            fingerprints.hash(image)
+        fingerprints.save()
+
+    with benchmark.stage("encode", len(snapshot.images)):
+        lib.update_cache(
+            gallery.gallery_dir,
+            quiet=True,
+            detection=FAKE_DETECTION,
+            snapshot=snapshot,
+        )
+
+    album_dirs = lib.find_album_dirs(gallery.albums_root_dir)
+    with benchmark.stage("match-names", len(snapshot.images)):
+        matcher = NameMatcher(
+            [albums.load_album_index(album_dir) for album_dir in album_dirs]
+        )
+        matcher.prepare(snapshot.images)
+        for image in snapshot.images:
+            matcher.match(image)
+
+    for name in ("process", "process-unchanged"):
+        with benchmark.stage(name, len(snapshot.images)):
+            lib.process_directory(
+                gallery.gallery_dir,
+                gallery.albums_root_dir,
+                quiet=True,
+                link_mode=link_mode,
+                detection=FAKE_DETECTION,
+            )
+
+    modify_images(gallery.images, CHANGED_IMAGES_RATIO)
+    with benchmark.stage("process-changed", len(snapshot.images)):
+        lib.process_directory(
+            gallery.gallery_dir,
+            gallery.albums_root_dir,
+            quiet=True,
+            link_mode=link_mode,
+            detection=FAKE_DETECTION,
+        )
+
+    return benchmark.results
+
+
+def print_results(results: list[StageResult]) -> None:
+    """Prints the measurements as table."""
+    table = Table(title="CutyX benchmark")
+    table.add_column("Stage", no_wrap=True)
+    table.add_column("Items", justify="right")
+    table.add_column("Seconds", justify="right")
+    table.add_column("Items/s", justify="right")
+    table.add_column("Max RSS (MiB)", justify="right")
+    table.add_column("Traced peak (MiB)", justify="right")
+    for result in results:
+        table.add_row(
+            result.name,
+            str(result.items),
+            f"{result.seconds:.3f}",
+            f"{result.items / result.seconds:.0f}" if result.seconds else "-",
+            f"{result.max_rss_mib:.1f}",
+            (
+                f"{result.traced_peak_mib:.1f}"
+                if result.traced_peak_mib is not None
+                else "-"
+            ),
+        )
+    print(table)
+
+
+app = typer.Typer(context_settings={"help_option_names": ["-h", "--help"]})
+
+
+@app.command()
+def main(
+    images: int = typer.Option(1000, help="Number of images."),
+    albums: int = typer.Option(10, help="Number of albums."),
+    training_faces: int = typer.Option(
+        3, help="Number of training images per album."
+    ),
+    name_rules: int = typer.Option(
+        10, help="Total number of name rules (distributed over the albums)."
+    ),
+    depth: int = typer.Option(2, help="Depth of the directory tree."),
+    fanout: int = typer.Option(4, help="Subdirectories per directory."),
+    persons: int = typer.Option(20, help="Number of different persons."),
+    max_faces: int = typer.Option(3, help="Maximum persons per image."),
+    image_size: int = typer.Option(4096, help="Size of an image in bytes."),
+    seed: int = typer.Option(0, help="Seed of the random generator."),
+    link_mode: str = typer.Option(
+        "symlink", help="How images are added to the albums."
+    ),
+    trace_memory: bool = typer.Option(
+        False,
+        "--trace-memory",
+        help="Trace the memory allocated during every stage (slower).",
+    ),
+    work_dir: Optional[str] = typer.Option(
+        None,
+        "--work-dir",
+        help="Empty directory to generate the gallery in, which is kept "
+        "(default: a temporary directory).",
+    ),
+    json_file: Optional[str] = typer.Option(
+        None, "--json", help="Write the results to this JSON file."
+    ),
+    cache_store: str = typer.Option(
+        cache.DEFAULT_CACHE_STORE,
+        "--cache-store",
+        help="How the cache entries are stored: 'files' or 'sqlite'.",
+    ),
+) -> None:
+    """Benchmarks CutyX on a synthetic gallery."""
+    config = GalleryConfig(
+        images=images,
+        albums=albums,
+        training_faces=training_faces,
+        name_rules=name_rules,
+        depth=depth,
+        fanout=fanout,
+        persons=persons,
+        max_faces=max_faces,
+        image_size=image_size,
+        seed=seed,
+    )
+    with contextlib.ExitStack() as stack:
+        if work_dir is None:
+            work_dir = stack.enter_context(
+                tempfile.TemporaryDirectory(prefix="cutyx-benchmark-")
+            )
+        results = run_benchmark(
+            work_dir, config, link_mode, trace_memory, cache_store
+        )
+    print_results(results)
+    if json_file:
+        with open(json_file, "w") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "config": asdict(config),
+                        "link_mode": link_mode,
+                        "cache_store": cache_store,
+                        "stages": [asdict(r) for r in results],
+                    },
+                    indent=2,
+                )
+            )
+
+
+if __name__ == "__main__":
+    app()
@@ -17,13 +17,18 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 .. include:: ../README.md
 """
-from cutyx import examples, exceptions, lib
-from cutyx.__version__ import (
-    __major_version__,
-    __minor_version__,
-    __patch_version__,
-    __version__,
-)
+import importlib
+from typing import Any
+
+from cutyx import examples, exceptions
+from cutyx.__version__ import __version__
+
+_LAZY_ATTRIBUTES = {
+    "lib": "cutyx.lib",
+    "__major_version__": "cutyx.__version__",
+    "__minor_version__": "cutyx.__version__",
+    "__patch_version__": "cutyx.__version__",
+}
 
 __author__ = "Leah Lackner"
 __contact__ = "leah.lackner+github@gmail.com"
@@ -34,3 +39,12 @@ __license__ = "GPLv3"
 __maintainer__ = "Leah Lackner"
 
 __all__ = ["lib", "examples", "exceptions"]
+
+
+def __getattr__(name: str) -> Any:
+    # `lib` (and with it the processing dependencies) is imported on first
+    # access only, so that the CLI starts quickly
+    if name in _LAZY_ATTRIBUTES:
+        module = importlib.import_module(_LAZY_ATTRIBUTES[name])
+        return module if name == "lib" else getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -13,17 +13,30 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import semantic_version  # type: ignore
+from typing import Any
 
 __version__ = "1.5.0"
 
-_v = semantic_version.Version(__version__)
+_VERSION_PARTS = {
+    "__major_version__": "major",
+    "__minor_version__": "minor",
+    "__patch_version__": "patch",
+}
 
-__major_version__ = _v.major
-__minor_version__ = _v.minor
-__patch_version__ = _v.patch
 
-__all__ = [
+def __getattr__(name: str) -> Any:
+    # The version parts are parsed on first access only, so that reading
+    # `__version__` does not import `semantic_version`
+    if name in _VERSION_PARTS:
+        import semantic_version  # type: ignore
+
+        return getattr(
+            semantic_version.Version(__version__), _VERSION_PARTS[name]
+        )
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = [  # noqa: F822 (see `__getattr__`)
     "__version__",
     "__major_version__",
     "__minor_version__",
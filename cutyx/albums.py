@@ -0,0 +1,269 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compiled album indexes.
+
+An album index contains all training encodings of an album as one contiguous
+matrix together with the parsed name rules and the face backend each training
+directory was calculated with. It is stored in the hidden faces
+directory of the album and is rebuilt automatically whenever the training data
+or the name rules of the album change.
+"""
+
+import hashlib
+import json
+import os
+import os.path
+import zipfile
+from dataclasses import dataclass, field
+from typing import Any
+
+from cutyx import storage
+from cutyx.constants import (
+    ALBUM_INDEX_FILE_NAME,
+    FACES_DIR_NAME,
+    NAMES_FILE_EXT,
+    TRAINING_BACKEND_FILE_NAME,
+    TRAINING_ENCODINGS_FILE_NAME,
+    TRAINING_IMAGE_DIR_EXT,
+)
+
+ALBUM_INDEX_VERSION = 2
+
+
+def _empty_encodings() -> Any:
+    import numpy as np
+
+    return np.empty((0, storage.ENCODING_DIMENSION), dtype=np.float64)
+
+
+@dataclass
+class AlbumIndex:
+    """The compiled rules of a single album."""
+
+    album_dir: str
+    """The album directory."""
+
+    signature: str
+    """Signature of the faces directory the index was compiled from."""
+
+    encodings: Any = field(default_factory=_empty_encodings)
+    """All training encodings of the album (one per row)."""
+
+    trainingdirs: list[str] = field(default_factory=list)
+    """The training directory name for each row of `encodings`."""
+
+    name_rules: list[dict[str, Any]] = field(default_factory=list)
+    """The parsed name rules of the album."""
+
+    backends: dict[str, str] = field(default_factory=dict)
+    """The identity of the face backend of each training directory (unknown
+    for training data of older versions)."""
+
+
+def faces_dir_signature(album_dir: str) -> str:
+    """Calculates a signature of the training data and rules of an album.
+
+    Only the directory entries are examined (name, size and modification
+    time), the files themselves are not read.
+
+    :param album_dir: The album directory.
+
+    :return: The signature as hex string.
+    """
+    faces_dir = os.path.join(album_dir, FACES_DIR_NAME)
+    entries: list[tuple[str, int, int]] = []
+    if os.path.isdir(faces_dir):
+        for entry in os.scandir(faces_dir):
+            if entry.name.endswith(NAMES_FILE_EXT):
+                stat = entry.stat()
+                entries.append((entry.name, stat.st_size, stat.st_mtime_ns))
+            elif entry.name.endswith(TRAINING_IMAGE_DIR_EXT):
+                for subentry in os.scandir(entry.path):
+                    stat = subentry.stat()
+                    entries.append(
+                        (
+                            os.path.join(entry.name, subentry.name),
+                            stat.st_size,
+                            stat.st_mtime_ns,
+                        )
+                    )
+    entries.sort()
+    data = json.dumps([ALBUM_INDEX_VERSION, entries])
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def read_training_encodings(trainingdir_path: str) -> Any:
+    """Reads the face encodings of a training directory.
+
+    Training directories in the legacy layout (one file per face) are
+    migrated to the current format if possible.
+
+    :param trainingdir_path: The training directory.
+
+    :return: A matrix with one encoding per row.
+    """
+    path = os.path.join(trainingdir_path, TRAINING_ENCODINGS_FILE_NAME)
+    if os.path.exists(path):
+        return storage.read_encodings(path, mmap=False)
+    if storage.has_legacy_encodings(trainingdir_path):
+        try:
+            return storage.migrate_legacy_encodings(trainingdir_path, path)
+        except OSError:
+            return storage.read_legacy_encodings(trainingdir_path)
+    return _empty_encodings()
+
+
+def read_training_backend(trainingdir_path: str) -> str | None:
+    """Reads the identity of the face backend which calculated the encodings of
+    a training directory.
+
+    :param trainingdir_path: The training directory.
+
+    :return: The identity or `None` if it is unknown (older versions did not
+        store it).
+    """
+    try:
+        with open(
+            os.path.join(trainingdir_path, TRAINING_BACKEND_FILE_NAME), "r"
+        ) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def build_album_index(album_dir: str) -> AlbumIndex:
+    """Compiles the index of an album from its faces directory.
+
+    :param album_dir: The album directory.
+
+    :return: The compiled album index.
+    """
+    faces_dir = os.path.join(album_dir, FACES_DIR_NAME)
+    encodings: list[Any] = []
+    trainingdirs: list[str] = []
+    name_rules: list[dict[str, Any]] = []
+    backends: dict[str, str] = {}
+    if os.path.isdir(faces_dir):
+        for name in sorted(os.listdir(faces_dir)):
+            path = os.path.join(faces_dir, name)
+            if name.endswith(NAMES_FILE_EXT):
+                with open(path, "r") as f:
+                    rule = json.loads(f.read())
+                rule["rule"] = name
+                name_rules.append(rule)
+            elif name.endswith(TRAINING_IMAGE_DIR_EXT):
+                trainingdir_encodings = read_training_encodings(path)
+                encodings.extend(trainingdir_encodings)
+                trainingdirs.extend([name] * len(trainingdir_encodings))
+                backend = read_training_backend(path)
+                if backend is not None:
+                    backends[name] = backend
+
+    # Calculated after reading, as legacy training data may have been migrated
+    signature = faces_dir_signature(album_dir)
+    index = AlbumIndex(album_dir, signature)
+    if encodings:
+        import numpy as np
+
+        index.encodings = np.vstack(
+            [np.asarray(e, dtype=np.float64) for e in encodings]
+        )
+    index.trainingdirs = trainingdirs
+    index.name_rules = name_rules
+    index.backends = backends
+    return index
+
+
+def album_index_path(album_dir: str) -> str:
+    """Returns the path of the stored index of an album."""
+    return os.path.join(album_dir, FACES_DIR_NAME, ALBUM_INDEX_FILE_NAME)
+
+
+def save_album_index(index: AlbumIndex) -> None:
+    """Stores a compiled album index in the faces directory of the album.
+
+    :param index: The index to be stored.
+    """
+    import numpy as np
+
+    path = album_index_path(index.album_dir)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            version=np.array(ALBUM_INDEX_VERSION),
+            signature=np.array(index.signature),
+            encodings=index.encodings,
+            trainingdirs=np.array(index.trainingdirs, dtype=np.str_),
+            name_rules=np.array(json.dumps(index.name_rules)),
+            backends=np.array(json.dumps(index.backends)),
+        )
+    os.replace(tmp_path, path)
+
+
+def read_album_index(album_dir: str) -> AlbumIndex | None:
+    """Reads the stored index of an album.
+
+    :param album_dir: The album directory.
+
+    :return: The stored index or `None` if none exists or it is unreadable.
+    """
+    import numpy as np
+
+    try:
+        with np.load(album_index_path(album_dir), allow_pickle=False) as data:
+            if int(data["version"]) != ALBUM_INDEX_VERSION:
+                return None
+            return AlbumIndex(
+                album_dir,
+                str(data["signature"]),
+                encodings=data["encodings"],
+                trainingdirs=[str(d) for d in data["trainingdirs"]],
+                name_rules=json.loads(str(data["name_rules"])),
+                backends=json.loads(str(data["backends"])),
+            )
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+
+
+def rebuild_album_index(album_dir: str) -> AlbumIndex:
+    """Compiles the index of an album and stores it.
+
+    :param album_dir: The album directory.
+
+    :return: The compiled album index.
+    """
+    index = build_album_index(album_dir)
+    if os.path.isdir(os.path.join(album_dir, FACES_DIR_NAME)):
+        try:
+            save_album_index(index)
+        except OSError:
+            # A read-only album can still be used with the in-memory index
+            pass
+    return index
+
+
+def load_album_index(album_dir: str) -> AlbumIndex:
+    """Loads the index of an album, rebuilding it if it is missing or outdated.
+
+    :param album_dir: The album directory.
+
+    :return: The up-to-date album index.
+    """
+    index = read_album_index(album_dir)
+    if index is None or index.signature != faces_dir_signature(album_dir):
+        index = rebuild_album_index(album_dir)
+    return index
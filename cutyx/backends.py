@@ -0,0 +1,281 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Face recognition backends.
+
+A backend calculates the face encodings of images and compares face encodings,
+both in batches: many images are encoded with a single call and all known
+encodings are compared to all encodings in question at once.
+
+Backends are registered by name. Besides the built-in backends, other packages
+can provide backends (e.g. an OpenCV DNN or ONNX Runtime model loaded from a
+local file) with an entry point in the `cutyx.face_backends` group, which
+refers to a factory (usually the class) creating the backend::
+
+    entry_points={
+        "cutyx.face_backends": ["onnx = cutyx_onnx:OnnxBackend"],
+    }
+
+The backend is part of the face detection options (see
+`faces.DetectionOptions`), and the identity of the backend is stored in the
+cache configuration and with the training data of the albums, so encodings of
+different backends are never compared.
+
+Built-in backends:
+
+- `face_recognition`: The `face_recognition` (dlib) library (default).
+- `fake`: A deterministic test double for synthetic images (see
+  `write_fake_image`), which needs neither real images nor models.
+"""
+
+import json
+import os.path
+import zlib
+from typing import Any, Callable, Protocol
+
+from cutyx import faces
+from cutyx.exceptions import FacesException
+
+DEFAULT_BACKEND = "face_recognition"
+
+ENTRY_POINT_GROUP = "cutyx.face_backends"
+
+
+class FaceBackend(Protocol):
+    """The interface of a face recognition backend.
+
+    Backends are created once per process, so expensive resources like models
+    should be loaded on first use rather than when the backend is created.
+    """
+
+    identity: str
+    """Identifies the encodings calculated by the backend, e.g. the name and
+    the model used. Caches can only be used with the backend they were created
+    with."""
+
+    def encode_images(
+        self, image_paths: list[str], options: faces.DetectionOptions
+    ) -> list[Any]:
+        """Calculates the face encodings of images.
+
+        :param image_paths: The images.
+
+        :param options: The face detection options.
+
+        :return: For each image, the encodings of all found faces (a list of
+            encodings or a matrix with one encoding per row).
+        """
+        ...
+
+    def compare_faces(
+        self,
+        known_encodings: Any,
+        query_encodings: Any,
+        tolerance: float | None = None,
+    ) -> Any:
+        """Compares all known encodings to all encodings in question.
+
+        :param known_encodings: Matrix of known encodings (one per row).
+
+        :param query_encodings: Matrix of encodings in question (one per row).
+
+        :param tolerance: The maximum distance to be considered a match. The
+            default of the backend if `None`.
+
+        :return: A boolean matrix of shape
+            `(len(known_encodings), len(query_encodings))`.
+        """
+        ...
+
+
+class EuclideanBackend:
+    """Base class of backends comparing encodings by their euclidean
+    distance."""
+
+    tolerance: float = faces.DEFAULT_TOLERANCE
+    """The default tolerance."""
+
+    def compare_faces(
+        self,
+        known_encodings: Any,
+        query_encodings: Any,
+        tolerance: float | None = None,
+    ) -> Any:
+        """See `FaceBackend.compare_faces`."""
+        return faces.compare_faces_matrix(
+            known_encodings,
+            query_encodings,
+            self.tolerance if tolerance is None else tolerance,
+        )
+
+
+class FaceRecognitionBackend(EuclideanBackend):
+    """The `face_recognition` (dlib) library."""
+
+    identity = "face_recognition"
+
+    def encode_images(
+        self, image_paths: list[str], options: faces.DetectionOptions
+    ) -> list[Any]:
+        """See `FaceBackend.encode_images`."""
+        return [
+            faces.detect_face_encodings(image_path, options)
+            for image_path in image_paths
+        ]
+
+
+FAKE_IMAGE_MAGIC = b"CUTYXFAKE"
+"""The start of a synthetic image for the `fake` backend."""
+
+
+def write_fake_image(path: str, persons: list[int], size: int = 0) -> None:
+    """Writes a synthetic image for the `fake` backend.
+
+    :param path: The output file.
+
+    :param persons: The persons shown in the image.
+
+    :param size: The minimum size of the file in bytes (padded with data
+        derived from the path, so that all images have different hashes).
+    """
+    header = FAKE_IMAGE_MAGIC + json.dumps(persons).encode("utf-8") + b"\n"
+    seed = path.encode("utf-8") + b"\n"
+    padding_size = max(0, size - len(header))
+    padding = seed * (padding_size // len(seed) + 1)
+    with open(path, "wb") as f:
+        f.write(header + padding[:padding_size])
+
+
+def read_fake_persons(image_path: str) -> list[int]:
+    """Returns the persons shown in a synthetic image (none for other
+    images)."""
+    with open(image_path, "rb") as f:
+        line = f.readline()
+    if not line.startswith(FAKE_IMAGE_MAGIC):
+        return []
+    persons: list[int] = json.loads(line[len(FAKE_IMAGE_MAGIC) :])
+    return persons
+
+
+class FakeBackend(EuclideanBackend):
+    """A deterministic test double.
+
+    The encoding of a person is a fixed random unit vector with a little noise
+    derived from the image name. Faces of the same person are therefore close to
+    each other and faces of different persons are far apart.
+    """
+
+    identity = "fake"
+
+    noise_scale = 0.005
+    """Standard deviation of the noise added to each encoding dimension."""
+
+    def encode_images(
+        self, image_paths: list[str], options: faces.DetectionOptions
+    ) -> list[Any]:
+        """See `FaceBackend.encode_images`."""
+        import numpy as np
+
+        results = []
+        for image_path in image_paths:
+            rng = np.random.default_rng(
+                zlib.crc32(os.path.basename(image_path).encode("utf-8"))
+            )
+            results.append(
+                [
+                    self.person_encoding(person)
+                    + rng.normal(0.0, self.noise_scale, 128)
+                    for person in read_fake_persons(image_path)
+                ]
+            )
+        return results
+
+    @staticmethod
+    def person_encoding(person: int) -> Any:
+        """Returns the encoding of a person without noise."""
+        import numpy as np
+
+        vector = np.random.default_rng(person).standard_normal(128)
+        return vector / np.linalg.norm(vector)
+
+
+_factories: dict[str, Callable[[], FaceBackend]] = {
+    "face_recognition": FaceRecognitionBackend,
+    "fake": FakeBackend,
+}
+_backends: dict[str, FaceBackend] = {}
+_entry_points_loaded = False
+
+
+def register_backend(name: str, factory: Callable[[], FaceBackend]) -> None:
+    """Registers a backend.
+
+    :param name: The name of the backend, replacing a registered backend of
+        the same name.
+
+    :param factory: Creates the backend when it is used the first time.
+    """
+    _factories[name] = factory
+    _backends.pop(name, None)
+
+
+def _load_entry_points() -> None:
+    """Registers the backends provided by installed packages (once)."""
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+
+    from importlib.metadata import entry_points
+
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        if entry_point.name not in _factories:
+            _factories[entry_point.name] = _entry_point_factory(entry_point)
+
+
+def _entry_point_factory(entry_point: Any) -> Callable[[], FaceBackend]:
+    def factory() -> FaceBackend:
+        backend: FaceBackend = entry_point.load()()
+        return backend
+
+    return factory
+
+
+def available_backends() -> list[str]:
+    """Returns the names of all registered backends."""
+    _load_entry_points()
+    return sorted(_factories)
+
+
+def get_backend(name: str | None = None) -> FaceBackend:
+    """Returns a backend.
+
+    :param name: The name of the backend. The default backend if `None`.
+
+    :return: The backend (created once per process).
+    """
+    if name is None:
+        name = DEFAULT_BACKEND
+    if name not in _backends:
+        if name not in _factories:
+            _load_entry_points()
+        if name not in _factories:
+            raise FacesException(
+                f"Unknown face backend '{name}' (available backends: "
+                f"{', '.join(available_backends())})."
+            )
+        _backends[name] = _factories[name]()
+    return _backends[name]
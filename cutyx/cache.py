@@ -0,0 +1,594 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""The cache of face encodings.
+
+The cache is located in the root directory of the processed images. For each
+image (identified by the hash of its content) a single encodings file is stored
+(see `cutyx.storage`). Cache entries in the legacy layout (a directory per image
+with one file per face) are migrated when they are accessed.
+
+Alternatively all entries are stored in a single SQLite database (see
+`cutyx.sqlite_cache`), which is selected by the `store` setting of the cache
+(see `convert_cache`).
+
+The settings of a cache (e.g. the hash algorithm used to identify images) are
+stored in a configuration file within the cache directory.
+
+The modification time of a cache entry records when it was last accessed
+(updated at most once per `ACCESS_INTERVAL_SECONDS`), as the access time is not
+maintained by many file systems. Entries of images which are not part of the
+gallery anymore and the least recently used entries are removed by
+`collect_garbage`.
+"""
+
+import atexit
+import json
+import os
+import os.path
+import pathlib
+import shutil
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Iterator
+
+from cutyx import storage
+from cutyx.constants import (
+    CACHE_CONFIG_FILE_NAME,
+    CACHE_DATABASE_FILE_NAME,
+    ENCODINGS_FILE_EXT,
+    FACES_CACHE_DIR_NAME,
+)
+from cutyx.exceptions import FacesException
+
+if TYPE_CHECKING:
+    from cutyx.sqlite_cache import SqliteCache
+
+DEFAULT_HASH_ALGORITHM = "blake2b"
+"""Hash algorithm used to identify images in new caches."""
+
+LEGACY_HASH_ALGORITHM = "md5"
+"""Hash algorithm used by caches created by earlier versions."""
+
+CACHE_STORES = ("files", "sqlite")
+"""The ways the entries of a cache can be stored: one file per image or a
+single SQLite database."""
+
+DEFAULT_CACHE_STORE = "files"
+
+ACCESS_INTERVAL_SECONDS = 24 * 60 * 60
+"""Minimum time between two updates of the last access time of an entry."""
+
+TMP_FILE_MAX_AGE_SECONDS = 60 * 60
+"""Age after which temporary files of interrupted writes are removed."""
+
+
+def read_cache_config(root_dir: str) -> dict[str, Any]:
+    """Reads the configuration of a cache.
+
+    :param root_dir: The root directory containing the cache.
+
+    :return: The configuration or an empty `dict` if none was stored.
+    """
+    try:
+        with open(os.path.join(root_dir, CACHE_CONFIG_FILE_NAME), "r") as f:
+            config: dict[str, Any] = json.loads(f.read())
+            return config
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_cache_config(root_dir: str, config: dict[str, Any]) -> None:
+    """Writes the configuration of a cache.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param config: The configuration to be stored.
+    """
+    path = os.path.join(root_dir, CACHE_CONFIG_FILE_NAME)
+    pathlib.Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        f.write(json.dumps(config))
+    os.replace(path + ".tmp", path)
+
+
+def hash_algorithm(root_dir: str) -> str:
+    """Returns the hash algorithm used to identify images in a cache.
+
+    Caches created by earlier versions of `CutyX` have no configuration and
+    keep on using the legacy algorithm, so existing entries stay valid.
+
+    :param root_dir: The root directory containing the cache.
+    """
+    algorithm = read_cache_config(root_dir).get("hash_algorithm")
+    if algorithm:
+        return str(algorithm)
+    if os.path.isdir(os.path.join(root_dir, FACES_CACHE_DIR_NAME)):
+        return LEGACY_HASH_ALGORITHM
+    return DEFAULT_HASH_ALGORITHM
+
+
+def ensure_cache_config(
+    root_dir: str,
+    detection: dict[str, Any] | None = None,
+    backend: str | None = None,
+) -> None:
+    """Stores the configuration of a cache if it was not stored yet.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param detection: The face detection options the cache entries are
+        calculated with.
+
+    :param backend: The identity of the face backend the cache entries are
+        calculated with.
+    """
+    config = read_cache_config(root_dir)
+    modified = False
+    if "hash_algorithm" not in config:
+        config["hash_algorithm"] = hash_algorithm(root_dir)
+        modified = True
+    if detection is not None and "detection" not in config:
+        config["detection"] = detection
+        modified = True
+    if backend is not None and "backend" not in config:
+        config["backend"] = backend
+        modified = True
+    if modified:
+        write_cache_config(root_dir, config)
+
+
+def cache_store(root_dir: str) -> str:
+    """Returns how the entries of a cache are stored (see `CACHE_STORES`).
+
+    :param root_dir: The root directory containing the cache.
+    """
+    return str(read_cache_config(root_dir).get("store", DEFAULT_CACHE_STORE))
+
+
+_databases: dict[str, "SqliteCache | None"] = {}
+_databases_lock = threading.Lock()
+
+
+def open_database(root_dir: str) -> "SqliteCache | None":
+    """Returns the database of a cache using the SQLite store.
+
+    The database is opened once per process and closed on exit (or by
+    `close_database`).
+
+    :param root_dir: The root directory containing the cache.
+
+    :return: The database or `None` if the cache uses the file store.
+    """
+    root_dir = os.path.abspath(root_dir)
+    try:
+        return _databases[root_dir]
+    except KeyError:
+        pass
+    with _databases_lock:
+        if root_dir not in _databases:
+            database: "SqliteCache | None" = None
+            config = read_cache_config(root_dir)
+            if config.get("store", DEFAULT_CACHE_STORE) == "sqlite":
+                from cutyx.sqlite_cache import SqliteCache
+
+                if not _databases:
+                    atexit.register(close_databases)
+                database = SqliteCache(
+                    os.path.join(root_dir, CACHE_DATABASE_FILE_NAME),
+                    backend=config.get("backend"),
+                    access_interval=ACCESS_INTERVAL_SECONDS,
+                )
+            _databases[root_dir] = database
+        return _databases[root_dir]
+
+
+def flush(root_dir: str) -> None:
+    """Commits the pending writes to the cache database (if used).
+
+    :param root_dir: The root directory containing the cache.
+    """
+    database = _databases.get(os.path.abspath(root_dir))
+    if database is not None:
+        database.flush()
+
+
+def close_database(root_dir: str) -> None:
+    """Closes the database of a cache (if opened). The store of the cache is
+    determined again on the next access.
+
+    :param root_dir: The root directory containing the cache.
+    """
+    with _databases_lock:
+        database = _databases.pop(os.path.abspath(root_dir), None)
+    if database is not None:
+        database.close()
+
+
+def close_databases() -> None:
+    """Closes all opened cache databases."""
+    for root_dir in list(_databases):
+        close_database(root_dir)
+
+
+def is_cached(root_dir: str, image_hash: str) -> bool:
+    """Checks whether the face encodings of an image are cached.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param image_hash: The hash of the image content.
+    """
+    database = open_database(root_dir)
+    if database is not None:
+        return database.contains(image_hash)
+    return lookup(root_dir, image_hash) is not None
+
+
+def cached_encodings_path(root_dir: str, image_hash: str) -> str:
+    """Returns the path of the cache entry of an image.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param image_hash: The hash of the image content.
+    """
+    return os.path.join(
+        root_dir, FACES_CACHE_DIR_NAME, image_hash + ENCODINGS_FILE_EXT
+    )
+
+
+def legacy_cache_dir(root_dir: str, image_hash: str) -> str:
+    """Returns the path of a cache entry in the legacy layout."""
+    return os.path.join(root_dir, FACES_CACHE_DIR_NAME, image_hash)
+
+
+def lookup(root_dir: str, image_hash: str) -> str | None:
+    """Looks up the cache entry of an image in the file store.
+
+    An entry in the legacy layout is migrated to the current format.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param image_hash: The hash of the image content.
+
+    :return: The path of the cache entry or `None` if the image is not cached.
+    """
+    path = cached_encodings_path(root_dir, image_hash)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        pass
+    else:
+        mark_accessed(path, stat)
+        return path
+    legacy_dir = legacy_cache_dir(root_dir, image_hash)
+    if os.path.isdir(legacy_dir):
+        storage.migrate_legacy_encodings(legacy_dir, path)
+        shutil.rmtree(legacy_dir)
+        return path
+    return None
+
+
+def read_cached_encodings(root_dir: str, image_hash: str) -> Any | None:
+    """Reads the cached face encodings of an image.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param image_hash: The hash of the image content.
+
+    :return: A matrix of the face encodings (memory-mapped for the file store)
+        or `None` if the image is not cached (or the cache entry is
+        unreadable).
+    """
+    database = open_database(root_dir)
+    if database is not None:
+        return database.read(image_hash)
+    path = lookup(root_dir, image_hash)
+    if path is None:
+        return None
+    try:
+        return storage.read_encodings(path)
+    except FacesException:
+        return None
+
+
+def write_cached_encodings(
+    root_dir: str, image_hash: str, encodings: Any
+) -> None:
+    """Writes the face encodings of an image to the cache.
+
+    Entries written to a database are only visible to other processes after
+    `flush`.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param image_hash: The hash of the image content.
+
+    :param encodings: The face encodings of the image.
+    """
+    database = open_database(root_dir)
+    if database is not None:
+        database.write(image_hash, encodings)
+        return
+    path = cached_encodings_path(root_dir, image_hash)
+    pathlib.Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+    storage.write_encodings(path, encodings)
+
+
+def mark_accessed(path: str, stat: os.stat_result | None = None) -> None:
+    """Records the access of a cache entry.
+
+    The modification time is only updated if it is older than
+    `ACCESS_INTERVAL_SECONDS`, so reading the cache rarely writes to it.
+
+    :param path: The path of the cache entry.
+
+    :param stat: The result of `os.stat` for the entry if already known.
+    """
+    try:
+        if stat is None:
+            stat = os.stat(path)
+        if time.time() - stat.st_mtime > ACCESS_INTERVAL_SECONDS:
+            os.utime(path)
+    except OSError:
+        # A read-only cache is still usable, its entries are just not evicted
+        # in the order of their use
+        pass
+
+
+def convert_cache(root_dir: str, store: str) -> int:
+    """Moves all entries of a cache to another store (see `CACHE_STORES`).
+
+    The new store is used as soon as all entries were copied, afterwards the
+    old store is removed. The cache must not be used by other processes in the
+    meantime.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param store: The new store.
+
+    :return: The number of moved entries.
+    """
+    if store not in CACHE_STORES:
+        raise FacesException(
+            f"Invalid cache store '{store}' (valid stores: "
+            f"{', '.join(CACHE_STORES)})."
+        )
+    root_dir = os.path.abspath(root_dir)
+    ensure_cache_config(root_dir)
+    if cache_store(root_dir) == store:
+        return 0
+
+    entries = [
+        (entry.image_hash, entry.last_access)
+        for entry in iter_cache_entries(root_dir)
+        if entry.image_hash is not None
+    ]
+    database_path = os.path.join(root_dir, CACHE_DATABASE_FILE_NAME)
+    if store == "sqlite":
+        from cutyx.sqlite_cache import SqliteCache
+
+        config = read_cache_config(root_dir)
+        database = SqliteCache(database_path, backend=config.get("backend"))
+        try:
+            for image_hash, last_access in entries:
+                encodings = read_cached_encodings(root_dir, image_hash)
+                if encodings is not None:
+                    database.write(image_hash, encodings, last_access)
+        finally:
+            database.close()
+    else:
+        for image_hash, last_access in entries:
+            encodings = read_cached_encodings(root_dir, image_hash)
+            if encodings is not None:
+                path = cached_encodings_path(root_dir, image_hash)
+                pathlib.Path(os.path.dirname(path)).mkdir(
+                    parents=True, exist_ok=True
+                )
+                storage.write_encodings(path, encodings)
+                os.utime(path, (last_access, last_access))
+
+    close_database(root_dir)
+    config = read_cache_config(root_dir)
+    config["store"] = store
+    write_cache_config(root_dir, config)
+
+    if store == "sqlite":
+        shutil.rmtree(
+            os.path.join(root_dir, FACES_CACHE_DIR_NAME), ignore_errors=True
+        )
+    else:
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(database_path + suffix)
+            except FileNotFoundError:
+                pass
+    return len(entries)
+
+
+@dataclass
+class CacheEntry:
+    """A cache entry as found in the cache directory or database."""
+
+    image_hash: str | None
+    """The hash of the image content (`None` for a temporary file)."""
+
+    path: str | None
+    """The path of the entry (a directory for entries in the legacy layout,
+    `None` for entries in a database)."""
+
+    size: int
+    """The size of the entry in bytes."""
+
+    last_access: float
+    """The time the entry was last accessed (see `mark_accessed`)."""
+
+
+def iter_cache_entries(root_dir: str) -> Iterator[CacheEntry]:
+    """Lists the entries of a cache without reading them.
+
+    :param root_dir: The root directory containing the cache.
+
+    :return: An iterator over the entries in no particular order.
+    """
+    database = open_database(root_dir)
+    if database is not None:
+        for stored_hash, size, last_access in database.entries():
+            yield CacheEntry(stored_hash, None, size, last_access)
+        return
+    try:
+        entries = os.scandir(os.path.join(root_dir, FACES_CACHE_DIR_NAME))
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    yield _legacy_cache_entry(entry)
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                # Removed in the meantime
+                continue
+            image_hash: str | None = None
+            if entry.name.endswith(ENCODINGS_FILE_EXT):
+                image_hash = entry.name[: -len(ENCODINGS_FILE_EXT)]
+            yield CacheEntry(
+                image_hash, entry.path, stat.st_size, stat.st_mtime
+            )
+
+
+def _legacy_cache_entry(entry: os.DirEntry[str]) -> CacheEntry:
+    size = 0
+    last_access = entry.stat(follow_symlinks=False).st_mtime
+    with os.scandir(entry.path) as files:
+        for f in files:
+            stat = f.stat(follow_symlinks=False)
+            size += stat.st_size
+            last_access = max(last_access, stat.st_mtime)
+    return CacheEntry(entry.name, entry.path, size, last_access)
+
+
+def remove_cache_entries(root_dir: str, entries: list[CacheEntry]) -> None:
+    """Removes entries from the cache.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param entries: The entries to be removed.
+    """
+    database = open_database(root_dir)
+    if database is not None:
+        database.remove(
+            [
+                entry.image_hash
+                for entry in entries
+                if entry.path is None and entry.image_hash is not None
+            ]
+        )
+    for entry in entries:
+        if entry.path is None:
+            continue
+        try:
+            if os.path.isdir(entry.path) and not os.path.islink(entry.path):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+@dataclass
+class GarbageReport:
+    """The result of a garbage collection of the cache."""
+
+    removed: list[CacheEntry] = field(default_factory=list)
+    """The removed entries."""
+
+    kept: int = 0
+    """The number of entries left in the cache (temporary files excluded)."""
+
+    kept_size: int = 0
+    """The size of the entries left in the cache in bytes."""
+
+    @property
+    def removed_size(self) -> int:
+        """The size of the removed entries in bytes."""
+        return sum(entry.size for entry in self.removed)
+
+
+def collect_garbage(
+    root_dir: str,
+    live_hashes: set[str] | None = None,
+    max_size: int | None = None,
+    max_age: float | None = None,
+    dry_run: bool = False,
+    now: float | None = None,
+) -> GarbageReport:
+    """Removes unused entries from the cache.
+
+    Entries are removed if their image is not part of the gallery anymore, if
+    they were not accessed for `max_age` seconds and, least recently used
+    first, while the cache is larger than `max_size`.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param live_hashes: The content hashes of all images of the gallery. Entries
+        of other images are removed. Orphaned entries are kept if `None`.
+
+    :param max_size: The maximum size of the cache in bytes.
+
+    :param max_age: The maximum time in seconds since the last access of an
+        entry.
+
+    :param dry_run: Whether to only determine the entries to be removed.
+
+    :param now: The current time (defaults to `time.time()`).
+
+    :return: The removed and the remaining entries.
+    """
+    if now is None:
+        now = time.time()
+    report = GarbageReport()
+    kept: list[CacheEntry] = []
+    for entry in iter_cache_entries(root_dir):
+        age = now - entry.last_access
+        if entry.image_hash is None:
+            # Temporary files may belong to a write in progress
+            if age > TMP_FILE_MAX_AGE_SECONDS:
+                report.removed.append(entry)
+            continue
+        if (
+            live_hashes is not None and entry.image_hash not in live_hashes
+        ) or (max_age is not None and age > max_age):
+            report.removed.append(entry)
+        else:
+            kept.append(entry)
+
+    report.kept = len(kept)
+    report.kept_size = sum(entry.size for entry in kept)
+    if max_size is not None and report.kept_size > max_size:
+        # Evict the least recently used entries first
+        kept.sort(key=lambda entry: entry.last_access)
+        for entry in kept:
+            if report.kept_size <= max_size:
+                break
+            report.removed.append(entry)
+            report.kept -= 1
+            report.kept_size -= entry.size
+
+    if not dry_run:
+        remove_cache_entries(root_dir, report.removed)
+    return report
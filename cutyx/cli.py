@@ -22,7 +22,7 @@ CLI only contains stubs. All the logic is implemented in the `lib` module.
 import os
 import os.path
 import sys
-from typing import Optional
+from typing import List, Optional
 
 import typer
 from rich import print
@@ -35,7 +35,15 @@ if __name__ == "__main__":
     _sys.path.append(_os.path.join(_os.path.dirname(__file__), ".."))
 
 from cutyx.__version__ import __version__
+from cutyx.cli_cache import SECONDS_PER_DAY
+from cutyx.cli_cache import app as app_cache
 from cutyx.cli_match import app as app_match
+from cutyx.cli_options import (
+    BACKEND_OPTION,
+    DETECTION_MODEL_OPTION,
+    MAX_DIMENSION_OPTION,
+    UPSAMPLE_OPTION,
+)
 
 app = typer.Typer(
     context_settings={"help_option_names": ["-h", "--help"]},
@@ -49,6 +57,7 @@ To run the main utility try the 'run' command.
 )
 
 app.add_typer(app_match, name="match")
+app.add_typer(app_cache, name="cache")
 
 
 def version_callback(value: bool) -> None:
@@ -70,14 +79,30 @@ def update_cache(
         "-r",
         "--root-dir",
         help="Root dir containing the images to be processed.",
-    )
+    ),
+    jobs: int = typer.Option(
+        os.cpu_count() or 1,
+        "-j",
+        "--jobs",
+        help="Number of worker processes calculating face encodings.",
+    ),
+    max_dimension: Optional[int] = MAX_DIMENSION_OPTION,
+    detection_model: Optional[str] = DETECTION_MODEL_OPTION,
+    upsample: Optional[int] = UPSAMPLE_OPTION,
+    backend: Optional[str] = BACKEND_OPTION,
 ) -> None:
     """Generates or updates the cache beforehand without sorting
     the images into albums (is automatically run when using the
     other commands and cache use is specified)."""
     from cutyx import lib
 
-    lib.update_cache(root_dir=root_dir)
+    lib.update_cache(
+        root_dir=root_dir,
+        jobs=jobs,
+        detection=lib.make_detection_options(
+            max_dimension, detection_model, upsample, backend
+        ),
+    )
 
 
 @app.command()
@@ -121,9 +146,49 @@ def run(
         "--symlink",
         help="Do not copy the images to the album directories. Instead create a smylink.",
     ),
+    link_mode: Optional[str] = typer.Option(
+        None,
+        "--link-mode",
+        help="How images are added to the album directories: 'copy', 'symlink', "
+        "'hardlink' or 'reflink' (copy-on-write clone where supported). "
+        "Overrides --symlink.",
+    ),
     no_cache: bool = typer.Option(
         False, "-c", "--no-cache", help="Disables the cache."
     ),
+    sync: bool = typer.Option(
+        False,
+        "--sync",
+        help="Only add and remove the images which changed instead of recreating "
+        "the album directories (implies deleting old images).",
+    ),
+    jobs: int = typer.Option(
+        os.cpu_count() or 1,
+        "-j",
+        "--jobs",
+        help="Number of worker processes calculating face encodings for the cache.",
+    ),
+    max_dimension: Optional[int] = MAX_DIMENSION_OPTION,
+    detection_model: Optional[str] = DETECTION_MODEL_OPTION,
+    upsample: Optional[int] = UPSAMPLE_OPTION,
+    backend: Optional[str] = BACKEND_OPTION,
+    gc: bool = typer.Option(
+        False,
+        "--gc",
+        help="Remove the cache entries of images which are not found anymore "
+        "after the run (see 'cache gc').",
+    ),
+    cache_max_size: Optional[str] = typer.Option(
+        None,
+        "--cache-max-size",
+        help="With --gc: maximum size of the cache (e.g. 500M or 2G).",
+    ),
+    cache_max_age: Optional[float] = typer.Option(
+        None,
+        "--cache-max-age",
+        help="With --gc: remove cache entries which were not used for this "
+        "many days.",
+    ),
 ) -> None:
     """Process images anywhere in a directory hierarchy."""
     from cutyx import lib
@@ -135,6 +200,23 @@ def run(
         delete_old=not no_delete_old,
         symlink=symlink,
         use_cache=not no_cache,
+        sync=sync,
+        link_mode=link_mode,
+        jobs=jobs,
+        detection=lib.make_detection_options(
+            max_dimension, detection_model, upsample, backend
+        ),
+        gc=gc,
+        cache_max_size=(
+            lib.parse_size(cache_max_size)
+            if cache_max_size is not None
+            else None
+        ),
+        cache_max_age=(
+            cache_max_age * SECONDS_PER_DAY
+            if cache_max_age is not None
+            else None
+        ),
     )
 
 
@@ -162,13 +244,46 @@ def process_image(
         "--symlink",
         help="Do not copy the images to the album directories. Instead create a smylink.",
     ),
+    link_mode: Optional[str] = typer.Option(
+        None,
+        "--link-mode",
+        help="How images are added to the album directories: 'copy', 'symlink', "
+        "'hardlink' or 'reflink' (copy-on-write clone where supported). "
+        "Overrides --symlink.",
+    ),
     no_cache: bool = typer.Option(
         False, "-c", "--no-cache", help="Disables the cache."
     ),
+    sync: bool = typer.Option(
+        False,
+        "--sync",
+        help="Only add and remove the images which changed instead of recreating "
+        "the album directories (implies deleting old images).",
+    ),
+    max_dimension: Optional[int] = MAX_DIMENSION_OPTION,
+    detection_model: Optional[str] = DETECTION_MODEL_OPTION,
+    upsample: Optional[int] = UPSAMPLE_OPTION,
+    backend: Optional[str] = BACKEND_OPTION,
 ) -> None:
     """Process a single image."""
     from cutyx import lib
 
+    detection = lib.make_detection_options(
+        max_dimension, detection_model, upsample, backend
+    )
+    if (
+        not dry_run
+        and not no_delete_old
+        and not no_cache
+        and detection is None
+        and forward_process_images(
+            [image_to_process_path],
+            albums_root_dir,
+            lib.get_link_mode(symlink, link_mode),
+        )
+    ):
+        return
+
     lib.process_image(
         image_to_process_path,
         albums_root_dir,
@@ -176,6 +291,312 @@ def process_image(
         delete_old=not no_delete_old,
         symlink=symlink,
         use_cache=not no_cache,
+        sync=sync,
+        link_mode=link_mode,
+        detection=detection,
+    )
+
+
+@app.command()
+def process_images(
+    image_paths: Optional[List[str]] = typer.Argument(
+        None,
+        help="Images to process. Read from standard input (one per line) if "
+        "neither images nor --files-from are given.",
+    ),
+    files_from: Optional[str] = typer.Option(
+        None,
+        "-f",
+        "--files-from",
+        help="File containing the images to process, one per line ('-' for "
+        "standard input).",
+    ),
+    root_dir: Optional[str] = typer.Option(
+        None,
+        "-r",
+        "--root-dir",
+        help="Root dir containing the cache (default: the deepest directory "
+        "containing all images).",
+    ),
+    dry_run: bool = typer.Option(
+        False, "-n", "--dry-run", help="Only pretend to do anything."
+    ),
+    albums_root_dir: str = typer.Option(
+        os.getcwd(),
+        "--albums-root-dir",
+        help="Root albums dir.",
+    ),
+    no_delete_old: bool = typer.Option(
+        False,
+        "-d",
+        "--no-delete-old",
+        help="Do not delete instances of the previously classified images found in album directories "
+        "(images outside of a trained album dir are not removed).",
+    ),
+    symlink: bool = typer.Option(
+        False,
+        "-s",
+        "--symlink",
+        help="Do not copy the images to the album directories. Instead create a smylink.",
+    ),
+    link_mode: Optional[str] = typer.Option(
+        None,
+        "--link-mode",
+        help="How images are added to the album directories: 'copy', 'symlink', "
+        "'hardlink' or 'reflink' (copy-on-write clone where supported). "
+        "Overrides --symlink.",
+    ),
+    no_cache: bool = typer.Option(
+        False, "-c", "--no-cache", help="Disables the cache."
+    ),
+    sync: bool = typer.Option(
+        False,
+        "--sync",
+        help="Only add and remove the images which changed instead of recreating "
+        "the album directories (implies deleting old images).",
+    ),
+    max_dimension: Optional[int] = MAX_DIMENSION_OPTION,
+    detection_model: Optional[str] = DETECTION_MODEL_OPTION,
+    upsample: Optional[int] = UPSAMPLE_OPTION,
+    backend: Optional[str] = BACKEND_OPTION,
+) -> None:
+    """Process multiple images without searching any image directory."""
+    from cutyx import lib
+
+    paths = list(image_paths or [])
+    if files_from is not None or not paths:
+        if files_from is None or files_from == "-":
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(files_from, "r") as f:
+                lines = f.read().splitlines()
+        paths.extend(line.strip() for line in lines if line.strip())
+
+    detection = lib.make_detection_options(
+        max_dimension, detection_model, upsample, backend
+    )
+    if (
+        paths
+        and not dry_run
+        and not no_delete_old
+        and not no_cache
+        and detection is None
+        and forward_process_images(
+            paths,
+            albums_root_dir,
+            lib.get_link_mode(symlink, link_mode),
+            root_dir=root_dir,
+        )
+    ):
+        return
+
+    lib.process_images(
+        paths,
+        albums_root_dir,
+        root_dir=root_dir,
+        dry_run=dry_run,
+        delete_old=not no_delete_old,
+        symlink=symlink,
+        use_cache=not no_cache,
+        sync=sync,
+        link_mode=link_mode,
+        detection=detection,
+    )
+
+
+def forward_process_images(
+    paths: list[str],
+    albums_root_dir: str,
+    link_mode: str,
+    root_dir: Optional[str] = None,
+) -> bool:
+    """Forwards the processing of images to a running server.
+
+    :return: `True` if the images were processed by the server.
+    """
+    from cutyx import server
+
+    response = server.forward(
+        "process-images",
+        {
+            "images": [os.path.abspath(p) for p in paths],
+            "albums_root_dir": os.path.abspath(albums_root_dir),
+            "root_dir": os.path.abspath(root_dir) if root_dir else None,
+            "link_mode": link_mode,
+        },
+    )
+    if response is None:
+        return False
+    report = response["result"]
+    print(
+        f"[green]++ Processed by the server: {len(report['added'])} added, "
+        f"{len(report['updated'])} updated, {len(report['removed'])} removed, "
+        f"{report['unchanged']} unchanged ++[/green]"
+    )
+    return True
+
+
+@app.command()
+def search(
+    image_path: str = typer.Argument(
+        ..., help="Image showing the persons to search for."
+    ),
+    root_dir: str = typer.Option(
+        os.getcwd(),
+        "-r",
+        "--root-dir",
+        help="Root dir containing the images to be searched.",
+    ),
+    tolerance: Optional[float] = typer.Option(
+        None,
+        "-t",
+        "--tolerance",
+        help="Maximum face distance of a match (default: 0.6, lower is "
+        "stricter).",
+    ),
+    limit: int = typer.Option(
+        20, "-l", "--limit", help="Maximum number of images listed."
+    ),
+    no_update: bool = typer.Option(
+        False,
+        "--no-update",
+        help="Search the images found by the previous search without updating "
+        "the cache (fast for large galleries).",
+    ),
+    ann: bool = typer.Option(
+        False,
+        "--ann",
+        help="Search an approximate index of the gallery instead of comparing "
+        "all faces (much faster for millions of faces, may miss matches).",
+    ),
+    nprobe: Optional[int] = typer.Option(
+        None,
+        "--nprobe",
+        help="Number of lists of the approximate index searched per face "
+        "(default: 16, higher finds more matches). Implies --ann.",
+    ),
+    jobs: int = typer.Option(
+        os.cpu_count() or 1,
+        "-j",
+        "--jobs",
+        help="Number of worker processes calculating face encodings for the cache.",
+    ),
+) -> None:
+    """Lists the images showing the persons of an image, closest first."""
+    from cutyx import lib
+
+    lib.search_images(
+        image_path,
+        root_dir=root_dir,
+        tolerance=tolerance,
+        limit=limit,
+        update=not no_update,
+        jobs=jobs,
+        ann=ann,
+        nprobe=nprobe,
+    )
+
+
+@app.command()
+def serve(
+    root_dir: str = typer.Option(
+        os.getcwd(),
+        "-r",
+        "--root-dir",
+        help="Root dir containing the images to be processed.",
+    ),
+    albums_root_dir: str = typer.Option(
+        os.getcwd(),
+        "--albums-root-dir",
+        help="Root albums dir.",
+    ),
+    socket_path: Optional[str] = typer.Option(
+        None,
+        "--socket",
+        help="Path of the server socket (default: $CUTYX_SOCKET or "
+        "cutyx-<uid>.sock in the runtime directory).",
+    ),
+    symlink: bool = typer.Option(
+        False,
+        "-s",
+        "--symlink",
+        help="Do not copy the images to the album directories. Instead create a smylink.",
+    ),
+    link_mode: Optional[str] = typer.Option(
+        None,
+        "--link-mode",
+        help="How images are added to the album directories: 'copy', 'symlink', "
+        "'hardlink' or 'reflink' (copy-on-write clone where supported). "
+        "Overrides --symlink.",
+    ),
+    max_dimension: Optional[int] = MAX_DIMENSION_OPTION,
+    detection_model: Optional[str] = DETECTION_MODEL_OPTION,
+    upsample: Optional[int] = UPSAMPLE_OPTION,
+    backend: Optional[str] = BACKEND_OPTION,
+) -> None:
+    """Keep the models and albums loaded and process the requests of the
+    other commands (which are forwarded automatically while the server runs).
+    """
+    from cutyx import lib, server
+
+    server.serve(
+        root_dir=root_dir,
+        albums_root_dir=albums_root_dir,
+        socket_path=socket_path,
+        link_mode=lib.get_link_mode(symlink, link_mode),
+        detection=lib.make_detection_options(
+            max_dimension, detection_model, upsample, backend
+        ),
+    )
+
+
+@app.command()
+def watch(
+    root_dir: str = typer.Option(
+        os.getcwd(),
+        "-r",
+        "--root-dir",
+        help="Root dir containing the images to be processed.",
+    ),
+    albums_root_dir: str = typer.Option(
+        os.getcwd(),
+        "--albums-root-dir",
+        help="Root albums dir.",
+    ),
+    symlink: bool = typer.Option(
+        False,
+        "-s",
+        "--symlink",
+        help="Do not copy the images to the album directories. Instead create a smylink.",
+    ),
+    link_mode: Optional[str] = typer.Option(
+        None,
+        "--link-mode",
+        help="How images are added to the album directories: 'copy', 'symlink', "
+        "'hardlink' or 'reflink' (copy-on-write clone where supported). "
+        "Overrides --symlink.",
+    ),
+    no_cache: bool = typer.Option(
+        False, "-c", "--no-cache", help="Disables the cache."
+    ),
+    max_dimension: Optional[int] = MAX_DIMENSION_OPTION,
+    detection_model: Optional[str] = DETECTION_MODEL_OPTION,
+    upsample: Optional[int] = UPSAMPLE_OPTION,
+    backend: Optional[str] = BACKEND_OPTION,
+) -> None:
+    """Keep the albums up to date while images and rules change
+    (requires the 'watch' extra)."""
+    from cutyx import lib
+    from cutyx.watch import watch as watch_gallery
+
+    watch_gallery(
+        root_dir=root_dir,
+        albums_root_dir=albums_root_dir,
+        link_mode=lib.get_link_mode(symlink, link_mode),
+        use_cache=not no_cache,
+        detection=lib.make_detection_options(
+            max_dimension, detection_model, upsample, backend
+        ),
     )
 
 
@@ -0,0 +1,95 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""The `cache` commands of the CLI of `CutyX`.
+
+All the logic is implemented in the `lib` module.
+"""
+
+import os
+from typing import Optional
+
+import typer
+
+app = typer.Typer(
+    context_settings={"help_option_names": ["-h", "--help"]},
+    help="""
+Commands to maintain the cache of face encodings.
+""",
+)
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+@app.command()
+def gc(
+    root_dir: str = typer.Option(
+        os.getcwd(),
+        "-r",
+        "--root-dir",
+        help="Root dir containing the images and the cache.",
+    ),
+    max_size: Optional[str] = typer.Option(
+        None,
+        "--max-size",
+        help="Maximum size of the cache (e.g. 500M or 2G). The least recently "
+        "used entries are removed first.",
+    ),
+    max_age: Optional[float] = typer.Option(
+        None,
+        "--max-age",
+        help="Remove entries which were not used for this many days.",
+    ),
+    keep_orphans: bool = typer.Option(
+        False,
+        "--keep-orphans",
+        help="Keep the entries of images which are not found in the root dir "
+        "anymore.",
+    ),
+    dry_run: bool = typer.Option(
+        False, "-n", "--dry-run", help="Only pretend to do anything."
+    ),
+) -> None:
+    """Removes unused entries from the cache."""
+    from cutyx import lib
+
+    lib.collect_cache_garbage(
+        root_dir=root_dir,
+        max_size=lib.parse_size(max_size) if max_size is not None else None,
+        max_age=max_age * SECONDS_PER_DAY if max_age is not None else None,
+        keep_orphans=keep_orphans,
+        dry_run=dry_run,
+    )
+
+
+@app.command()
+def convert(
+    store: str = typer.Argument(
+        ...,
+        help="The new store: 'sqlite' (a single database file) or 'files' "
+        "(one file per image).",
+    ),
+    root_dir: str = typer.Option(
+        os.getcwd(),
+        "-r",
+        "--root-dir",
+        help="Root dir containing the cache.",
+    ),
+) -> None:
+    """Moves the cache to another store (also works for a new cache)."""
+    from cutyx import lib
+
+    lib.convert_cache(root_dir=root_dir, store=store)
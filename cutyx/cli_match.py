@@ -18,9 +18,19 @@
 For the implementation of the commands the `typer` library is used. This
 CLI only contains stubs. All the logic is implemented in the `lib` module.
 """
+
+import os.path
 from typing import Optional
 
 import typer
+from rich import print
+
+from cutyx.cli_options import (
+    BACKEND_OPTION,
+    DETECTION_MODEL_OPTION,
+    MAX_DIMENSION_OPTION,
+    UPSAMPLE_OPTION,
+)
 
 app = typer.Typer(
     context_settings={"help_option_names": ["-h", "--help"]},
@@ -48,15 +58,37 @@ def faces(
         "--rule-prefix",
         help="Prefix for the rule (default: no prefix).",
     ),
+    max_dimension: Optional[int] = MAX_DIMENSION_OPTION,
+    detection_model: Optional[str] = DETECTION_MODEL_OPTION,
+    upsample: Optional[int] = UPSAMPLE_OPTION,
+    backend: Optional[str] = BACKEND_OPTION,
 ) -> None:
     """Matches registered faces in images."""
-    from cutyx import lib
+    from cutyx import lib, server
+
+    detection = lib.make_detection_options(
+        max_dimension, detection_model, upsample, backend
+    )
+    if not dry_run and detection is None:
+        # A running server loads the training image with its own options
+        response = server.forward(
+            "match-faces",
+            {
+                "album_dir": os.path.abspath(album_dir),
+                "training_image_path": os.path.abspath(training_image_path),
+                "training_data_prefix": rule_prefix,
+            },
+        )
+        if response is not None:
+            print("[green]++ Face rule added by the server ++[/green]")
+            return
 
     lib.match_faces(
         album_dir,
         training_image_path,
         dry_run=dry_run,
         training_data_prefix=rule_prefix,
+        detection=detection,
     )
 
 
@@ -96,7 +128,23 @@ def name(
     ),
 ) -> None:
     """Matches registered faces in images."""
-    from cutyx import lib
+    from cutyx import lib, server
+
+    if not dry_run:
+        response = server.forward(
+            "match-names",
+            {
+                "album_dir": os.path.abspath(album_dir),
+                "text": text,
+                "use_regex": use_regex,
+                "use_fuzzy": use_fuzzy,
+                "fuzzy_min_ratio": fuzzy_min_ratio,
+                "rule_name": rule_name,
+            },
+        )
+        if response is not None:
+            print("[green]++ Name rule added by the server ++[/green]")
+            return
 
     lib.match_names(
         album_dir,
@@ -0,0 +1,48 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Options shared by several commands of the CLI of `CutyX`.
+
+The face detection options are accepted by every command calculating face
+encodings and are passed to `lib.make_detection_options`.
+"""
+
+import typer
+
+MAX_DIMENSION_OPTION = typer.Option(
+    None,
+    "--max-dimension",
+    help="Downscale images while loading so that the larger side has at most "
+    "this many pixels before detecting faces (default: full resolution).",
+)
+
+DETECTION_MODEL_OPTION = typer.Option(
+    None,
+    "--detection-model",
+    help="Face detection model: 'hog' (default) or 'cnn'.",
+)
+
+UPSAMPLE_OPTION = typer.Option(
+    None,
+    "--upsample",
+    help="How many times images are upsampled when looking for faces (default: 1).",
+)
+
+BACKEND_OPTION = typer.Option(
+    None,
+    "--backend",
+    help="Face recognition backend: 'face_recognition' (default), 'fake' "
+    "(test double) or a backend provided by an installed package.",
+)
@@ -0,0 +1,42 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""File and directory names used within `CutyX`."""
+
+import os.path
+
+FACES_DIR_NAME = ".cutyx-faces.d"
+CACHE_BASE_NAME = ".cutyx-cache.d"
+FACES_CACHE_DIR_NAME = os.path.join(CACHE_BASE_NAME, "faces")
+TRAINING_IMAGE_FILE_PART = ".trainingimage"
+TRAINING_IMAGE_DIR_EXT = TRAINING_IMAGE_FILE_PART + ".d"
+TRAINING_IMAGE_SRC_EXT = TRAINING_IMAGE_FILE_PART + ".src"
+
+NAMES_FILE_EXT = ".names"
+
+ALBUM_INDEX_FILE_NAME = "album.index"
+
+ENCODINGS_FILE_EXT = ".encodings"
+LEGACY_ENCODING_FILE_EXT = ".encoding"
+TRAINING_ENCODINGS_FILE_NAME = "faces" + ENCODINGS_FILE_EXT
+TRAINING_BACKEND_FILE_NAME = "backend"
+
+CACHE_CONFIG_FILE_NAME = os.path.join(CACHE_BASE_NAME, "cache.json")
+CACHE_DATABASE_FILE_NAME = os.path.join(CACHE_BASE_NAME, "cache.sqlite")
+FINGERPRINTS_FILE_NAME = os.path.join(CACHE_BASE_NAME, "fingerprints.json")
+JOURNAL_FILE_NAME = os.path.join(CACHE_BASE_NAME, "journal.json")
+GALLERY_INDEX_DIR_NAME = os.path.join(CACHE_BASE_NAME, "gallery")
+
+IGNORE_FILE_NAME = ".cutyxignore"
@@ -20,3 +20,9 @@ class FacesException(Exception):
     """Base exception thrown by errors in `CutyX`."""
 
     pass
+
+
+class NoMatchesException(FacesException):
+    """Thrown if albums are configured, but no image matches any of them."""
+
+    pass
@@ -14,31 +14,131 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """Wrapper module around the `face_recognition` library to make the function calls
-typechecked."""
+typechecked.
 
+`face_recognition`, `dlib` and `numpy` are only imported once a face operation
+actually runs, so that commands which do not need them start quickly.
+"""
+
+from dataclasses import dataclass
 from typing import Any
 
-import face_recognition  # type: ignore
+DEFAULT_TOLERANCE = 0.6
+"""Maximum distance between two face encodings to be considered a match
+(the same default as used by `face_recognition.compare_faces`)."""
+
+DETECTION_MODELS = ("hog", "cnn")
+
+
+@dataclass(frozen=True)
+class DetectionOptions:
+    """Options for the detection of faces in images."""
+
+    max_dimension: int | None = None
+    """Images are downscaled on load so that their larger side has at most this
+    many pixels. Faces are detected and encoded on the downscaled image. Images
+    are used at full resolution if `None`."""
+
+    model: str = "hog"
+    """The face detection model, either `hog` or `cnn`."""
 
+    upsample: int = 1
+    """How many times the image is upsampled when looking for faces."""
 
-def load_image_file(image_path: str) -> Any:
+    backend: str = "face_recognition"
+    """The name of the face recognition backend (see `backends`)."""
+
+    def as_dict(self) -> dict[str, Any]:
+        """Returns the options as JSON-serialisable `dict`."""
+        return {
+            "max_dimension": self.max_dimension,
+            "model": self.model,
+            "upsample": self.upsample,
+            "backend": self.backend,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "DetectionOptions":
+        """Creates the options from a `dict` as returned by `as_dict`."""
+        return cls(
+            max_dimension=data.get("max_dimension"),
+            model=data.get("model", "hog"),
+            upsample=data.get("upsample", 1),
+            backend=data.get("backend", "face_recognition"),
+        )
+
+
+def load_image_file(image_path: str, max_dimension: int | None = None) -> Any:
     """Loads an image file with `face_recognition`.
 
     :param image_path: The path of the image to be loaded.
 
+    :param max_dimension: If set, images larger than this are downscaled while
+        loading. JPEGs are decoded at a reduced scale directly, so the full
+        resolution image is never materialised.
+
     :return: The loaded image as `face_recognition` instance.
     """
-    return face_recognition.load_image_file(image_path)
+    if max_dimension is None:
+        import face_recognition  # type: ignore
+
+        return face_recognition.load_image_file(image_path)
 
+    import numpy as np
+    from PIL import Image
 
-def face_encodings(image: Any) -> Any:
+    with Image.open(image_path) as im:
+        size = (max_dimension, max_dimension)
+        if max(im.size) > max_dimension:
+            # Lets the JPEG decoder scale down by a power of two (DCT scaling)
+            im.draft("RGB", size)
+        rgb = im.convert("RGB")
+    if max(rgb.size) > max_dimension:
+        rgb.thumbnail(size)
+    return np.array(rgb)
+
+
+def face_encodings(image: Any, model: str = "hog", upsample: int = 1) -> Any:
     """Calculates the face encodings for a given image.
 
     :param image: The image object (loaded with `load_image_file`).
 
+    :param model: The face detection model (`hog` or `cnn`).
+
+    :param upsample: How many times the image is upsampled when looking
+        for faces.
+
+    :return: The found face encodings as list.
+    """
+    import face_recognition
+
+    if model == "hog" and upsample == 1:
+        return face_recognition.face_encodings(image)
+    locations = face_recognition.face_locations(
+        image, number_of_times_to_upsample=upsample, model=model
+    )
+    return face_recognition.face_encodings(
+        image, known_face_locations=locations
+    )
+
+
+def detect_face_encodings(
+    image_path: str, options: DetectionOptions | None = None
+) -> Any:
+    """Loads an image and calculates its face encodings.
+
+    :param image_path: The path of the image.
+
+    :param options: The face detection options. Defaults are used if `None`.
+
     :return: The found face encodings as list.
     """
-    return face_recognition.face_encodings(image)
+    if options is None:
+        options = DetectionOptions()
+    image = load_image_file(image_path, max_dimension=options.max_dimension)
+    return face_encodings(
+        image, model=options.model, upsample=options.upsample
+    )
 
 
 def compare_faces(
@@ -52,9 +152,73 @@ def compare_faces(
 
     :return: A list of `bools` whether the encoding matches.
     """
+    import face_recognition
+
     res: list[bool] = face_recognition.compare_faces(  # type: ignore
         faces_encodings, file_encoding_to_compare
     )
     if not res:
         res = []
     return res
+
+
+def stack_encodings(encodings: Any) -> Any:
+    """Stacks a list of face encodings into a single matrix.
+
+    :param encodings: The face encodings (or matrices of face encodings)
+        to be stacked.
+
+    :return: A `numpy` matrix with one encoding per row. Empty if no
+        encodings were given.
+    """
+    import numpy as np
+
+    if isinstance(encodings, np.ndarray) and encodings.ndim == 2:
+        return encodings
+    if len(encodings) == 0:
+        return np.empty((0, 128), dtype=np.float64)
+    return np.vstack([np.asarray(e, dtype=np.float64) for e in encodings])
+
+
+def face_distance_matrix(known_encodings: Any, query_encodings: Any) -> Any:
+    """Calculates the euclidean distances between all known encodings and all
+    query encodings in a single vectorised operation.
+
+    :param known_encodings: Matrix of known encodings (one per row).
+
+    :param query_encodings: Matrix of encodings in question (one per row).
+
+    :return: A matrix of shape `(len(known_encodings), len(query_encodings))`.
+    """
+    import numpy as np
+
+    known = np.asarray(known_encodings, dtype=np.float64)
+    query = np.asarray(query_encodings, dtype=np.float64)
+    if known.size == 0 or query.size == 0:
+        return np.empty((len(known), len(query)), dtype=np.float64)
+    # |a - b|^2 = |a|^2 + |b|^2 - 2ab, evaluated for all pairs at once
+    squared = (
+        np.einsum("ij,ij->i", known, known)[:, np.newaxis]
+        + np.einsum("ij,ij->i", query, query)[np.newaxis, :]
+        - 2.0 * (known @ query.T)
+    )
+    return np.sqrt(np.maximum(squared, 0.0))
+
+
+def compare_faces_matrix(
+    known_encodings: Any,
+    query_encodings: Any,
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> Any:
+    """Compares all known encodings to all query encodings at once.
+
+    :param known_encodings: Matrix of known encodings (one per row).
+
+    :param query_encodings: Matrix of encodings in question (one per row).
+
+    :param tolerance: The maximum distance to be considered a match.
+
+    :return: A boolean matrix of shape
+        `(len(known_encodings), len(query_encodings))`.
+    """
+    return face_distance_matrix(known_encodings, query_encodings) <= tolerance
@@ -0,0 +1,207 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Content hashes of images.
+
+Images are identified in the cache by the hash of their content. As hashing a
+large gallery means reading all of it, the hashes are remembered in a persistent
+fingerprint index keyed by the path, size, modification time and inode of the
+files. Only new or modified files are read and hashed again.
+
+The index is stored next to the cache entries: in a JSON file for the file
+store and in the database for the SQLite store of the cache.
+"""
+
+import hashlib
+import json
+import os
+import os.path
+import time
+from typing import TYPE_CHECKING, Any, Iterable
+
+from cutyx import cache
+from cutyx.constants import FINGERPRINTS_FILE_NAME
+from cutyx.exceptions import FacesException
+
+if TYPE_CHECKING:
+    from cutyx.sqlite_cache import SqliteCache
+
+HASH_CHUNK_SIZE = 1024 * 1024
+"""Number of bytes read at once when hashing a file."""
+
+RACY_INTERVAL_NS = 2 * 1000 * 1000 * 1000
+"""Files modified more recently than this are hashed, but not remembered, as a
+further modification within the same timestamp granularity could go unnoticed."""
+
+FINGERPRINTS_VERSION = 1
+
+
+def new_hash(algorithm: str) -> Any:
+    """Creates a new hash object.
+
+    :param algorithm: Either `blake2b` or `md5`.
+    """
+    if algorithm == "blake2b":
+        return hashlib.blake2b(digest_size=16)
+    elif algorithm == "md5":
+        return hashlib.md5()
+    raise FacesException(f"Unsupported hash algorithm '{algorithm}'.")
+
+
+def hash_file(path: str, algorithm: str = cache.DEFAULT_HASH_ALGORITHM) -> str:
+    """Hashes the content of a file with streaming reads.
+
+    :param path: The file to be hashed.
+
+    :param algorithm: The hash algorithm (`blake2b` or `md5`).
+
+    :return: The hash as hex string.
+    """
+    h = new_hash(algorithm)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    hexdigest: str = h.hexdigest()
+    return hexdigest
+
+
+class FingerprintIndex:
+    """Maps the fingerprint of a file (path, size, modification time and inode)
+    to the hash of its content.
+    """
+
+    def __init__(
+        self,
+        path: str | None,
+        algorithm: str,
+        database: "SqliteCache | None" = None,
+    ) -> None:
+        """
+        :param path: The file the index is stored in. The index is not
+            persisted if `None` (and no `database` is given).
+
+        :param algorithm: The hash algorithm used for the content hashes.
+
+        :param database: The cache database the index is stored in instead of
+            `path`.
+        """
+        self.path = path
+        self.algorithm = algorithm
+        self.database = database
+        self.entries: dict[str, list[Any]] = {}
+        self.modified = False
+
+    @classmethod
+    def load(cls, root_dir: str) -> "FingerprintIndex":
+        """Loads the fingerprint index of a cache.
+
+        :param root_dir: The root directory containing the cache.
+
+        :return: The loaded index (empty if none was stored yet).
+        """
+        root_dir = os.path.abspath(root_dir)
+        database = cache.open_database(root_dir)
+        if database is not None:
+            index = cls(None, cache.hash_algorithm(root_dir), database)
+            index.entries = database.read_fingerprints()
+            return index
+        index = cls(
+            os.path.join(root_dir, FINGERPRINTS_FILE_NAME),
+            cache.hash_algorithm(root_dir),
+        )
+        try:
+            assert index.path is not None
+            with open(index.path, "r") as f:
+                data = json.loads(f.read())
+            if (
+                data.get("version") == FINGERPRINTS_VERSION
+                and data.get("hash_algorithm") == index.algorithm
+            ):
+                index.entries = data["entries"]
+        except (FileNotFoundError, ValueError, KeyError, AttributeError):
+            pass
+        return index
+
+    def hash(self, path: str, stat: os.stat_result | None = None) -> str:
+        """Returns the content hash of a file.
+
+        The file is only read if it is not known or has changed.
+        May be called from several threads at once.
+
+        :param path: The file.
+
+        :param stat: The result of `os.stat` for the file if already known.
+
+        :return: The content hash as hex string.
+        """
+        path = os.path.abspath(path)
+        if stat is None:
+            stat = os.stat(path)
+        entry = self.entries.get(path)
+        if (
+            entry is not None
+            and entry[0] == stat.st_size
+            and entry[1] == stat.st_mtime_ns
+            and entry[2] == stat.st_ino
+        ):
+            return str(entry[3])
+
+        image_hash = hash_file(path, self.algorithm)
+        if time.time_ns() - stat.st_mtime_ns > RACY_INTERVAL_NS:
+            self.entries[path] = [
+                stat.st_size,
+                stat.st_mtime_ns,
+                stat.st_ino,
+                image_hash,
+            ]
+            self.modified = True
+        elif self.entries.pop(path, None) is not None:
+            self.modified = True
+        return image_hash
+
+    def prune(self, paths: Iterable[str]) -> None:
+        """Removes the entries of all files except the given ones.
+
+        :param paths: The files whose entries are kept.
+        """
+        keep = {os.path.abspath(path) for path in paths}
+        for path in set(self.entries) - keep:
+            del self.entries[path]
+            self.modified = True
+
+    def save(self) -> None:
+        """Stores the index if it was modified."""
+        if self.modified and self.database is not None:
+            self.database.write_fingerprints(self.entries)
+            self.modified = False
+        if not self.modified or self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "version": FINGERPRINTS_VERSION,
+                        "hash_algorithm": self.algorithm,
+                        "entries": self.entries,
+                    }
+                )
+            )
+        os.replace(self.path + ".tmp", self.path)
+        self.modified = False
@@ -0,0 +1,183 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Ignore patterns for the gallery scanner.
+
+Ignore patterns are declared in `.cutyxignore` files, which can be placed in any
+directory of a gallery and apply to everything below that directory. The syntax
+is the one of `.gitignore` files:
+
+- Blank lines and lines starting with `#` are skipped.
+- A leading `!` negates a pattern, re-including paths excluded before.
+- A trailing `/` only matches directories.
+- A pattern containing another `/` is relative to the directory of the ignore
+  file, otherwise it matches a name at any depth.
+- `*` and `?` match within a path component, `**` across components.
+
+Later patterns and patterns of deeper ignore files take precedence. The contents
+of an ignored directory are never scanned, so they cannot be re-included.
+"""
+
+import re
+from dataclasses import dataclass
+
+DEFAULT_IGNORE_PATTERNS = (".*/",)
+"""Patterns applied to every gallery: hidden directories are not scanned.
+They can be re-included with a negated pattern (e.g. `!.photos/`)."""
+
+
+@dataclass(frozen=True)
+class IgnorePattern:
+    """A single parsed ignore pattern."""
+
+    base: str
+    """The directory of the ignore file, relative to the scanned root ('' for the
+    root itself)."""
+
+    regex: re.Pattern[str]
+    """The compiled pattern, matching paths relative to `base`."""
+
+    negate: bool = False
+    """Whether the pattern re-includes matching paths."""
+
+    dir_only: bool = False
+    """Whether the pattern only matches directories."""
+
+
+def translate_glob(pattern: str) -> str:
+    """Translates a glob pattern of an ignore file to a regular expression.
+
+    :param pattern: The glob pattern (without negation and trailing slash).
+
+    :return: The regular expression matching a whole relative path.
+    """
+    i, n = 0, len(pattern)
+    res: list[str] = []
+    while i < n:
+        if pattern.startswith("**/", i):
+            res.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            res.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            res.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            res.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2 :]:
+            j = pattern.index("]", i + 2)
+            chars = pattern[i + 1 : j]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            res.append("[" + chars.replace("\\", "\\\\") + "]")
+            i = j + 1
+        elif pattern[i] == "\\" and i + 1 < n:
+            res.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            res.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(res)
+
+
+def parse_ignore_pattern(line: str, base: str = "") -> IgnorePattern | None:
+    """Parses a line of an ignore file.
+
+    :param line: The line.
+
+    :param base: The directory of the ignore file, relative to the scanned root.
+
+    :return: The parsed pattern or `None` for blank lines and comments.
+    """
+    line = line.rstrip("\n").rstrip()
+    if not line or line.startswith("#"):
+        return None
+    negate = line.startswith("!")
+    if negate:
+        line = line[1:]
+    elif line.startswith("\\"):
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+    if "/" in line:
+        regex = translate_glob(line.lstrip("/"))
+    else:
+        regex = "(?:.*/)?" + translate_glob(line)
+    return IgnorePattern(base, re.compile(regex + r"\Z"), negate, dir_only)
+
+
+class IgnoreRules:
+    """The ignore patterns in effect for a directory."""
+
+    def __init__(self, patterns: tuple[IgnorePattern, ...] = ()) -> None:
+        """
+        :param patterns: The patterns, with the highest precedence last.
+        """
+        self.patterns = patterns
+
+    @classmethod
+    def default(cls) -> "IgnoreRules":
+        """Returns the rules applied to every scanned root directory."""
+        patterns = [parse_ignore_pattern(p) for p in DEFAULT_IGNORE_PATTERNS]
+        return cls(tuple(p for p in patterns if p is not None))
+
+    def with_ignore_file(self, path: str, base: str) -> "IgnoreRules":
+        """Adds the patterns of an ignore file.
+
+        :param path: The ignore file.
+
+        :param base: The directory of the ignore file, relative to the scanned root.
+
+        :return: The combined rules (unchanged if the file is unreadable).
+        """
+        try:
+            with open(path, "r") as f:
+                lines = f.readlines()
+        except (OSError, UnicodeDecodeError):
+            return self
+        patterns = [parse_ignore_pattern(line, base) for line in lines]
+        return IgnoreRules(
+            self.patterns + tuple(p for p in patterns if p is not None)
+        )
+
+    def is_ignored(self, rel_path: str, is_dir: bool = False) -> bool:
+        """Checks whether a path is ignored.
+
+        :param rel_path: The path relative to the scanned root (separated by `/`).
+
+        :param is_dir: Whether the path is a directory.
+
+        :return: `True` if the path is ignored.
+        """
+        for pattern in reversed(self.patterns):
+            if pattern.dir_only and not is_dir:
+                continue
+            path = rel_path
+            if pattern.base:
+                if not rel_path.startswith(pattern.base + "/"):
+                    continue
+                path = rel_path[len(pattern.base) + 1 :]
+            if pattern.regex.match(path):
+                return not pattern.negate
+        return False
+
+
+def join_relative(rel_dir: str, name: str) -> str:
+    """Joins a path relative to the scanned root with a name, using `/`."""
+    return rel_dir + "/" + name if rel_dir else name
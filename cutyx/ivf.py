@@ -0,0 +1,334 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Approximate nearest neighbour search in the gallery index.
+
+Comparing a face with every face of a very large gallery takes time linear in
+the size of the gallery. The inverted file index (IVF) partitions the faces of
+the gallery index (see `cutyx.search`) into lists of nearby faces: the faces
+are clustered with k-means and every face is assigned to the list of its
+closest cluster centroid. A search only compares the faces of the lists whose
+centroids are closest to the faces in question (`nprobe` lists), so it reads a
+small fraction of the gallery matrix. Probing more lists finds more of the
+true matches at the cost of speed; probing all lists is an exhaustive search.
+
+The index is stored next to the gallery index::
+
+    gallery/ivf.npz     the centroids, the list of every row of the gallery
+                        matrix and the generation of the gallery index
+
+New faces are added to the lists of their closest centroids without changing
+the centroids. Once the gallery has grown considerably since the centroids
+were trained, they are trained again.
+"""
+
+import math
+import os
+import os.path
+import zipfile
+from dataclasses import dataclass, field
+from typing import Any
+
+from cutyx import storage
+from cutyx.constants import GALLERY_INDEX_DIR_NAME
+
+IVF_INDEX_VERSION = 1
+
+DEFAULT_NPROBE = 16
+"""The number of lists searched by default."""
+
+KMEANS_ITERATIONS = 10
+TRAINING_POINTS_PER_LIST = 64
+"""The size of the sample the centroids are trained on, per list."""
+
+RETRAIN_GROWTH = 4
+"""The centroids are trained again once the gallery has grown by this factor
+since they were trained."""
+
+ASSIGN_BATCH_SIZE = 16384
+
+
+@dataclass
+class IvfIndex:
+    """An inverted file index of the rows of a gallery matrix."""
+
+    centroids: Any
+    """The centroid of each list (one per row)."""
+
+    assignments: Any
+    """The list of each row of the gallery matrix."""
+
+    trained_faces: int
+    """The number of faces of the gallery the centroids were trained on."""
+
+    generation: str = ""
+    """The generation of the gallery index the rows belong to."""
+
+    order: Any = field(init=False, repr=False)
+    """The rows of the gallery matrix ordered by list."""
+
+    list_offsets: Any = field(init=False, repr=False)
+    """The first entry of each list in `order` (`lists + 1` values)."""
+
+    def __post_init__(self) -> None:
+        import numpy as np
+
+        self.order = np.argsort(self.assignments, kind="stable")
+        self.list_offsets = np.zeros(self.lists + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(self.assignments, minlength=self.lists),
+            out=self.list_offsets[1:],
+        )
+
+    @property
+    def lists(self) -> int:
+        """The number of lists."""
+        return len(self.centroids)
+
+
+def list_count(faces: int) -> int:
+    """Returns the number of lists used for a gallery (the square root of the
+    number of faces, so that the lists and their centroids are searched in
+    about the same time).
+
+    :param faces: The number of faces of the gallery.
+    """
+    return max(1, int(round(math.sqrt(faces))))
+
+
+def assign(centroids: Any, encodings: Any) -> Any:
+    """Finds the closest centroid of face encodings.
+
+    :param centroids: The centroids (one per row).
+
+    :param encodings: The face encodings (one per row). Processed in batches,
+        so the encodings may be memory-mapped.
+
+    :return: The row of the closest centroid for each encoding.
+    """
+    import numpy as np
+
+    labels = np.empty(len(encodings), dtype=np.int32)
+    # |a - c|^2 = |a|^2 + |c|^2 - 2ac, where |a|^2 does not change the order
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    for start in range(0, len(encodings), ASSIGN_BATCH_SIZE):
+        batch = np.asarray(
+            encodings[start : start + ASSIGN_BATCH_SIZE], dtype=centroids.dtype
+        )
+        squared = batch @ (-2.0 * centroids.T)
+        squared += centroid_norms[np.newaxis, :]
+        labels[start : start + len(batch)] = squared.argmin(axis=1)
+    return labels
+
+
+def kmeans(
+    points: Any,
+    clusters: int,
+    iterations: int = KMEANS_ITERATIONS,
+    seed: int = 0,
+) -> Any:
+    """Clusters points with Lloyd's algorithm.
+
+    :param points: The points (one per row).
+
+    :param clusters: The number of clusters (at most the number of points).
+
+    :param iterations: The number of refinement iterations.
+
+    :param seed: The seed of the random initialisation.
+
+    :return: The cluster centroids (one per row).
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    centroids = points[
+        np.sort(rng.choice(len(points), clusters, replace=False))
+    ].copy()
+    for _ in range(iterations):
+        labels = assign(centroids, points)
+        counts = np.bincount(labels, minlength=clusters)
+        order = np.argsort(labels, kind="stable")
+        filled = np.flatnonzero(counts)
+        starts = np.searchsorted(labels[order], filled)
+        sums = np.add.reduceat(points[order], starts, axis=0)
+        centroids[filled] = sums / counts[filled, np.newaxis]
+        # Clusters without points are started again at random points
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = points[
+                rng.choice(len(points), len(empty), replace=False)
+            ]
+    return centroids
+
+
+def build_ivf_index(encodings: Any, seed: int = 0) -> IvfIndex:
+    """Trains the centroids on a sample of a gallery matrix and assigns all
+    rows to their lists.
+
+    :param encodings: The gallery matrix (may be memory-mapped).
+
+    :param seed: The seed of the random sample.
+
+    :return: The new index (not stored yet).
+    """
+    import numpy as np
+
+    faces = len(encodings)
+    lists = list_count(faces)
+    if faces == 0:
+        centroids = np.zeros(
+            (lists, storage.ENCODING_DIMENSION), dtype=np.float32
+        )
+        return IvfIndex(centroids, np.empty(0, dtype=np.int32), 0)
+
+    rng = np.random.default_rng(seed)
+    sample_size = min(faces, lists * TRAINING_POINTS_PER_LIST)
+    sample = np.asarray(
+        encodings[np.sort(rng.choice(faces, sample_size, replace=False))],
+        dtype=np.float32,
+    )
+    centroids = kmeans(sample, min(lists, len(sample)), seed=seed)
+    return IvfIndex(centroids, assign(centroids, encodings), faces)
+
+
+def update_ivf_index(
+    index: IvfIndex, encodings: Any, previous_rows: Any
+) -> IvfIndex:
+    """Maps an index to an updated gallery matrix, adding the new rows to the
+    lists of their closest centroids.
+
+    :param index: The index of the previous gallery matrix.
+
+    :param encodings: The updated gallery matrix.
+
+    :param previous_rows: The row of the previous gallery matrix each row of
+        `encodings` was taken from (`-1` for new rows).
+
+    :return: The index of the updated gallery matrix (not stored yet).
+    """
+    import numpy as np
+
+    assignments = np.empty(len(previous_rows), dtype=np.int32)
+    taken = previous_rows >= 0
+    assignments[taken] = index.assignments[previous_rows[taken]]
+    new_rows = np.flatnonzero(~taken)
+    if len(new_rows):
+        assignments[new_rows] = assign(index.centroids, encodings[new_rows])
+    return IvfIndex(index.centroids, assignments, index.trained_faces)
+
+
+def needs_training(index: IvfIndex, faces: int) -> bool:
+    """Returns whether the centroids of an index should be trained again.
+
+    :param index: The index.
+
+    :param faces: The current number of faces of the gallery.
+    """
+    return faces > RETRAIN_GROWTH * index.trained_faces
+
+
+def probe(index: IvfIndex, query: Any, nprobe: int) -> Any:
+    """Finds the candidate rows of a search.
+
+    :param index: The index.
+
+    :param query: The encodings of the faces to search for (one per row).
+
+    :param nprobe: The number of lists searched for each face.
+
+    :return: The rows of the gallery matrix in the closest lists of any of
+        the faces (sorted).
+    """
+    import numpy as np
+
+    nprobe = min(nprobe, index.lists)
+    query = np.asarray(query, dtype=index.centroids.dtype)
+    squared = query @ (-2.0 * index.centroids.T)
+    squared += np.einsum("ij,ij->i", index.centroids, index.centroids)
+    probed = np.unique(
+        np.argpartition(squared, nprobe - 1, axis=1)[:, :nprobe]
+    )
+    rows = np.concatenate(
+        [
+            index.order[index.list_offsets[i] : index.list_offsets[i + 1]]
+            for i in probed
+        ]
+    )
+    # Reading the gallery matrix in order
+    rows.sort()
+    return rows
+
+
+def ivf_index_path(root_dir: str) -> str:
+    """Returns the path of the stored index of a gallery.
+
+    :param root_dir: The root directory containing the cache.
+    """
+    return os.path.join(root_dir, GALLERY_INDEX_DIR_NAME, "ivf.npz")
+
+
+def has_ivf_index(root_dir: str) -> bool:
+    """Returns whether an index was stored for a gallery.
+
+    :param root_dir: The root directory containing the cache.
+    """
+    return os.path.exists(ivf_index_path(root_dir))
+
+
+def save_ivf_index(root_dir: str, index: IvfIndex) -> None:
+    """Stores an index next to the gallery index.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param index: The index to be stored.
+    """
+    import numpy as np
+
+    path = ivf_index_path(root_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        np.savez(
+            f,
+            version=np.array(IVF_INDEX_VERSION),
+            centroids=index.centroids,
+            assignments=index.assignments,
+            trained_faces=np.array(index.trained_faces),
+            generation=np.array(index.generation),
+        )
+    os.replace(path + ".tmp", path)
+
+
+def read_ivf_index(root_dir: str) -> IvfIndex | None:
+    """Reads the stored index of a gallery.
+
+    :param root_dir: The root directory containing the cache.
+
+    :return: The index or `None` if none exists or it is unreadable.
+    """
+    import numpy as np
+
+    try:
+        with np.load(ivf_index_path(root_dir), allow_pickle=False) as data:
+            if int(data["version"]) != IVF_INDEX_VERSION:
+                return None
+            return IvfIndex(
+                data["centroids"],
+                data["assignments"],
+                int(data["trained_faces"]),
+                generation=str(data["generation"]),
+            )
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
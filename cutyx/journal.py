@@ -0,0 +1,191 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""The decision journal.
+
+The journal remembers which albums an image was classified into. A decision is
+keyed by the content hash and the file name of the image (the name rules only
+depend on the file name, the face rules only on the content) and is valid as
+long as the rules of the album did not change. This allows a run to evaluate
+only new or modified images and albums with changed rules.
+
+To keep the journal small, every image refers to a *generation*, the rule-set
+versions (album index signatures) of all albums it was evaluated against.
+"""
+
+import json
+import os
+import os.path
+from typing import Any
+
+from cutyx.constants import JOURNAL_FILE_NAME
+
+JOURNAL_VERSION = 1
+
+
+class DecisionJournal:
+    """Persistent classification decisions of images."""
+
+    def __init__(self, path: str | None, cache_config: dict[str, Any]) -> None:
+        """
+        :param path: The file the journal is stored in. The journal is not
+            persisted if `None`.
+
+        :param cache_config: The configuration of the cache the decisions are
+            based on. Decisions made with a different configuration are discarded.
+        """
+        self.path = path
+        self.cache_config = cache_config
+        self.generations: dict[str, dict[str, str]] = {}
+        self.images: dict[str, list[Any]] = {}
+        self.seen: set[str] = set()
+        self.modified = False
+        self._generation_ids: dict[str, str] = {}
+
+    @classmethod
+    def load(
+        cls, root_dir: str, cache_config: dict[str, Any]
+    ) -> "DecisionJournal":
+        """Loads the decision journal of a cache.
+
+        :param root_dir: The root directory containing the cache.
+
+        :param cache_config: The current configuration of the cache.
+
+        :return: The loaded journal (empty if none was stored yet or it
+            is outdated).
+        """
+        journal = cls(
+            os.path.join(os.path.abspath(root_dir), JOURNAL_FILE_NAME),
+            cache_config,
+        )
+        try:
+            assert journal.path is not None
+            with open(journal.path, "r") as f:
+                data = json.loads(f.read())
+            if (
+                data.get("version") == JOURNAL_VERSION
+                and data.get("cache_config") == cache_config
+            ):
+                journal.generations = data["generations"]
+                journal.images = data["images"]
+                for generation_id, signatures in journal.generations.items():
+                    key = json.dumps(signatures, sort_keys=True)
+                    journal._generation_ids[key] = generation_id
+        except (FileNotFoundError, ValueError, KeyError, AttributeError):
+            pass
+        return journal
+
+    @staticmethod
+    def image_key(image_hash: str, image_path: str) -> str:
+        """Returns the key of an image in the journal.
+
+        :param image_hash: The content hash of the image.
+
+        :param image_path: The path of the image.
+        """
+        return image_hash + "/" + os.path.basename(image_path)
+
+    def lookup(
+        self, key: str, signatures: dict[str, str]
+    ) -> tuple[dict[str, tuple[str, str]], list[str]]:
+        """Looks up the decisions for an image.
+
+        :param key: The key of the image (see `image_key`).
+
+        :param signatures: The current rule-set signature of every album.
+
+        :return: The still valid matches (album directory to rule type and
+            description) and the albums which have to be evaluated again.
+        """
+        self.seen.add(key)
+        record = self.images.get(key)
+        if record is None:
+            return {}, list(signatures)
+        generation_id, matches = record
+        evaluated = self.generations.get(generation_id, {})
+        stale = [
+            album_dir
+            for album_dir, signature in signatures.items()
+            if evaluated.get(album_dir) != signature
+        ]
+        known = {
+            album_dir: (match[0], match[1])
+            for album_dir, match in matches.items()
+            if album_dir in signatures and album_dir not in stale
+        }
+        return known, stale
+
+    def record(
+        self,
+        key: str,
+        signatures: dict[str, str],
+        matches: dict[str, tuple[str, str]],
+    ) -> None:
+        """Records the decisions for an image evaluated against all albums.
+
+        :param key: The key of the image (see `image_key`).
+
+        :param signatures: The current rule-set signature of every album.
+
+        :param matches: The matching albums (album directory to rule type and
+            description).
+        """
+        generation_key = json.dumps(signatures, sort_keys=True)
+        generation_id = self._generation_ids.get(generation_key)
+        if generation_id is None:
+            generation_id = str(
+                max((int(g) for g in self.generations), default=0) + 1
+            )
+            self.generations[generation_id] = dict(signatures)
+            self._generation_ids[generation_key] = generation_id
+        self.images[key] = [
+            generation_id,
+            {album_dir: list(match) for album_dir, match in matches.items()},
+        ]
+        self.seen.add(key)
+        self.modified = True
+
+    def prune(self) -> None:
+        """Removes the decisions of all images not looked up since loading."""
+        for key in set(self.images) - self.seen:
+            del self.images[key]
+            self.modified = True
+
+    def save(self) -> None:
+        """Stores the journal if it was modified."""
+        if not self.modified or self.path is None:
+            return
+        used = {record[0] for record in self.images.values()}
+        generations = {
+            generation_id: signatures
+            for generation_id, signatures in self.generations.items()
+            if generation_id in used
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "version": JOURNAL_VERSION,
+                        "cache_config": self.cache_config,
+                        "generations": generations,
+                        "images": self.images,
+                    }
+                )
+            )
+        os.replace(self.path + ".tmp", self.path)
+        self.modified = False
@@ -18,25 +18,49 @@ import json
 import os
 import os.path
 import pathlib
-import pickle
 import re
 import shutil
-from typing import Any, Callable
+from dataclasses import dataclass, field
+from typing import Any
 
 from rich import print
-from thefuzz import fuzz  # type: ignore
 
-from cutyx.exceptions import FacesException
-from cutyx.utils import copyfile, mksymlink
-
-FACES_DIR_NAME = ".cutyx-faces.d"
-CACHE_BASE_NAME = ".cutyx-cache.d"
-FACES_CACHE_DIR_NAME = os.path.join(CACHE_BASE_NAME, "faces")
-TRAINING_IMAGE_FILE_PART = ".trainingimage"
-TRAINING_IMAGE_DIR_EXT = TRAINING_IMAGE_FILE_PART + ".d"
-TRAINING_IMAGE_SRC_EXT = TRAINING_IMAGE_FILE_PART + ".src"
-
-NAMES_FILE_EXT = ".names"
+from cutyx import (
+    albums,
+    backends,
+    cache,
+    faces,
+    ivf,
+    pipeline,
+    scanner,
+    search,
+    storage,
+)
+from cutyx.constants import (
+    CACHE_BASE_NAME,
+    FACES_DIR_NAME,
+    NAMES_FILE_EXT,
+    TRAINING_BACKEND_FILE_NAME,
+    TRAINING_ENCODINGS_FILE_NAME,
+    TRAINING_IMAGE_DIR_EXT,
+    TRAINING_IMAGE_SRC_EXT,
+)
+from cutyx.exceptions import FacesException, NoMatchesException
+from cutyx.faces import DetectionOptions
+from cutyx.fingerprints import FingerprintIndex, hash_file
+from cutyx.journal import DecisionJournal
+from cutyx.names import NameMatcher
+from cutyx.scanner import GallerySnapshot
+from cutyx.utils import (
+    LINK_MODES,
+    clonefile,
+    copyfile,
+    mkhardlink,
+    mksymlink,
+)
+
+FACE_BATCH_SIZE = 16
+"""Maximum number of images encoded by a single call of the face backend."""
 
 
 def is_included(
@@ -67,10 +91,36 @@ def is_included(
         return True
 
 
+def basename_index(
+    only_process_files: set[str] | None = None,
+) -> frozenset[str] | None:
+    """Returns the base names of the only process files, to check many paths
+    with `is_included_name` in constant time each.
+
+    :param only_process_files: The include file list. If `None`, all files are
+        included.
+
+    :return: The set of base names or `None` if all files are included.
+    """
+    if not only_process_files:
+        return None
+    return frozenset(os.path.basename(file) for file in only_process_files)
+
+
+def is_included_name(path: str, included: frozenset[str] | None) -> bool:
+    """Checks like `is_included` whether a path is included, using the base
+    names returned by `basename_index`."""
+    return included is None or os.path.basename(path) in included
+
+
 def update_cache(
     root_dir: str = ".",
     only_process_files: set[str] | None = None,
     quiet: bool = False,
+    fingerprints: FingerprintIndex | None = None,
+    jobs: int = 1,
+    detection: DetectionOptions | None = None,
+    snapshot: GallerySnapshot | None = None,
 ) -> None:
     """Updates the cache.
 
@@ -81,6 +131,17 @@ def update_cache(
     will be classified.
 
     :param quiet: Whether additional verbose output should be generated.
+
+    :param fingerprints: The fingerprint index of the cache. Loaded from the cache
+        directory (and stored afterwards) if `None`.
+
+    :param jobs: The number of worker processes calculating face encodings.
+        The results are written to the cache by this process only.
+
+    :param detection: The face detection options. The options are stored in the
+        cache; if `None`, the options stored in the cache are used.
+
+    :param snapshot: The scanned images of `root_dir`. Scanned if `None`.
     """
     # Checks for correct parameters
     root_dir = os.path.abspath(root_dir)
@@ -93,50 +154,80 @@ def update_cache(
     if not quiet:
         print("[green]++ Update cache ++[/green]")
 
-    image_files_root = find_image_files(root_dir, for_albums=False)
-    for image in image_files_root:
-        # Only process files which are not excluded
-        if not is_included(image, only_process_files):
-            continue
+    detection = resolve_detection_options(root_dir, detection)
+    cache.ensure_cache_config(
+        root_dir,
+        detection=detection.as_dict(),
+        backend=get_face_backend(detection).identity,
+    )
+    save_fingerprints = fingerprints is None
+    if fingerprints is None:
+        fingerprints = FingerprintIndex.load(root_dir)
+
+    # Hash the images, calculate the face encodings of the images which are not
+    # cached yet and write them to the cache in an overlapping pipeline
+    if snapshot is None:
+        snapshot = scanner.scan(root_dir)
+    included = basename_index(only_process_files)
+    images = [
+        image for image in snapshot.images if is_included_name(image, included)
+    ]
+    try:
+        pipeline.EncodingPipeline(
+            root_dir,
+            fingerprints,
+            encode_images,
+            detection,
+            jobs=jobs,
+            batch_size=min(FACE_BATCH_SIZE, -(-len(images) // max(1, jobs))),
+            quiet=quiet,
+        ).run(images)
+    finally:
+        # The entries written to a cache database are committed in batches
+        cache.flush(root_dir)
+
+    # Once the approximate index of the gallery exists, it is kept up to date
+    # (see `search_images`). The gallery index can only be updated with all
+    # images of the gallery, not with a selection of changed images.
+    if (
+        snapshot.complete
+        and only_process_files is None
+        and ivf.has_ivf_index(root_dir)
+    ):
+        update_gallery_index(root_dir, images, fingerprints, quiet=quiet)
 
-        # Generate an MD5 hash, as this is used for the cache file name
-        with open(image, "rb") as f:
-            image_hash = hashlib.md5(f.read()).hexdigest()
+    if save_fingerprints:
+        fingerprints.save()
 
-        encodings_dir = os.path.join(
-            root_dir, FACES_CACHE_DIR_NAME, image_hash
-        )
-        # Only re-calculates the encodings for images which were not classified
-        # in an earlier run.
-        if not os.path.exists(encodings_dir):
-            pathlib.Path(encodings_dir).mkdir(parents=True, exist_ok=True)
-            if not quiet:
-                print(
-                    f"  [blue]++ Calculating image '{os.path.basename(image)}'"
-                    " face encodings ++[/blue]"
-                )
 
-            # Calculate the face encodings
-            encodings_data = get_face_encodings(image, quiet=quiet)
+def update_gallery_index(
+    root_dir: str,
+    images: list[str],
+    fingerprints: FingerprintIndex,
+    quiet: bool = False,
+) -> search.GalleryIndex:
+    """Updates the gallery index with the cached encodings of images.
 
-            # Serialise the face encodings
-            for idx, encoding in enumerate(encodings_data):
-                if not quiet:
-                    print(
-                        f"    [blue]++ Writing image '{os.path.basename(image)}'"
-                        f" face encoding {idx + 1}/{len(encodings_data)} ++[/blue]"
-                    )
-                serialized_as_json = json.dumps(
-                    pickle.dumps(encoding).decode("latin-1")
-                )
-                # Store the individual encoding in a filename that is the MD5 hash of the
-                # encoding itself.
-                md5 = str(
-                    hashlib.md5(serialized_as_json.encode("utf-8")).hexdigest()
-                )
-                output_file = os.path.join(encodings_dir, md5 + ".encoding")
-                with open(output_file, "w") as f:
-                    f.write(serialized_as_json)
+    :param root_dir: The root path containing the cache.
+
+    :param images: All images of the gallery.
+
+    :param fingerprints: The fingerprint index of the cache.
+
+    :param quiet: Whether additional verbose output should be generated.
+
+    :return: The up-to-date gallery index.
+    """
+    if not quiet:
+        print("[green]++ Update gallery index ++[/green]")
+    hashes: list[tuple[str, str]] = []
+    for image in images:
+        try:
+            hashes.append((image, fingerprints.hash(image)))
+        except OSError:
+            # Removed in the meantime
+            pass
+    return search.update_gallery_index(root_dir, hashes)
 
 
 def clear_cache(root_dir: str = ".", quiet: bool = False) -> None:
@@ -152,6 +243,7 @@ def clear_cache(root_dir: str = ".", quiet: bool = False) -> None:
         raise FacesException(f"Root directory ({root_dir}) does not exist.")
     if not os.path.isdir(root_dir):
         raise FacesException(f"Path ({root_dir}) is not a directory.")
+    cache.close_database(root_dir)
     try:
         # Remove the cache directory recursively if it exists
         shutil.rmtree(os.path.join(root_dir, CACHE_BASE_NAME))
@@ -162,11 +254,175 @@ def clear_cache(root_dir: str = ".", quiet: bool = False) -> None:
             print(f"[red]++ No previous cache found ({root_dir}) ++[/red]")
 
 
+_SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(size: str) -> int:
+    """Parses a size in bytes with an optional unit (e.g. `500M` or `2GiB`).
+
+    :param size: The size (units are powers of 1024).
+
+    :return: The size in bytes.
+    """
+    match = re.fullmatch(
+        r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*", size, re.IGNORECASE
+    )
+    if match is None:
+        raise FacesException(
+            f"Invalid size '{size}' (e.g. 1048576, 500M or 2G)."
+        )
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def format_size(size: int) -> str:
+    """Formats a size in bytes for humans."""
+    if size < 1024:
+        return f"{size} B"
+    value = size / 1024
+    for unit in ("KiB", "MiB", "GiB"):
+        if value < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} TiB"
+
+
+def collect_cache_garbage(
+    root_dir: str = ".",
+    max_size: int | None = None,
+    max_age: float | None = None,
+    keep_orphans: bool = False,
+    dry_run: bool = False,
+    quiet: bool = False,
+    fingerprints: FingerprintIndex | None = None,
+    snapshot: GallerySnapshot | None = None,
+) -> cache.GarbageReport:
+    """Removes the cache entries of images which are not part of the gallery
+    anymore and evicts the least recently used entries.
+
+    :param root_dir: The root path containing the images and the cache.
+
+    :param max_size: The maximum size of the cache in bytes.
+
+    :param max_age: The maximum time in seconds since a cache entry was last
+        used.
+
+    :param keep_orphans: Whether to keep the entries of images not found in the
+        gallery.
+
+    :param dry_run: Whether to only print the entries which would be removed.
+
+    :param quiet: Whether additional verbose output should be generated.
+
+    :param fingerprints: The fingerprint index of the cache (loaded if `None`).
+        It is not stored by this function if given.
+
+    :param snapshot: The images of the gallery. If `None`, `root_dir` is scanned
+        for images.
+
+    :return: The removed and the remaining cache entries.
+    """
+    if not quiet:
+        handle_dry_run(dry_run)
+    root_dir = os.path.abspath(root_dir)
+    if not os.path.isdir(root_dir):
+        raise FacesException(f"Root directory ({root_dir}) does not exist.")
+    if max_size is not None and max_size < 0:
+        raise FacesException("The maximum cache size must not be negative.")
+    if max_age is not None and max_age < 0:
+        raise FacesException("The maximum cache age must not be negative.")
+    if not quiet:
+        print("[green]++ Collect cache garbage ++[/green]")
+
+    live_hashes: set[str] | None = None
+    if not keep_orphans:
+        save_fingerprints = fingerprints is None
+        if fingerprints is None:
+            fingerprints = FingerprintIndex.load(root_dir)
+        if snapshot is None:
+            snapshot = scanner.scan(root_dir)
+        # Only new or modified images are read to find their content hash
+        live_hashes = set()
+        for image in snapshot.images:
+            try:
+                live_hashes.add(fingerprints.hash(image))
+            except OSError:
+                # Removed in the meantime
+                pass
+        fingerprints.prune(snapshot.images)
+        if save_fingerprints and not dry_run:
+            fingerprints.save()
+
+    report = cache.collect_garbage(
+        root_dir,
+        live_hashes=live_hashes,
+        max_size=max_size,
+        max_age=max_age,
+        dry_run=dry_run,
+    )
+    if not quiet:
+        for entry in report.removed:
+            name = (
+                os.path.basename(entry.path)
+                if entry.path is not None
+                else entry.image_hash
+            )
+            print(f"  [blue]++ Remove cache entry '{name}' ++[/blue]")
+        print(
+            f"[green]++ Removed {len(report.removed)} cache entries"
+            f" ({format_size(report.removed_size)}), kept {report.kept}"
+            f" ({format_size(report.kept_size)}) ++[/green]"
+        )
+    return report
+
+
+def convert_cache(
+    root_dir: str = ".", store: str = "sqlite", quiet: bool = False
+) -> None:
+    """Moves the cache entries and the fingerprint index to another store.
+
+    :param root_dir: The root path containing the cache.
+
+    :param store: The new store (`files` or `sqlite`, see `cache.CACHE_STORES`).
+
+    :param quiet: Whether additional verbose output should be generated.
+    """
+    root_dir = os.path.abspath(root_dir)
+    if not os.path.isdir(root_dir):
+        raise FacesException(f"Root directory ({root_dir}) does not exist.")
+    if store not in cache.CACHE_STORES:
+        raise FacesException(
+            f"Invalid cache store '{store}' (valid stores: "
+            f"{', '.join(cache.CACHE_STORES)})."
+        )
+    if cache.cache_store(root_dir) == store:
+        if not quiet:
+            print(f"[green]++ Cache already uses the {store} store ++[/green]")
+        return
+
+    fingerprints = FingerprintIndex.load(root_dir)
+    count = cache.convert_cache(root_dir, store)
+    converted = FingerprintIndex.load(root_dir)
+    converted.entries = fingerprints.entries
+    converted.modified = True
+    converted.save()
+    if fingerprints.path is not None:
+        try:
+            os.remove(fingerprints.path)
+        except FileNotFoundError:
+            pass
+    if not quiet:
+        print(
+            f"[green]++ Moved {count} cache entries to the {store} store"
+            " ++[/green]"
+        )
+
+
 def handle_delete_old(
     albums_root_dir: str,
     only_process_files: set[str] | None = None,
     quiet: bool = False,
     dry_run: bool = False,
+    albums_snapshot: GallerySnapshot | None = None,
 ) -> None:
     """Internal function to handle the deletion of old files in albums.
 
@@ -179,18 +435,23 @@ def handle_delete_old(
     :param quiet: Whether additional verbose output should be generated.
 
     :param dry_run: Whether to only print the actions which would be executed.
+
+    :param albums_snapshot: The scanned albums of `albums_root_dir`. Scanned if `None`.
     """
     if not quiet:
         print("[green]++ Check for old files to remove ++[/green]")
 
     # Find all directories which are configured to be used with `CutyX`
-    album_dirs = find_album_dirs(albums_root_dir)
+    if albums_snapshot is None:
+        albums_snapshot = scanner.scan(albums_root_dir)
+    album_dirs = albums_snapshot.album_dirs
 
     if only_process_files:
         # Do a matching on the base name to check, whether the file should be removed
-        image_files_albums = find_image_files(albums_root_dir, for_albums=True)
+        image_files_albums = albums_snapshot.album_images
+        included = basename_index(only_process_files)
         for image_album_file in image_files_albums:
-            if is_included(image_album_file, only_process_files):
+            if is_included_name(image_album_file, included):
                 if not os.path.isdir(image_album_file):
                     if not quiet:
                         print(
@@ -219,6 +480,139 @@ def handle_delete_old(
                         os.remove(file_to_remove)
 
 
+@dataclass
+class SyncReport:
+    """The changes done to the albums by a synchronisation."""
+
+    added: list[str] = field(default_factory=list)
+    """The images added to an album."""
+
+    updated: list[str] = field(default_factory=list)
+    """The album images replaced, as the source image or link mode changed."""
+
+    removed: list[str] = field(default_factory=list)
+    """The images removed from an album."""
+
+    unchanged: int = 0
+    """The number of album images which were already up to date."""
+
+
+def is_album_image_up_to_date(
+    image_path: str, target: str, link_mode: str = "copy"
+) -> bool:
+    """Checks whether an image in an album directory matches its source image.
+
+    :param image_path: The source image.
+
+    :param target: The image in the album directory.
+
+    :param link_mode: How the image is added to the album (see `get_link_mode`).
+
+    :return: `True` if the album image does not have to be written again.
+    """
+    if link_mode == "symlink":
+        return os.path.islink(target) and os.readlink(
+            target
+        ) == os.path.relpath(image_path, os.path.dirname(target))
+    if os.path.islink(target):
+        return False
+    try:
+        target_stat = os.stat(target)
+        image_stat = os.stat(image_path)
+    except FileNotFoundError:
+        return False
+    if (target_stat.st_dev, target_stat.st_ino) == (
+        image_stat.st_dev,
+        image_stat.st_ino,
+    ):
+        return link_mode == "hardlink"
+    # Copies and clones keep the modification time of the source image.
+    # Hardlinks fall back to clones if the album is on another file system.
+    return (
+        target_stat.st_size == image_stat.st_size
+        and target_stat.st_mtime_ns == image_stat.st_mtime_ns
+    )
+
+
+def handle_sync(
+    album_contents: dict[str, dict[str, str]],
+    only_process_files: set[str] | None = None,
+    link_mode: str = "copy",
+    quiet: bool = False,
+    dry_run: bool = False,
+) -> SyncReport:
+    """Internal function to bring the album directories to the desired state.
+
+    Only the differences between the desired contents and the album directories
+    are written: missing or outdated images are added and images which do not
+    belong to an album anymore are removed.
+
+    :param album_contents: The desired contents of all albums (album directory
+        to file name to source image).
+
+    :param only_process_files: A set of image paths which were processed. If given,
+        only album images with the same file names are considered for removal.
+
+    :param link_mode: How images are added to the albums (see `get_link_mode`).
+
+    :param quiet: Whether additional verbose output should be generated.
+
+    :param dry_run: Whether to only print the actions which would be executed.
+
+    :return: The changes done to the albums.
+    """
+    if not quiet:
+        print("[green]++ Synchronise albums ++[/green]")
+
+    report = SyncReport()
+    included = basename_index(only_process_files)
+    for album_dir, contents in album_contents.items():
+        existing = {
+            entry.name
+            for entry in os.scandir(album_dir)
+            if not entry.name.startswith(".") and not entry.is_dir()
+        }
+
+        # Remove images which do not belong to the album anymore
+        for name in sorted(existing - contents.keys()):
+            if not is_included_name(name, included):
+                continue
+            if not quiet:
+                print(
+                    "  [blue]++ Remove previously classified image "
+                    f"'{name}' ({os.path.basename(album_dir)}) ++[/blue]"
+                )
+            report.removed.append(os.path.join(album_dir, name))
+            if not dry_run:
+                os.remove(os.path.join(album_dir, name))
+
+        # Add missing images and replace outdated ones
+        for name, image_path in contents.items():
+            target = os.path.join(album_dir, name)
+            if name in existing:
+                if is_album_image_up_to_date(image_path, target, link_mode):
+                    report.unchanged += 1
+                    continue
+                report.updated.append(target)
+            else:
+                report.added.append(target)
+            materialize_image(
+                image_path,
+                album_dir,
+                link_mode=link_mode,
+                quiet=quiet,
+                dry_run=dry_run,
+            )
+
+    if not quiet:
+        print(
+            f"[green]++ Synchronised albums: {len(report.added)} added, "
+            f"{len(report.updated)} updated, {len(report.removed)} removed, "
+            f"{report.unchanged} unchanged ++[/green]"
+        )
+    return report
+
+
 def process_directory(
     root_dir: str = ".",
     albums_root_dir: str = ".",
@@ -228,7 +622,15 @@ def process_directory(
     use_cache: bool = True,
     quiet: bool = False,
     only_process_files: set[str] | None = None,
-) -> None:
+    jobs: int = 1,
+    detection: DetectionOptions | None = None,
+    sync: bool = False,
+    link_mode: str | None = None,
+    snapshot: GallerySnapshot | None = None,
+    gc: bool = False,
+    cache_max_size: int | None = None,
+    cache_max_age: float | None = None,
+) -> SyncReport | None:
     """The main logic of **CutyX**.
 
     This function will process the files, classify them, and write the results to the
@@ -253,40 +655,172 @@ def process_directory(
 
     :param only_process_files: A set of image paths to be processed. If `None`, all found images
     will be considered for processing.
+
+    :param jobs: The number of worker processes used to update the cache.
+
+    :param detection: The face detection options (see `update_cache`).
+
+    :param sync: Whether to only write the differences between the classification
+        and the album directories instead of recreating the albums. Implies
+        `delete_old`.
+
+    :param link_mode: How images are added to the albums (see `get_link_mode`).
+        Overrides `symlink` if given.
+
+    :param snapshot: The images to be processed. If `None`, `root_dir` is scanned
+        for images.
+
+    :param gc: Whether to remove unused cache entries after the run (see
+        `collect_cache_garbage`).
+
+    :param cache_max_size: The maximum size of the cache in bytes if `gc` is
+        used.
+
+    :param cache_max_age: The maximum time in seconds since a cache entry was
+        last used if `gc` is used.
+
+    :return: The changes done to the albums if `sync` is used, `None` otherwise.
     """
     handle_dry_run(dry_run)
+    link_mode = get_link_mode(symlink, link_mode)
 
     # Check only-process files for validity
     if only_process_files:
-        only_process_files = {os.path.abspath(f) for f in only_process_files}
-        for f in only_process_files:
-            check_valid_image(f)
+        only_process_files = check_valid_images(only_process_files)
+
+    root_dir = os.path.abspath(root_dir)
+
+    # The directory hierarchies are only scanned once and shared by all stages
+    snapshot, albums_snapshot = scan_directories(
+        root_dir, albums_root_dir, snapshot
+    )
+
+    # The fingerprint index is shared by all stages and stored once at the end
+    fingerprints: FingerprintIndex | None = None
+    if use_cache:
+        fingerprints = FingerprintIndex.load(root_dir)
 
     # Update the cache if the cache should be used
     if not dry_run and use_cache:
-        update_cache(root_dir, only_process_files=only_process_files)
+        update_cache(
+            root_dir,
+            only_process_files=only_process_files,
+            quiet=quiet,
+            fingerprints=fingerprints,
+            jobs=jobs,
+            detection=detection,
+            snapshot=snapshot,
+        )
 
-    root_dir = os.path.abspath(root_dir)
+    # The cached encodings are compared with the backend of the cache
+    if use_cache:
+        detection = resolve_detection_options(root_dir, detection)
 
     # Handle deletion of old files
-    if delete_old:
+    if delete_old and not sync:
         handle_delete_old(
             albums_root_dir,
             only_process_files=only_process_files,
             quiet=quiet,
             dry_run=dry_run,
+            albums_snapshot=albums_snapshot,
+        )
+
+    # Decisions of earlier runs are only valid for the same cache configuration
+    journal: DecisionJournal | None = None
+    if use_cache:
+        journal = DecisionJournal.load(
+            root_dir, cache.read_cache_config(root_dir)
         )
 
     # Run the actual processing
-    handle_process_files(
-        root_dir,
-        albums_root_dir,
-        only_process_files=only_process_files,
-        quiet=quiet,
-        use_cache=use_cache,
-        symlink=symlink,
-        dry_run=dry_run,
-    )
+    album_contents: dict[str, dict[str, str]] | None = {} if sync else None
+    try:
+        handle_process_files(
+            root_dir,
+            albums_root_dir,
+            only_process_files=only_process_files,
+            quiet=quiet,
+            use_cache=use_cache,
+            symlink=symlink,
+            dry_run=dry_run,
+            fingerprints=fingerprints,
+            link_mode=link_mode,
+            detection=detection,
+            journal=journal,
+            album_contents=album_contents,
+            snapshot=snapshot,
+            albums_snapshot=albums_snapshot,
+        )
+    except NoMatchesException:
+        # The albums are synchronised anyway, so that images which do not
+        # match anymore are removed
+        if album_contents is not None:
+            handle_sync(
+                album_contents,
+                only_process_files=only_process_files,
+                link_mode=link_mode,
+                quiet=quiet,
+                dry_run=dry_run,
+            )
+        raise
+
+    report: SyncReport | None = None
+    if album_contents is not None:
+        report = handle_sync(
+            album_contents,
+            only_process_files=only_process_files,
+            link_mode=link_mode,
+            quiet=quiet,
+            dry_run=dry_run,
+        )
+
+    # The entries of images outside of the processed set are only orphaned if
+    # the whole gallery was processed
+    if gc and use_cache and not dry_run:
+        collect_cache_garbage(
+            root_dir,
+            max_size=cache_max_size,
+            max_age=cache_max_age,
+            keep_orphans=bool(only_process_files),
+            quiet=quiet,
+            fingerprints=fingerprints,
+            snapshot=snapshot,
+        )
+
+    if fingerprints is not None and not dry_run:
+        fingerprints.save()
+    if use_cache:
+        cache.flush(root_dir)
+    if journal is not None and not dry_run:
+        # Forget images which do not exist anymore after a full run
+        if not only_process_files:
+            journal.prune()
+        journal.save()
+
+    return report
+
+
+def scan_directories(
+    root_dir: str,
+    albums_root_dir: str,
+    snapshot: GallerySnapshot | None = None,
+) -> tuple[GallerySnapshot, GallerySnapshot]:
+    """Scans the images and the albums, scanning a shared root directory once.
+
+    :param root_dir: The root path containing the images.
+
+    :param albums_root_dir: The root path containing the albums.
+
+    :param snapshot: The scanned images of `root_dir`. Scanned if `None`.
+
+    :return: The scanned images and the scanned albums.
+    """
+    if snapshot is None:
+        snapshot = scanner.scan(root_dir)
+        if os.path.abspath(albums_root_dir) == root_dir:
+            return snapshot, snapshot
+    return snapshot, scanner.scan(os.path.abspath(albums_root_dir))
 
 
 def handle_process_files(
@@ -297,6 +831,13 @@ def handle_process_files(
     use_cache: bool = False,
     symlink: bool = False,
     dry_run: bool = False,
+    fingerprints: FingerprintIndex | None = None,
+    detection: DetectionOptions | None = None,
+    journal: DecisionJournal | None = None,
+    album_contents: dict[str, dict[str, str]] | None = None,
+    link_mode: str | None = None,
+    snapshot: GallerySnapshot | None = None,
+    albums_snapshot: GallerySnapshot | None = None,
 ) -> None:
     """The main processing and classification logic.
 
@@ -316,12 +857,52 @@ def handle_process_files(
 
     :param only_process_files: A set of image paths to be processed. If `None`, all found images
     will be considered for processing.
+
+    :param fingerprints: The fingerprint index of the cache, used to find the cache
+        entries of the images.
+
+    :param detection: The face detection options used if the cache is not used.
+
+    :param journal: The decision journal. If given (together with `fingerprints`),
+        images are only evaluated against albums whose rules changed since the
+        image was classified the last time.
+
+    :param album_contents: If given, the matching images are only collected in this
+        `dict` (album directory to file name to image) and not written to the albums.
+
+    :param link_mode: How images are added to the albums (see `get_link_mode`).
+        Overrides `symlink` if given.
+
+    :param snapshot: The scanned images of `root_dir`. Scanned if `None`.
+
+    :param albums_snapshot: The scanned albums of `albums_root_dir`. Scanned if `None`.
     """
     num_processed = 0
+    link_mode = get_link_mode(symlink, link_mode)
 
     # Search for all images
-    album_dirs = find_album_dirs(albums_root_dir)
-    image_files_root = find_image_files(root_dir, for_albums=False)
+    if snapshot is None:
+        snapshot = scanner.scan(root_dir)
+    if albums_snapshot is None:
+        albums_snapshot = scanner.scan(albums_root_dir)
+    album_dirs = [os.path.abspath(d) for d in albums_snapshot.album_dirs]
+    image_files_root = snapshot.images
+
+    # Load the compiled rules of all albums once and stack the face training
+    # data of all albums into a single matrix
+    album_indexes = [albums.load_album_index(d) for d in album_dirs]
+    training_data = load_training_encodings(album_indexes, detection)
+    name_matcher = NameMatcher(album_indexes)
+    name_matcher.prepare(
+        [
+            file
+            for file in image_files_root
+            if not only_process_files or file in only_process_files
+        ]
+    )
+    if album_contents is not None:
+        for album_dir in album_dirs:
+            album_contents.setdefault(album_dir, {})
 
     if not quiet:
         if not image_files_root:
@@ -329,64 +910,252 @@ def handle_process_files(
         else:
             print(f"[green]++ Found {len(image_files_root)} images ++[/green]")
 
-    # Process the albums
-    for album_dir in album_dirs:
-        if not quiet:
-            print(
-                f"[green]++ Process album directory '{os.path.basename(album_dir)} ++[/green]"
+    cache_root_dir: str | None = root_dir
+    if not use_cache:
+        cache_root_dir = None
+
+    # Process the images, each image is evaluated against all albums at once
+    for file in image_files_root:
+        if only_process_files:
+            if file not in only_process_files:
+                continue
+        if journal is not None and fingerprints is not None:
+            matched_albums = classify_image_with_journal(
+                file,
+                album_indexes,
+                journal,
+                fingerprints,
+                cache_root_dir=cache_root_dir,
+                quiet=quiet,
+                training_data=training_data,
+                detection=detection,
+                name_matcher=name_matcher,
             )
-        for file in image_files_root:
-            do_process = True
-            if only_process_files:
-                if file not in only_process_files:
-                    do_process = False
-            cache_root_dir: str | None = root_dir
-            if not use_cache:
-                cache_root_dir = None
-            if do_process and any_matches(
-                [
-                    ("name", lambda: name_matches(file, album_dir)),
-                    (
-                        "face",
-                        lambda: face_matches(
-                            file,
-                            album_dir,
-                            cache_root_dir=cache_root_dir,
-                            quiet=quiet,
-                        ),
-                    ),
-                ],
+        else:
+            matched_albums = classify_image(
+                file,
+                album_indexes,
+                cache_root_dir=cache_root_dir,
                 quiet=quiet,
-            ):
-                # We got a match => Copy or symlink the file to the albums folder
-                num_processed += 1
-                if symlink:
-                    if not quiet:
-                        print(
-                            f"  [blue]++ Symlink '{os.path.basename(file)}' -> "
-                            f"'{os.path.basename(album_dir)}/' ++[/blue]"
-                        )
-                    if not dry_run:
-                        mksymlink(
-                            file,
-                            os.path.join(album_dir, os.path.basename(file)),
-                        )
-                else:
-                    if not quiet:
-                        print(
-                            f"  [blue]++ Copy '{os.path.basename(file)}' -> "
-                            f"'{os.path.basename(album_dir)}/' ++[/blue]"
-                        )
-                    if not dry_run:
-                        copyfile(
-                            file,
-                            os.path.join(album_dir, os.path.basename(file)),
-                        )
+                training_data=training_data,
+                fingerprints=fingerprints,
+                detection=detection,
+                name_matcher=name_matcher,
+            )
+        for album_dir, rule_type, msg in matched_albums:
+            if not quiet:
+                print(
+                    f"    [brown]++ {rule_type} ({msg}) rule matched ++[/brown]"
+                )
+            # We got a match => Copy or symlink the file to the albums folder
+            num_processed += 1
+            if album_contents is not None:
+                album_contents[album_dir][os.path.basename(file)] = file
+                continue
+            materialize_image(
+                file,
+                album_dir,
+                link_mode=link_mode,
+                quiet=quiet,
+                dry_run=dry_run,
+            )
 
     # Raises an exception if albums are configured, but not a single match
     # was found.
     if num_processed == 0 and image_files_root and album_dirs:
-        raise FacesException("No images were matching for any album.")
+        raise NoMatchesException("No images were matching for any album.")
+
+
+def classify_image(
+    image_path: str,
+    album_indexes: list[albums.AlbumIndex],
+    cache_root_dir: str | None = None,
+    quiet: bool = False,
+    training_data: tuple[Any, list[tuple[str, str]]] | None = None,
+    fingerprints: FingerprintIndex | None = None,
+    detection: DetectionOptions | None = None,
+    name_matcher: NameMatcher | None = None,
+) -> list[tuple[str, str, str]]:
+    """Evaluates the rules of all albums for a single image.
+
+    The face encodings of the image are loaded at most once and are compared to
+    the training data of all albums with a single distance matrix calculation.
+
+    :param image_path: The image to be classified.
+
+    :param album_indexes: The compiled indexes of all albums.
+
+    :param cache_root_dir: The root directory of the cache. The cache is not used
+        if `None`.
+
+    :param quiet: Whether additional verbose output should be generated.
+
+    :param training_data: The stacked training data of all albums as returned by
+        `load_training_encodings`. Calculated from `album_indexes` if `None`.
+
+    :param fingerprints: The fingerprint index of the cache.
+
+    :param detection: The face detection options used if the cache is not used.
+
+    :param name_matcher: The compiled name rules of all albums. Compiled from
+        `album_indexes` if `None`.
+
+    :return: For each matching album (in the order of `album_indexes`) the album
+        directory, the type of the matching rule and a description of the rule.
+    """
+    matched: dict[str, tuple[str, str]] = {}
+
+    # Name rules are cheap and are checked first
+    if name_matcher is None:
+        name_matcher = NameMatcher(album_indexes)
+    for album_dir, msg in name_matcher.match(image_path).items():
+        matched[album_dir] = ("name", msg)
+
+    # Only load the face encodings if an unmatched album has training data
+    if any(
+        index.album_dir not in matched and len(index.encodings) > 0
+        for index in album_indexes
+    ):
+        if training_data is None:
+            training_data = load_training_encodings(album_indexes, detection)
+        training_encodings, labels = training_data
+        query_encodings = get_face_encodings(
+            image_path,
+            cache_root_dir=cache_root_dir,
+            quiet=quiet,
+            fingerprints=fingerprints,
+            detection=detection,
+        )
+        if len(query_encodings) > 0:
+            matches = get_face_backend(detection).compare_faces(
+                training_encodings, faces.stack_encodings(query_encodings)
+            )
+            for row, row_matched in enumerate(matches.any(axis=1)):
+                album_dir, trainingdir = labels[row]
+                if row_matched and album_dir not in matched:
+                    matched[album_dir] = (
+                        "face",
+                        f"'{os.path.basename(album_dir)}'"
+                        f".'{os.path.basename(trainingdir)}'",
+                    )
+
+    return [
+        (index.album_dir, *matched[index.album_dir])
+        for index in album_indexes
+        if index.album_dir in matched
+    ]
+
+
+def classify_image_with_journal(
+    image_path: str,
+    album_indexes: list[albums.AlbumIndex],
+    journal: DecisionJournal,
+    fingerprints: FingerprintIndex,
+    cache_root_dir: str | None = None,
+    quiet: bool = False,
+    training_data: tuple[Any, list[tuple[str, str]]] | None = None,
+    detection: DetectionOptions | None = None,
+    name_matcher: NameMatcher | None = None,
+) -> list[tuple[str, str, str]]:
+    """Evaluates the rules of all albums for a single image, reusing the decisions
+    of earlier runs.
+
+    Only the albums whose rules changed since the image (with the same content
+    and name) was classified the last time are evaluated. The new decisions are
+    recorded in the journal.
+
+    :param journal: The decision journal.
+
+    :param fingerprints: The fingerprint index of the cache.
+
+    See `classify_image` for the other parameters and the return value.
+    """
+    signatures = {index.album_dir: index.signature for index in album_indexes}
+    key = journal.image_key(fingerprints.hash(image_path), image_path)
+    decisions, stale_albums = journal.lookup(key, signatures)
+    if stale_albums:
+        stale_indexes = [
+            index for index in album_indexes if index.album_dir in stale_albums
+        ]
+        for album_dir, rule_type, msg in classify_image(
+            image_path,
+            stale_indexes,
+            cache_root_dir=cache_root_dir,
+            quiet=quiet,
+            training_data=training_data,
+            fingerprints=fingerprints,
+            detection=detection,
+            name_matcher=name_matcher,
+        ):
+            decisions[album_dir] = (rule_type, msg)
+        journal.record(key, signatures, decisions)
+    return [
+        (index.album_dir, *decisions[index.album_dir])
+        for index in album_indexes
+        if index.album_dir in decisions
+    ]
+
+
+def materialize_image(
+    image_path: str,
+    album_dir: str,
+    link_mode: str = "copy",
+    quiet: bool = False,
+    dry_run: bool = False,
+) -> None:
+    """Copies or links an image into an album directory.
+
+    :param image_path: The image to be added to the album.
+
+    :param album_dir: The album directory.
+
+    :param link_mode: How the image is added to the album (see `get_link_mode`).
+
+    :param quiet: Whether additional verbose output should be generated.
+
+    :param dry_run: Whether to only print the actions which would be executed.
+    """
+    target = os.path.join(album_dir, os.path.basename(image_path))
+    action, materialize = {
+        "copy": ("Copy", copyfile),
+        "symlink": ("Symlink", mksymlink),
+        "hardlink": ("Hardlink", mkhardlink),
+        "reflink": ("Clone", clonefile),
+    }[link_mode]
+    if not quiet:
+        print(
+            f"  [blue]++ {action} '{os.path.basename(image_path)}' -> "
+            f"'{os.path.basename(album_dir)}/' ++[/blue]"
+        )
+    if not dry_run:
+        materialize(image_path, target)
+
+
+def get_link_mode(symlink: bool = False, link_mode: str | None = None) -> str:
+    """Determines how images are added to the albums.
+
+    The supported link modes are:
+
+    - `copy`: The image is copied.
+    - `symlink`: A relative symlink to the image is created.
+    - `hardlink`: A hardlink to the image is created (copied if not possible).
+    - `reflink`: A copy-on-write clone of the image is created (copied if not
+      supported by the file system).
+
+    :param symlink: Whether to symlink from the album folder instead of copying it.
+
+    :param link_mode: The link mode. Overrides `symlink` if given.
+
+    :return: The link mode.
+    """
+    if link_mode is None:
+        return "symlink" if symlink else "copy"
+    if link_mode not in LINK_MODES:
+        raise FacesException(
+            f"Unknown link mode '{link_mode}' "
+            f"(supported: {', '.join(LINK_MODES)})."
+        )
+    return link_mode
 
 
 def find_album_dirs(root_dir: str) -> list[str]:
@@ -397,18 +1166,7 @@ def find_album_dirs(root_dir: str) -> list[str]:
 
     :return: A `list` of all found album directories.
     """
-    dirs: list[str] = []
-    for root, dnames, _ in os.walk(
-        root_dir, topdown=True, onerror=None, followlinks=True
-    ):
-        # Search for albums in the current and child directories
-        for d in [root] + dnames:
-            dpath = os.path.join(root_dir, d)
-            faces_path = os.path.join(dpath, FACES_DIR_NAME)
-            # If a faces dir is in the directory, it is considered as an album
-            if os.path.exists(faces_path):
-                dirs.append(dpath)
-    return dirs
+    return scanner.scan(root_dir).album_dirs
 
 
 def find_image_files(root_dir: str, for_albums: bool = False) -> list[str]:
@@ -422,25 +1180,10 @@ def find_image_files(root_dir: str, for_albums: bool = False) -> list[str]:
 
     :return: A `list` of all found images.
     """
-    images: list[str] = []
-    for root, _, fnames in os.walk(
-        root_dir, topdown=True, onerror=None, followlinks=True
-    ):
-        for fname in fnames:
-            dpath = os.path.join(root_dir, root)
-            faces_path = os.path.join(dpath, FACES_DIR_NAME)
-            include_file = False
-            if os.path.exists(faces_path):
-                if for_albums:
-                    include_file = True
-            else:
-                if not for_albums:
-                    include_file = True
-            if include_file:
-                fpath = os.path.join(dpath, fname)
-                if is_valid_image(fpath):
-                    images.append(fpath)
-    return images
+    snapshot = scanner.scan(root_dir)
+    if for_albums:
+        return snapshot.album_images
+    return snapshot.images
 
 
 def process_image(
@@ -451,7 +1194,10 @@ def process_image(
     symlink: bool = False,
     use_cache: bool = True,
     quiet: bool = False,
-) -> None:
+    detection: DetectionOptions | None = None,
+    sync: bool = False,
+    link_mode: str | None = None,
+) -> SyncReport | None:
     """Processes only a single image file.
 
     :param image_to_process_path: The image to be processed.
@@ -468,21 +1214,208 @@ def process_image(
     :param use_cache: Whether the cache should be used.
 
     :param quiet: Whether additional verbose output should be generated.
+
+    :param detection: The face detection options (see `update_cache`).
+
+    :param sync: Whether to only write the differences to the album directories.
+
+    :param link_mode: How the image is added to the albums (see `get_link_mode`).
+        Overrides `symlink` if given.
+
+    :return: The changes done to the albums if `sync` is used, `None` otherwise.
+    """
+    return process_images(
+        [image_to_process_path],
+        albums_root_dir=albums_root_dir,
+        dry_run=dry_run,
+        delete_old=delete_old,
+        symlink=symlink,
+        use_cache=use_cache,
+        quiet=quiet,
+        detection=detection,
+        sync=sync,
+        link_mode=link_mode,
+    )
+
+
+def process_images(
+    images_to_process_paths: list[str],
+    albums_root_dir: str = ".",
+    root_dir: str | None = None,
+    dry_run: bool = False,
+    delete_old: bool = True,
+    symlink: bool = False,
+    use_cache: bool = True,
+    quiet: bool = False,
+    detection: DetectionOptions | None = None,
+    sync: bool = False,
+    link_mode: str | None = None,
+) -> SyncReport | None:
+    """Processes exactly the given image files.
+
+    No directory containing the images is scanned: only the given images are
+    hashed, added to the cache and classified.
+
+    :param images_to_process_paths: The images to be processed.
+
+    :param root_dir: The root directory of the cache. Defaults to the deepest
+        directory containing all images.
+
+    See `process_image` for the other parameters and the return value.
     """
-    check_valid_image(image_to_process_path)
-    dirname = os.path.dirname(image_to_process_path)
-    process_directory(
-        dirname,
+    image_paths = list(
+        dict.fromkeys(os.path.abspath(p) for p in images_to_process_paths)
+    )
+    if not image_paths:
+        raise FacesException("No images to process were given.")
+    for image_path in image_paths:
+        check_valid_image(image_path)
+    if root_dir is None:
+        root_dir = os.path.commonpath(
+            [os.path.dirname(image_path) for image_path in image_paths]
+        )
+    root_dir = os.path.abspath(root_dir)
+    return process_directory(
+        root_dir,
         albums_root_dir=albums_root_dir,
         dry_run=dry_run,
         delete_old=delete_old,
         symlink=symlink,
         use_cache=use_cache,
         quiet=quiet,
-        only_process_files={image_to_process_path},
+        only_process_files=set(image_paths),
+        detection=detection,
+        sync=sync,
+        link_mode=link_mode,
+        snapshot=GallerySnapshot(root_dir, images=image_paths),
     )
 
 
+def search_images(
+    image_path: str,
+    root_dir: str = ".",
+    tolerance: float | None = None,
+    limit: int | None = 20,
+    update: bool = True,
+    quiet: bool = False,
+    jobs: int = 1,
+    ann: bool = False,
+    nprobe: int | None = None,
+) -> list[tuple[str, float]]:
+    """Searches the gallery for images showing the persons of an image.
+
+    The faces are searched in the gallery index (see `search`), which holds
+    the cached face encodings of all images of the gallery.
+
+    :param image_path: The image showing the persons to search for.
+
+    :param root_dir: The root path containing the images and the cache.
+
+    :param tolerance: The maximum distance to be considered a match. The
+        default of the face backend if `None`.
+
+    :param limit: The maximum number of images returned.
+
+    :param update: Whether to update the cache and the gallery index before
+        searching. Otherwise the index of an earlier search is used as is.
+
+    :param quiet: Whether additional verbose output should be generated.
+
+    :param jobs: The number of worker processes used to update the cache.
+
+    :param ann: Whether to search the approximate index of the gallery (see
+        `ivf`) instead of comparing all faces. The index is built on first
+        use and kept up to date afterwards.
+
+    :param nprobe: The number of lists of the approximate index searched for
+        each face (more lists find more matches, but take longer). Implies
+        `ann`.
+
+    :return: The matching images and their distance to the closest face in
+        question, closest first.
+    """
+    check_valid_image(image_path)
+    image_path = os.path.abspath(image_path)
+    root_dir = os.path.abspath(root_dir)
+    if not os.path.isdir(root_dir):
+        raise FacesException(f"Root directory ({root_dir}) does not exist.")
+    if limit is not None and limit < 1:
+        raise FacesException("The limit must be positive.")
+    if nprobe is not None and nprobe < 1:
+        raise FacesException("The number of probed lists must be positive.")
+
+    detection = resolve_detection_options(root_dir)
+    backend = get_face_backend(detection)
+    if not isinstance(backend, backends.EuclideanBackend):
+        raise FacesException(
+            f"The face backend '{detection.backend}' does not support searching."
+        )
+    if tolerance is None:
+        tolerance = backend.tolerance
+
+    fingerprints = FingerprintIndex.load(root_dir)
+    if update:
+        snapshot = scanner.scan(root_dir)
+        update_cache(
+            root_dir,
+            quiet=quiet,
+            fingerprints=fingerprints,
+            jobs=jobs,
+            detection=detection,
+            snapshot=snapshot,
+        )
+        # The gallery index was updated with the cache if an approximate
+        # index exists
+        updated = None
+        if ivf.has_ivf_index(root_dir):
+            updated = search.read_gallery_index(root_dir)
+        if updated is None:
+            updated = update_gallery_index(
+                root_dir, snapshot.images, fingerprints, quiet=quiet
+            )
+        index = updated
+        fingerprints.save()
+    else:
+        stored = search.read_gallery_index(root_dir)
+        if stored is None:
+            raise FacesException(
+                f"No gallery index found in '{root_dir}'. Search once with"
+                " updating enabled."
+            )
+        index = stored
+
+    # Images of the gallery are usually cached already
+    query_encodings = None
+    if os.path.exists(os.path.join(root_dir, CACHE_BASE_NAME)):
+        query_encodings = cache.read_cached_encodings(
+            root_dir, fingerprints.hash(image_path)
+        )
+    if query_encodings is None:
+        query_encodings = encode_images([image_path], detection)[0]
+    if len(query_encodings) == 0:
+        raise FacesException(f"No faces found in '{image_path}'.")
+
+    ivf_index = None
+    if ann or nprobe is not None:
+        ivf_index = search.load_ivf_index(root_dir, index)
+    results = search.search_gallery(
+        index,
+        query_encodings,
+        tolerance,
+        limit,
+        ivf_index=ivf_index,
+        nprobe=ivf.DEFAULT_NPROBE if nprobe is None else nprobe,
+    )
+    if not quiet:
+        print(
+            f"[green]++ Found {len(results)} matching images"
+            f" ({len(index)} images searched) ++[/green]"
+        )
+        for image, distance in results:
+            print(f"  [blue]{distance:.3f}[/blue] {image}")
+    return results
+
+
 def handle_dry_run(dry_run: bool) -> None:
     """Set-up dry-run.
 
@@ -558,6 +1491,7 @@ def match_names(
         )
         with open(output_file, "w") as f:
             f.write(json.dumps(names_data))
+        albums.rebuild_album_index(album_dir)
 
 
 def match_faces(
@@ -566,6 +1500,7 @@ def match_faces(
     dry_run: bool = False,
     training_data_prefix: str | None = None,
     quiet: bool = False,
+    detection: DetectionOptions | None = None,
 ) -> None:
     """Adds training data for a face classification to an album.
 
@@ -581,6 +1516,8 @@ def match_faces(
         later.
 
     :param quiet: Whether additional verbose output should be generated.
+
+    :param detection: The face detection options. Defaults are used if `None`.
     """
     handle_dry_run(dry_run)
     check_valid_image(training_image_path)
@@ -589,15 +1526,16 @@ def match_faces(
         print(
             f"[green]++ Calculate face encodings '{training_image_path}' ++[/green]"
         )
-    encodings = get_face_encodings(training_image_path, quiet=quiet)
+    encodings = get_face_encodings(
+        training_image_path, quiet=quiet, detection=detection
+    )
 
     if len(encodings) == 0:
         raise FacesException(
             f"No face recognised in image '{training_image_path}."
         )
 
-    with open(training_image_path, "rb") as f:
-        image_hash = hashlib.md5(f.read()).hexdigest()
+    image_hash = hash_file(training_image_path, "md5")
 
     output_training_dir_name = image_hash + TRAINING_IMAGE_DIR_EXT
     if training_data_prefix:
@@ -621,19 +1559,19 @@ def match_faces(
         pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
 
     # Write all found face encodings
-    for idx, encoding in enumerate(encodings):
-        if not quiet:
-            print(
-                f"  [blue]++ Writing face encoding {idx + 1}/{len(encodings)} ++[/blue]"
-            )
-        serialized_as_json = json.dumps(
-            pickle.dumps(encoding).decode("latin-1")
+    if not quiet:
+        print(
+            f"  [blue]++ Writing face encodings ({len(encodings)}) ++[/blue]"
+        )
+    if not dry_run:
+        storage.write_encodings(
+            os.path.join(output_dir, TRAINING_ENCODINGS_FILE_NAME), encodings
         )
-        md5 = str(hashlib.md5(serialized_as_json.encode("utf-8")).hexdigest())
-        output_file = os.path.join(output_dir, md5 + ".encoding")
-        if not dry_run:
-            with open(output_file, "w") as f:
-                f.write(serialized_as_json)
+        # Only comparable with encodings of the same backend
+        with open(
+            os.path.join(output_dir, TRAINING_BACKEND_FILE_NAME), "w"
+        ) as f:
+            f.write(get_face_backend(detection).identity)
 
     # Generates a symlink to the training image to make it easier to remove it later.
     symlink_path = image_hash + TRAINING_IMAGE_SRC_EXT
@@ -648,6 +1586,7 @@ def match_faces(
         except FileNotFoundError:
             pass
         mksymlink(os.path.abspath(training_image_path), symlink_path)
+        albums.rebuild_album_index(album_dir)
 
 
 def is_valid_image(image_path: str) -> bool:
@@ -665,25 +1604,39 @@ def check_valid_image(image_path: str) -> None:
         raise FacesException(f"Path '{image_path}' does not exist.")
     if not os.path.isfile(image_path):
         raise FacesException(f"Path '{image_path}' is no file.")
-    if not (
-        image_path.lower().endswith(".jpg")
-        or image_path.lower().endswith(".jpeg")
-        or image_path.lower().endswith(".png")
-    ):
+    if not scanner.has_image_extension(image_path):
         raise FacesException(
             f"File '{image_path}' has an invalid file type (only JPEGs are supported)."
         )
 
 
+def check_valid_images(image_paths: set[str]) -> set[str]:
+    """Requires validity for images (see `check_valid_image`).
+
+    :return: The absolute paths of the images.
+    """
+    image_paths = {os.path.abspath(path) for path in image_paths}
+    for path in image_paths:
+        check_valid_image(path)
+    return image_paths
+
+
 def get_face_encodings(
-    image_path: str, cache_root_dir: str | None = None, quiet: bool = False
+    image_path: str,
+    cache_root_dir: str | None = None,
+    quiet: bool = False,
+    fingerprints: FingerprintIndex | None = None,
+    detection: DetectionOptions | None = None,
 ) -> Any:
     """Returns the face encodings for an image.
 
     Uses the cache if one is configured.
-    """
-    from cutyx import faces
 
+    :param fingerprints: The fingerprint index of the cache. If `None`, the image
+        is hashed to find its cache entry.
+
+    :param detection: The face detection options used if the cache is not used.
+    """
     check_valid_image(image_path)
 
     # Checks whether the cache should be used for encodings
@@ -697,46 +1650,174 @@ def get_face_encodings(
 
     # Loads the encodings from the associated cache directory
     if from_cache:
-        with open(image_path, "rb") as f:
-            image_hash = hashlib.md5(f.read()).hexdigest()
-
         assert cache_root_dir is not None
-        encodings_dir = os.path.join(
-            cache_root_dir, FACES_CACHE_DIR_NAME, image_hash
-        )
-        if os.path.exists(encodings_dir):
-            encoding_files = os.listdir(encodings_dir)
-            encodings = []
-            for file in encoding_files:
-                filepath = os.path.join(encodings_dir, file)
-
-                with open(filepath, "rb") as f:
-                    deserialized_from_json = pickle.loads(
-                        json.loads(f.read()).encode("latin-1")
-                    )
-                    encodings.append(deserialized_from_json)
-            return encodings
+        if fingerprints is not None:
+            image_hash = fingerprints.hash(image_path)
         else:
+            image_hash = hash_file(
+                image_path, cache.hash_algorithm(cache_root_dir)
+            )
+        encodings = cache.read_cached_encodings(cache_root_dir, image_hash)
+        if encodings is None:
             return []
+        return encodings
     else:
         # Calculates the face encodings without caching
-        image = faces.load_image_file(image_path)
-        encodings = faces.face_encodings(image)
-        return encodings
+        return encode_images([image_path], detection)[0]
 
 
-def any_matches(
-    handlers: list[tuple[str, Callable[[], tuple[bool, str]]]],
-    quiet: bool = False,
-) -> bool:
-    for handler in handlers:
-        name, fun = handler
-        res, msg = fun()
-        if res:
-            if not quiet:
-                print(f"    [brown]++ {name} ({msg}) rule matched ++[/brown]")
-            return True
-    return False
+def make_detection_options(
+    max_dimension: int | None = None,
+    model: str | None = None,
+    upsample: int | None = None,
+    backend: str | None = None,
+) -> DetectionOptions | None:
+    """Creates face detection options from optional settings (e.g. CLI arguments).
+
+    :param max_dimension: The maximum size of the larger image side.
+
+    :param model: The face detection model (`hog` or `cnn`).
+
+    :param upsample: How many times images are upsampled when looking for faces.
+
+    :param backend: The name of the face recognition backend (see `backends`).
+
+    :return: The detection options with defaults for all settings not given or
+        `None` if no setting was given at all.
+    """
+    if (
+        max_dimension is None
+        and model is None
+        and upsample is None
+        and backend is None
+    ):
+        return None
+    if max_dimension is not None and max_dimension < 1:
+        raise FacesException("The maximum dimension must be positive.")
+    if model is not None and model not in faces.DETECTION_MODELS:
+        raise FacesException(
+            f"Invalid detection model '{model}' (valid models: "
+            f"{', '.join(faces.DETECTION_MODELS)})."
+        )
+    if upsample is not None and upsample < 0:
+        raise FacesException("The upsample count must not be negative.")
+    if backend is not None:
+        # Raises an exception for unknown backends
+        backends.get_backend(backend)
+    defaults = DetectionOptions()
+    return DetectionOptions(
+        max_dimension=max_dimension,
+        model=model if model is not None else defaults.model,
+        upsample=upsample if upsample is not None else defaults.upsample,
+        backend=backend if backend is not None else defaults.backend,
+    )
+
+
+def resolve_detection_options(
+    root_dir: str, detection: DetectionOptions | None = None
+) -> DetectionOptions:
+    """Returns the face detection options to be used for a cache.
+
+    All entries of a cache must be calculated with the same options, hence the
+    options are stored in the cache configuration.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param detection: The requested options. If `None`, the options stored in the
+        cache (or the defaults) are used.
+
+    :return: The options to be used.
+    """
+    config = cache.read_cache_config(root_dir)
+    stored = config.get("detection")
+    if stored is None:
+        resolved = detection if detection is not None else DetectionOptions()
+    else:
+        resolved = DetectionOptions.from_dict(stored)
+        if detection is not None and detection != resolved:
+            raise FacesException(
+                f"The cache in '{root_dir}' was created with different face detection"
+                f" options ({resolved}). Clear the cache to change them."
+            )
+
+    # The backend itself may have changed (e.g. its model)
+    stored_backend = config.get("backend")
+    if (
+        stored_backend is not None
+        and stored_backend != get_face_backend(resolved).identity
+    ):
+        raise FacesException(
+            f"The cache in '{root_dir}' was created with the face backend"
+            f" '{stored_backend}'. Clear the cache to change it."
+        )
+    return resolved
+
+
+def get_face_backend(
+    detection: DetectionOptions | None = None,
+) -> backends.FaceBackend:
+    """Returns the face recognition backend of detection options.
+
+    :param detection: The face detection options. The default backend is
+        returned if `None`.
+    """
+    return backends.get_backend(detection.backend if detection else None)
+
+
+def encode_images(
+    image_paths: list[str], detection: DetectionOptions | None = None
+) -> list[Any]:
+    """Calculates the face encodings of a batch of images (without using the cache).
+
+    :param image_paths: The images to be processed.
+
+    :param detection: The face detection options (including the backend).
+
+    :return: The face encodings of each image.
+    """
+    for image_path in image_paths:
+        check_valid_image(image_path)
+    if detection is None:
+        detection = DetectionOptions()
+    return get_face_backend(detection).encode_images(image_paths, detection)
+
+
+def load_training_encodings(
+    album_indexes: list[albums.AlbumIndex],
+    detection: DetectionOptions | None = None,
+) -> tuple[Any, list[tuple[str, str]]]:
+    """Stacks the face training data of one or more albums.
+
+    Encodings of different face backends can not be compared, so the training
+    data has to be calculated with the backend the images are encoded with.
+
+    :param album_indexes: The compiled indexes of the albums.
+
+    :param detection: The face detection options (including the backend) the
+        images are encoded with. The default backend is used if `None`.
+
+    :return: A tuple of a matrix with all training encodings (one per row) and,
+        for each row, the album directory and training directory it belongs to.
+    """
+    identity = get_face_backend(detection).identity
+    labels: list[tuple[str, str]] = []
+    for index in album_indexes:
+        for trainingdir, backend in index.backends.items():
+            if backend != identity:
+                raise FacesException(
+                    f"The training data '{trainingdir}' of the album"
+                    f" '{index.album_dir}' was calculated with the face backend"
+                    f" '{backend}', but the images are compared with"
+                    f" '{identity}'. Add the training image again with"
+                    " 'cutyx match faces'."
+                )
+        labels.extend((index.album_dir, d) for d in index.trainingdirs)
+    if len(album_indexes) == 1:
+        return album_indexes[0].encodings, labels
+    return (
+        faces.stack_encodings([index.encodings for index in album_indexes]),
+        labels,
+    )
 
 
 def face_matches(
@@ -744,81 +1825,70 @@ def face_matches(
     album_dir: str,
     cache_root_dir: str | None = None,
     quiet: bool = False,
+    album_index: albums.AlbumIndex | None = None,
+    detection: DetectionOptions | None = None,
 ) -> tuple[bool, str]:
     """Checks whether a person matches to one of the configured training data images
     in the given album directory.
+
+    All faces of the image are compared to all training faces of the album
+    with a single distance matrix calculation.
+
+    :param album_index: The compiled index of the album. Loaded from the album
+        directory if `None`.
+
+    :param detection: The face detection options (including the backend). The
+        options of the cache are used if `None` and a cache is used.
     """
-    from cutyx import faces
+    if album_index is None:
+        album_index = albums.load_album_index(album_dir)
+    if cache_root_dir:
+        detection = resolve_detection_options(cache_root_dir, detection)
+    training_encodings, labels = load_training_encodings(
+        [album_index], detection
+    )
+    if len(training_encodings) == 0:
+        return False, ""
 
     # Get the face encodings for the image in question
     query_encodings = get_face_encodings(
-        image_path, cache_root_dir=cache_root_dir, quiet=quiet
+        image_path,
+        cache_root_dir=cache_root_dir,
+        quiet=quiet,
+        detection=detection,
     )
+    if len(query_encodings) == 0:
+        return False, ""
 
-    # If no faces directory exists, we cannot classify anything
-    faces_dir = os.path.join(album_dir, FACES_DIR_NAME)
-    if os.path.exists(faces_dir):
-        trainingdirs = [
-            f
-            for f in os.listdir(faces_dir)
-            if f.endswith(TRAINING_IMAGE_DIR_EXT)
-        ]
-        for trainingdir in trainingdirs:
-            trainingdirpath = os.path.join(faces_dir, trainingdir)
-            encodings = os.listdir(trainingdirpath)
-            for encoding in encodings:
-                encodingpath = os.path.join(trainingdirpath, encoding)
-
-                # Load the classifier from the album directory
-                with open(encodingpath, "r") as f:
-                    deserialized_from_json = pickle.loads(
-                        json.loads(f.read()).encode("latin-1")
-                    )
-                    for query_encoding in query_encodings:
-                        results = faces.compare_faces(
-                            [deserialized_from_json], query_encoding
-                        )
-                        if True in results:
-                            return True, (
-                                f"'{os.path.basename(album_dir)}'"
-                                f".'{os.path.basename(trainingdir)}'"
-                            )
+    matches = get_face_backend(detection).compare_faces(
+        training_encodings,
+        faces.stack_encodings(query_encodings),
+    )
+    for row, matched in enumerate(matches.any(axis=1)):
+        if matched:
+            _, trainingdir = labels[row]
+            return True, (
+                f"'{os.path.basename(album_dir)}'"
+                f".'{os.path.basename(trainingdir)}'"
+            )
     return False, ""
 
 
 def name_matches(
     image_path: str,
     album_dir: str,
+    album_index: albums.AlbumIndex | None = None,
 ) -> tuple[bool, str]:
-    """Checks whether a file name matches."""
-    # If no faces directory exists, we cannot classify anything
-    faces_dir = os.path.join(album_dir, FACES_DIR_NAME)
-    if os.path.exists(faces_dir):
-        namefiles = [
-            f for f in os.listdir(faces_dir) if f.endswith(NAMES_FILE_EXT)
-        ]
-        for namefile in namefiles:
-            namefilepath = os.path.join(faces_dir, namefile)
-            with open(namefilepath, "r") as f:
-                namedata = json.loads(f.read())
-
-            if namedata["use_regex"]:
-                if re.match(
-                    re.compile(namedata["text"]), os.path.basename(image_path)
-                ):
-                    return True, f"'{namedata['text']}'"
-            elif namedata["use_fuzzy"]:
-                if (
-                    fuzz.token_sort_ratio(
-                        namedata["text"],
-                        os.path.splitext(os.path.basename(image_path))[0],
-                    )
-                    > namedata["fuzzy_min_ratio"]
-                ):
-                    return True, f"'{namedata['text']}'"
-            else:
-                if namedata["text"].lower() in os.path.basename(
-                    image_path.lower()
-                ):
-                    return True, f"'{namedata['text']}'"
+    """Checks whether a file name matches.
+
+    :param album_index: The compiled index of the album. Loaded from the album
+        directory if `None`.
+    """
+    if album_index is None:
+        album_index = albums.load_album_index(album_dir)
+    msg = (
+        NameMatcher([album_index]).match(image_path).get(album_index.album_dir)
+    )
+    if msg is not None:
+        return True, msg
     return False, ""
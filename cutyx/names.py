@@ -0,0 +1,242 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Matching of file names against the name rules of all albums.
+
+The name rules of all albums are compiled once per run into a `NameMatcher`:
+
+- Substring rules are combined into an Aho-Corasick automaton, so a file name is
+  scanned once for all of them.
+- Regex rules are combined into a single expression of optional lookaheads, one
+  named group per rule. Rules which can not be combined (e.g. because they use
+  groups or inline flags) are matched separately.
+- Fuzzy rules are scored in batches: the names of many images are scored
+  against all fuzzy rules with a single `rapidfuzz` `cdist` call. Names and rule
+  texts are pre-processed (and their tokens sorted) only once.
+
+For every album, the first of its rules matching a file name is reported.
+`rapidfuzz`, `thefuzz` and `numpy` are only imported if fuzzy rules exist.
+"""
+
+import os.path
+import re
+from collections import deque
+from typing import TYPE_CHECKING, Iterator
+
+if TYPE_CHECKING:
+    from cutyx.albums import AlbumIndex
+
+FUZZY_CHUNK_SIZE = 4096
+"""Number of image names scored against the fuzzy rules at once."""
+
+
+class AhoCorasick:
+    """A multi-pattern substring matcher."""
+
+    def __init__(self, patterns: list[str]) -> None:
+        """
+        :param patterns: The patterns. A pattern is identified by its position.
+        """
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[int]] = [[]]
+        for pattern_id, pattern in enumerate(patterns):
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = next_node
+            self._out[node].append(pattern_id)
+
+        # Breadth first, so the failure links of shallower nodes are known
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] = (
+                    self._out[child] + self._out[self._fail[child]]
+                )
+
+    def search(self, text: str) -> set[int]:
+        """Searches a text for all patterns.
+
+        :param text: The text.
+
+        :return: The identifiers of all patterns contained in the text.
+        """
+        found = set(self._out[0])
+        node = 0
+        for char in text:
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            found.update(self._out[node])
+        return found
+
+
+def fuzzy_key(text: str) -> str:
+    """Pre-processes a text for fuzzy matching.
+
+    The text is processed like by `thefuzz` and its tokens are sorted, so that the
+    plain ratio of two keys equals the `token_sort_ratio` of the texts.
+    """
+    from thefuzz import utils as fuzz_utils  # type: ignore
+
+    processed = fuzz_utils.full_process(text, force_ascii=True)
+    return " ".join(sorted(processed.split()))
+
+
+def is_combinable_regex(pattern: str) -> bool:
+    """Checks whether a regex rule can be part of a combined expression.
+
+    Patterns with groups (which could be referenced by number) or inline flags
+    change their meaning when being embedded and are matched separately.
+    """
+    compiled = re.compile(pattern)
+    return compiled.groups == 0 and compiled.flags == re.compile("").flags
+
+
+class NameMatcher:
+    """The compiled name rules of all albums."""
+
+    def __init__(self, album_indexes: list["AlbumIndex"]) -> None:
+        """
+        :param album_indexes: The compiled indexes of all albums.
+        """
+        self.rules: list[tuple[str, str]] = []
+        """The album directory and match description for each rule, ordered by
+        album and rule."""
+
+        substrings: list[str] = []
+        self._substring_rules: list[int] = []
+        regex_parts: list[str] = []
+        self._regex_rules: list[int] = []
+        self._separate_regexes: list[tuple[int, re.Pattern[str]]] = []
+        self._fuzzy_rules: list[int] = []
+        fuzzy_keys: list[str] = []
+        fuzzy_ratios: list[int] = []
+        for index in album_indexes:
+            for namedata in index.name_rules:
+                rule_id = len(self.rules)
+                self.rules.append((index.album_dir, f"'{namedata['text']}'"))
+                if namedata["use_regex"]:
+                    if is_combinable_regex(namedata["text"]):
+                        regex_parts.append(
+                            f"(?:(?=(?P<r{rule_id}>{namedata['text']}))|)"
+                        )
+                        self._regex_rules.append(rule_id)
+                    else:
+                        self._separate_regexes.append(
+                            (rule_id, re.compile(namedata["text"]))
+                        )
+                elif namedata["use_fuzzy"]:
+                    self._fuzzy_rules.append(rule_id)
+                    fuzzy_keys.append(fuzzy_key(namedata["text"]))
+                    fuzzy_ratios.append(namedata["fuzzy_min_ratio"])
+                else:
+                    substrings.append(namedata["text"].lower())
+                    self._substring_rules.append(rule_id)
+
+        self._automaton = AhoCorasick(substrings)
+        self._regex = re.compile("".join(regex_parts)) if regex_parts else None
+        self._fuzzy_keys = fuzzy_keys
+        self._fuzzy_ratios = fuzzy_ratios
+        # Scores below the smallest minimum ratio can never match
+        self._fuzzy_cutoff = max(0, min(fuzzy_ratios, default=0))
+        self._fuzzy_matches: dict[str, list[int]] = {}
+
+    def prepare(self, image_paths: list[str]) -> None:
+        """Scores the names of many images against all fuzzy rules at once.
+
+        Images which were not prepared are scored on their own when matched.
+
+        :param image_paths: The images to be matched later on.
+        """
+        if not self._fuzzy_rules:
+            return
+        import numpy as np
+        from rapidfuzz import fuzz, process
+
+        ratios = np.array(self._fuzzy_ratios, dtype=np.float64)
+        stems = list(
+            dict.fromkeys(
+                os.path.splitext(os.path.basename(path))[0]
+                for path in image_paths
+            ).keys()
+            - self._fuzzy_matches.keys()
+        )
+        for start in range(0, len(stems), FUZZY_CHUNK_SIZE):
+            chunk = stems[start : start + FUZZY_CHUNK_SIZE]
+            scores = process.cdist(
+                [fuzzy_key(stem) for stem in chunk],
+                self._fuzzy_keys,
+                scorer=fuzz.ratio,
+                score_cutoff=self._fuzzy_cutoff,
+                workers=-1,
+            )
+            # Scores are rounded to integers like by `thefuzz`
+            matches = np.rint(scores) > ratios
+            for stem, row in zip(chunk, matches):
+                self._fuzzy_matches[stem] = [
+                    self._fuzzy_rules[i] for i in np.flatnonzero(row)
+                ]
+
+    def iter_matching_rules(self, image_path: str) -> Iterator[int]:
+        """Yields the identifiers of all rules matching the name of an image
+        (unordered).
+
+        :param image_path: The image.
+        """
+        basename = os.path.basename(image_path)
+        for pattern_id in self._automaton.search(basename.lower()):
+            yield self._substring_rules[pattern_id]
+        if self._regex is not None:
+            match = self._regex.match(basename)
+            if match is not None:
+                for rule_id, group in zip(self._regex_rules, match.groups()):
+                    if group is not None:
+                        yield rule_id
+        for rule_id, regex in self._separate_regexes:
+            if regex.match(basename):
+                yield rule_id
+        if self._fuzzy_rules:
+            stem = os.path.splitext(basename)[0]
+            if stem not in self._fuzzy_matches:
+                self.prepare([image_path])
+            yield from self._fuzzy_matches[stem]
+
+    def match(self, image_path: str) -> dict[str, str]:
+        """Matches the name of an image against the rules of all albums.
+
+        :param image_path: The image.
+
+        :return: For each matching album the description of the first matching
+            rule of the album.
+        """
+        matched: dict[str, str] = {}
+        for rule_id in sorted(self.iter_matching_rules(image_path)):
+            album_dir, msg = self.rules[rule_id]
+            matched.setdefault(album_dir, msg)
+        return matched
@@ -0,0 +1,349 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""The streaming pipeline calculating the face encodings of new images.
+
+The cache is updated in stages connected by bounded queues, so that reading the
+images overlaps with calculating face encodings and with writing the cache:
+
+1. enumerate: the images to be processed are fed into the pipeline.
+2. read/hash (threads): the images are hashed (they are only read if their
+   fingerprint changed) and looked up in the cache. The operating system is
+   asked to read images which are not cached yet ahead, so decoding them does
+   not wait for the disk.
+3. decode/encode: the face backend decodes the images and calculates their
+   face encodings in batches, in this process or in worker processes.
+4. commit (thread): the face encodings are written to the cache (and committed
+   whenever no further results are waiting).
+
+A stage waits if the queue to the next stage is full, so the memory used stays
+flat however many images are processed.
+"""
+
+import collections
+import os
+import queue
+import threading
+from typing import Any, Callable, Iterable
+
+from rich import print
+
+from cutyx import cache
+from cutyx.faces import DetectionOptions
+from cutyx.fingerprints import FingerprintIndex
+
+HASH_THREADS = 4
+"""Number of threads reading and hashing images."""
+
+QUEUE_SIZE = 256
+"""Maximum number of items waiting between two stages."""
+
+_END = None
+"""Marks the end of the items of a queue."""
+
+_POLL_INTERVAL_SECONDS = 0.1
+
+
+class EncodingPipeline:
+    """Calculates the face encodings of all images which are not cached yet."""
+
+    def __init__(
+        self,
+        root_dir: str,
+        fingerprints: FingerprintIndex,
+        encode: Callable[..., list[Any]],
+        detection: DetectionOptions,
+        jobs: int = 1,
+        batch_size: int = 16,
+        quiet: bool = False,
+        hash_threads: int = HASH_THREADS,
+        queue_size: int = QUEUE_SIZE,
+    ) -> None:
+        """
+        :param root_dir: The root directory containing the cache.
+
+        :param fingerprints: The fingerprint index of the cache.
+
+        :param encode: Calculates the face encodings of a batch of images (called
+            with the images and the `detection` keyword argument, see
+            `lib.encode_images`). Has to be picklable if `jobs` is greater than 1.
+
+        :param detection: The face detection options.
+
+        :param jobs: The number of worker processes calculating face encodings.
+            The encodings are calculated in this process if `1`.
+
+        :param batch_size: The maximum number of images encoded at once.
+
+        :param quiet: Whether additional verbose output should be generated.
+
+        :param hash_threads: The number of threads reading and hashing images.
+
+        :param queue_size: The maximum number of items waiting between two
+            stages.
+        """
+        self.root_dir = root_dir
+        self.fingerprints = fingerprints
+        self.encode = encode
+        self.detection = detection
+        self.jobs = jobs
+        self.batch_size = max(1, batch_size)
+        self.quiet = quiet
+        self.hash_threads = max(1, hash_threads)
+        self.queue_size = queue_size
+        self.encoded = 0
+        """The number of images whose encodings were written to the cache."""
+
+        self._seen: set[str] = set()
+        self._seen_lock = threading.Lock()
+        self._abort = threading.Event()
+        self._errors: list[BaseException] = []
+        self._executor: Any = None
+        self._pending: collections.deque[tuple[list[tuple[str, str]], Any]] = (
+            collections.deque()
+        )
+
+    def run(self, images: Iterable[str]) -> int:
+        """Runs the pipeline until all images are processed.
+
+        :param images: The images to be processed.
+
+        :return: The number of images whose encodings were calculated.
+        """
+        paths: queue.Queue[str | None] = queue.Queue(self.queue_size)
+        missing: queue.Queue[tuple[str, str] | None] = queue.Queue(
+            self.queue_size
+        )
+        results: queue.Queue[tuple[str, str, Any] | None] = queue.Queue(
+            self.queue_size
+        )
+        threads = [self._start(self._enumerate, images, paths)]
+        threads.extend(
+            self._start(self._hash, paths, missing)
+            for _ in range(self.hash_threads)
+        )
+        threads.append(self._start(self._commit, results))
+        try:
+            self._encode(missing, results)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._put(results, _END)
+            for thread in threads:
+                thread.join()
+        if self._errors:
+            raise self._errors[0]
+        return self.encoded
+
+    def _start(
+        self, target: Callable[..., None], *args: Any
+    ) -> threading.Thread:
+        """Starts a stage in a thread, which aborts the pipeline on errors."""
+
+        def run() -> None:
+            try:
+                target(*args)
+            except BaseException as e:
+                self._fail(e)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def _fail(self, error: BaseException) -> None:
+        self._errors.append(error)
+        self._abort.set()
+
+    def _put(self, q: "queue.Queue[Any]", item: Any) -> bool:
+        """Adds an item to a queue, waiting while it is full.
+
+        :return: `False` if the pipeline was aborted.
+        """
+        while not self._abort.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q: "queue.Queue[Any]") -> Any:
+        """Takes an item from a queue, waiting while it is empty.
+
+        :return: The item or `_END` if the pipeline was aborted.
+        """
+        while not self._abort.is_set():
+            try:
+                return q.get(timeout=_POLL_INTERVAL_SECONDS)
+            except queue.Empty:
+                pass
+        return _END
+
+    def _enumerate(
+        self, images: Iterable[str], paths: "queue.Queue[str | None]"
+    ) -> None:
+        for image in images:
+            if not self._put(paths, image):
+                return
+        for _ in range(self.hash_threads):
+            self._put(paths, _END)
+
+    def _hash(
+        self,
+        paths: "queue.Queue[str | None]",
+        missing: "queue.Queue[tuple[str, str] | None]",
+    ) -> None:
+        while True:
+            image = self._get(paths)
+            if image is _END:
+                self._put(missing, _END)
+                return
+            image_hash = self.fingerprints.hash(image)
+            with self._seen_lock:
+                if image_hash in self._seen:
+                    continue
+                self._seen.add(image_hash)
+            if not cache.is_cached(self.root_dir, image_hash):
+                read_ahead(image)
+                if not self._put(missing, (image, image_hash)):
+                    return
+
+    def _encode(
+        self,
+        missing: "queue.Queue[tuple[str, str] | None]",
+        results: "queue.Queue[tuple[str, str, Any] | None]",
+    ) -> None:
+        if self.jobs > 1:
+            import concurrent.futures
+
+            self._executor = concurrent.futures.ProcessPoolExecutor(self.jobs)
+        try:
+            producers = self.hash_threads
+            batch: list[tuple[str, str]] = []
+            announced = False
+            while producers > 0 and not self._abort.is_set():
+                try:
+                    # A partial batch is encoded instead of waiting for more
+                    # images
+                    item = missing.get(
+                        block=not batch, timeout=_POLL_INTERVAL_SECONDS
+                    )
+                except queue.Empty:
+                    if batch:
+                        self._submit(batch, results)
+                        batch = []
+                    self._collect(results)
+                    continue
+                if item is _END:
+                    producers -= 1
+                    continue
+                if not announced and not self.quiet:
+                    print(
+                        "  [blue]++ Calculating face encodings of new images"
+                        f" ({self.jobs} jobs) ++[/blue]"
+                    )
+                    announced = True
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    self._submit(batch, results)
+                    batch = []
+                self._collect(results)
+            if batch and not self._abort.is_set():
+                self._submit(batch, results)
+            self._collect(results, wait=True)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+    def _submit(
+        self,
+        batch: list[tuple[str, str]],
+        results: "queue.Queue[tuple[str, str, Any] | None]",
+    ) -> None:
+        """Encodes a batch of images (in this process or a worker process)."""
+        images = [image for image, _ in batch]
+        if self._executor is None:
+            self._emit(
+                batch, self.encode(images, detection=self.detection), results
+            )
+        else:
+            future = self._executor.submit(
+                self.encode, images, detection=self.detection
+            )
+            self._pending.append((batch, future))
+
+    def _collect(
+        self,
+        results: "queue.Queue[tuple[str, str, Any] | None]",
+        wait: bool = False,
+    ) -> None:
+        """Passes the finished batches of the worker processes to the commit
+        stage in order. Waits for the oldest batch if two batches per worker
+        are in flight already (or if `wait` is set, for all batches)."""
+        while self._pending and (
+            wait
+            or self._pending[0][1].done()
+            or len(self._pending) >= 2 * self.jobs
+        ):
+            batch, future = self._pending.popleft()
+            self._emit(batch, future.result(), results)
+
+    def _emit(
+        self,
+        batch: list[tuple[str, str]],
+        encodings: list[Any],
+        results: "queue.Queue[tuple[str, str, Any] | None]",
+    ) -> None:
+        for (image, image_hash), image_encodings in zip(batch, encodings):
+            self._put(results, (image, image_hash, image_encodings))
+
+    def _commit(
+        self, results: "queue.Queue[tuple[str, str, Any] | None]"
+    ) -> None:
+        while True:
+            item = self._get(results)
+            if item is _END:
+                return
+            image, image_hash, encodings = item
+            if not self.quiet:
+                print(
+                    f"    [blue]++ Writing image '{os.path.basename(image)}'"
+                    f" face encodings ({len(encodings)}) ++[/blue]"
+                )
+            cache.write_cached_encodings(self.root_dir, image_hash, encodings)
+            self.encoded += 1
+            # Writes to a cache database are committed in batches; while
+            # waiting for the next results, the database is not kept locked
+            if results.empty():
+                cache.flush(self.root_dir)
+
+
+def read_ahead(path: str) -> None:
+    """Asks the operating system to read a file in the background (if
+    supported)."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
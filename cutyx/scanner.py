@@ -0,0 +1,162 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Scanning of galleries.
+
+A gallery is scanned once per run with `os.scandir`, using the type information
+of the directory entries instead of checking every path separately. The result is
+an in-memory snapshot of all albums and images which is shared by all stages of
+a run.
+
+The metadata directories of CutyX are never descended into, neither are paths
+excluded by `.cutyxignore` files (see `cutyx.ignore`).
+"""
+
+import os
+import os.path
+from dataclasses import dataclass, field
+
+from cutyx.constants import CACHE_BASE_NAME, FACES_DIR_NAME, IGNORE_FILE_NAME
+from cutyx.ignore import IgnoreRules, join_relative
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+"""The file extensions of supported images (lower case)."""
+
+PRUNED_DIR_NAMES = frozenset((FACES_DIR_NAME, CACHE_BASE_NAME))
+"""Directories which are never scanned (regardless of ignore patterns)."""
+
+
+@dataclass
+class GallerySnapshot:
+    """The albums and images found in a directory hierarchy."""
+
+    root_dir: str
+    """The scanned root directory."""
+
+    album_dirs: list[str] = field(default_factory=list)
+    """All album directories (directories containing a faces directory)."""
+
+    images: list[str] = field(default_factory=list)
+    """All images outside of album directories."""
+
+    album_images: list[str] = field(default_factory=list)
+    """All images located directly in an album directory."""
+
+    complete: bool = False
+    """Whether all images of `root_dir` were found (set by `scan`), rather
+    than a selection of changed images."""
+
+
+def has_image_extension(path: str) -> bool:
+    """Checks whether a path has the file extension of a supported image."""
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def scan(root_dir: str) -> GallerySnapshot:
+    """Scans a directory hierarchy for albums and images.
+
+    Symlinks are followed. Every directory is only visited once, which also
+    prevents endless loops caused by symlinks pointing to a parent directory.
+    The directories are visited in the same order as with `os.walk`. Ignored
+    directories are pruned without being read.
+
+    :param root_dir: The root directory to be scanned.
+
+    :return: The snapshot of the directory hierarchy.
+    """
+    snapshot = GallerySnapshot(root_dir, complete=True)
+    visited: set[tuple[int, int]] = set()
+    pending = [(root_dir, "", IgnoreRules.default())]
+    while pending:
+        dpath, rel_dir, rules = pending.pop()
+        try:
+            stat = os.stat(dpath)
+        except OSError:
+            continue
+        if (stat.st_dev, stat.st_ino) in visited:
+            continue
+        visited.add((stat.st_dev, stat.st_ino))
+
+        try:
+            with os.scandir(dpath) as it:
+                entries = list(it)
+        except OSError:
+            continue
+
+        names = {entry.name for entry in entries}
+        is_album = FACES_DIR_NAME in names
+        if IGNORE_FILE_NAME in names:
+            rules = rules.with_ignore_file(
+                os.path.join(dpath, IGNORE_FILE_NAME), rel_dir
+            )
+
+        images: list[str] = []
+        subdirs: list[tuple[str, str, IgnoreRules]] = []
+        for entry in entries:
+            rel_path = join_relative(rel_dir, entry.name)
+            try:
+                if entry.is_dir():
+                    if (
+                        entry.name not in PRUNED_DIR_NAMES
+                        and not rules.is_ignored(rel_path, is_dir=True)
+                    ):
+                        subdirs.append((entry.path, rel_path, rules))
+                elif (
+                    entry.is_file()
+                    and has_image_extension(entry.name)
+                    and not rules.is_ignored(rel_path)
+                ):
+                    images.append(entry.path)
+            except OSError:
+                continue
+
+        if is_album:
+            snapshot.album_dirs.append(dpath)
+            snapshot.album_images.extend(images)
+        else:
+            snapshot.images.extend(images)
+        pending.extend(reversed(subdirs))
+    return snapshot
+
+
+def is_ignored(root_dir: str, path: str) -> bool:
+    """Checks whether a file would be skipped when scanning a root directory.
+
+    :param root_dir: The scanned root directory.
+
+    :param path: The file.
+
+    :return: `True` if the file is outside of the root directory, in a pruned
+        directory or excluded by an ignore pattern.
+    """
+    rel_path = os.path.relpath(path, root_dir)
+    if rel_path == os.curdir or rel_path.startswith(os.pardir):
+        return True
+    components = rel_path.split(os.sep)
+    rules = IgnoreRules.default()
+    dpath = root_dir
+    rel_dir = ""
+    for name in components[:-1]:
+        ignore_file = os.path.join(dpath, IGNORE_FILE_NAME)
+        if os.path.isfile(ignore_file):
+            rules = rules.with_ignore_file(ignore_file, rel_dir)
+        rel_dir = join_relative(rel_dir, name)
+        if name in PRUNED_DIR_NAMES or rules.is_ignored(rel_dir, is_dir=True):
+            return True
+        dpath = os.path.join(dpath, name)
+    ignore_file = os.path.join(dpath, IGNORE_FILE_NAME)
+    if os.path.isfile(ignore_file):
+        rules = rules.with_ignore_file(ignore_file, rel_dir)
+    return rules.is_ignored(join_relative(rel_dir, components[-1]))
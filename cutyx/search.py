@@ -0,0 +1,447 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Searching the whole gallery for faces.
+
+All cached face encodings of the gallery are consolidated into a single matrix,
+the gallery index, which is stored in the cache directory::
+
+    gallery/encodings-<generation>  all encodings (float32, one per row, see
+                                    `cutyx.storage`), grouped by image
+    gallery/index.npz               the generation, the images, their content
+                                    hashes, the first row of every image and
+                                    the squared norms of all rows
+
+Every update writes the matrix of a new generation before the mapping
+referring to it is replaced, so the mapping never refers to the rows of
+another update, even if an update is interrupted.
+
+The matrix is memory-mapped and searched with a single matrix product, so a
+search does not read the cache entries of the images. The index is updated
+incrementally: the rows of unchanged images are taken from the previous index
+and only the encodings of new or modified images are read from the cache.
+
+For very large galleries an approximate index of the gallery matrix can be
+used in addition (see `cutyx.ivf`). Once it exists, it is kept up to date
+whenever the gallery index is updated.
+"""
+
+import os
+import os.path
+import uuid
+import zipfile
+from dataclasses import dataclass
+from typing import Any
+
+from cutyx import cache, ivf, storage
+from cutyx.constants import GALLERY_INDEX_DIR_NAME
+from cutyx.exceptions import FacesException
+
+GALLERY_INDEX_VERSION = 3
+
+GALLERY_DTYPE = "<f4"
+"""The floating point type of the gallery matrix (half the size of the cache
+entries, precise enough to rank faces)."""
+
+
+@dataclass
+class GalleryIndex:
+    """All face encodings of a gallery."""
+
+    images: list[str]
+    """The images (absolute paths)."""
+
+    hashes: list[str]
+    """The content hash of each image."""
+
+    offsets: Any
+    """The first row of each image in `encodings` (`len(images) + 1` values,
+    the rows of image `i` are `offsets[i]` to `offsets[i + 1]`)."""
+
+    encodings: Any
+    """All face encodings (one per row)."""
+
+    norms: Any
+    """The squared euclidean norm of each row of `encodings`."""
+
+    generation: str = ""
+    """Identifies the stored version of the index (see `cutyx.ivf`)."""
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    @property
+    def faces(self) -> int:
+        """The number of faces (rows)."""
+        return int(self.offsets[-1])
+
+
+def gallery_index_path(root_dir: str) -> str:
+    """Returns the path of the mapping of a gallery index.
+
+    :param root_dir: The root directory containing the cache.
+    """
+    return os.path.join(root_dir, GALLERY_INDEX_DIR_NAME, "index.npz")
+
+
+def gallery_encodings_path(root_dir: str, generation: str) -> str:
+    """Returns the path of the matrix of a gallery index.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param generation: The generation of the index.
+    """
+    return os.path.join(
+        root_dir, GALLERY_INDEX_DIR_NAME, f"encodings-{generation}"
+    )
+
+
+def read_gallery_index(root_dir: str) -> GalleryIndex | None:
+    """Reads the stored gallery index (the matrix is memory-mapped).
+
+    :param root_dir: The root directory containing the cache.
+
+    :return: The index or `None` if none exists or it is unreadable.
+    """
+    import numpy as np
+
+    try:
+        with np.load(gallery_index_path(root_dir), allow_pickle=False) as data:
+            if int(data["version"]) != GALLERY_INDEX_VERSION:
+                return None
+            index = GalleryIndex(
+                images=[str(image) for image in data["images"]],
+                hashes=[str(image_hash) for image_hash in data["hashes"]],
+                offsets=data["offsets"],
+                encodings=None,
+                norms=data["norms"],
+                generation=str(data["generation"]),
+            )
+        index.encodings = storage.read_encodings(
+            gallery_encodings_path(root_dir, index.generation)
+        )
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+    except FacesException:
+        return None
+    if len(index.encodings) != index.faces or len(index.norms) != index.faces:
+        return None
+    return index
+
+
+def save_gallery_index(root_dir: str, index: GalleryIndex) -> None:
+    """Stores a gallery index in the cache directory.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param index: The index to be stored.
+    """
+    import numpy as np
+
+    index_path = gallery_index_path(root_dir)
+    index_dir = os.path.dirname(index_path)
+    os.makedirs(index_dir, exist_ok=True)
+    index.generation = uuid.uuid4().hex
+    encodings_path = gallery_encodings_path(root_dir, index.generation)
+    storage.write_encodings(encodings_path, index.encodings, GALLERY_DTYPE)
+    with open(index_path + ".tmp", "wb") as f:
+        np.savez(
+            f,
+            version=np.array(GALLERY_INDEX_VERSION),
+            images=np.array(index.images, dtype=np.str_),
+            hashes=np.array(index.hashes, dtype=np.str_),
+            offsets=index.offsets,
+            norms=index.norms,
+            generation=np.array(index.generation),
+        )
+    os.replace(index_path + ".tmp", index_path)
+
+    # The matrices of earlier generations (and of interrupted updates)
+    for name in os.listdir(index_dir):
+        path = os.path.join(index_dir, name)
+        if name.startswith("encodings") and path != encodings_path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def build_gallery_index(
+    root_dir: str,
+    images: list[tuple[str, str]],
+    previous: GalleryIndex | None = None,
+) -> GalleryIndex:
+    """Consolidates the cached face encodings of images into a gallery index.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param images: The images (absolute paths) and their content hashes.
+        Images which are not cached are left out.
+
+    :param previous: An earlier index of the gallery whose rows are reused for
+        images with unchanged content.
+
+    :return: The new index (not stored yet).
+    """
+    import numpy as np
+
+    previous_rows: dict[str, tuple[int, int]] = {}
+    if previous is not None:
+        for i, image_hash in enumerate(previous.hashes):
+            previous_rows[image_hash] = (
+                int(previous.offsets[i]),
+                int(previous.offsets[i + 1]),
+            )
+
+    # Each image is either a range of rows of the previous index or a matrix
+    # of encodings read from the cache
+    parts: list[tuple[int, int] | Any] = []
+    indexed_images: list[str] = []
+    hashes: list[str] = []
+    counts: list[int] = []
+    for image, image_hash in images:
+        rows = previous_rows.get(image_hash)
+        if rows is not None:
+            parts.append(rows)
+            counts.append(rows[1] - rows[0])
+        else:
+            encodings = cache.read_cached_encodings(root_dir, image_hash)
+            if encodings is None:
+                continue
+            # Copied right away, a cache entry may be memory-mapped and keep
+            # its file open
+            parts.append(np.array(encodings, dtype=GALLERY_DTYPE))
+            counts.append(len(parts[-1]))
+        indexed_images.append(image)
+        hashes.append(image_hash)
+
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    matrix = np.empty(
+        (int(offsets[-1]), storage.ENCODING_DIMENSION), GALLERY_DTYPE
+    )
+    norms = np.empty(len(matrix), GALLERY_DTYPE)
+    for i, part in enumerate(parts):
+        start, end = int(offsets[i]), int(offsets[i + 1])
+        if start == end:
+            continue
+        if isinstance(part, tuple):
+            assert previous is not None
+            matrix[start:end] = previous.encodings[part[0] : part[1]]
+            norms[start:end] = previous.norms[part[0] : part[1]]
+        else:
+            matrix[start:end] = part
+            norms[start:end] = np.einsum(
+                "ij,ij->i", matrix[start:end], matrix[start:end]
+            )
+    return GalleryIndex(indexed_images, hashes, offsets, matrix, norms)
+
+
+def previous_rows(previous: GalleryIndex, index: GalleryIndex) -> Any:
+    """Maps the rows of an updated gallery index to the rows of the previous
+    index they were taken from.
+
+    :param previous: The previous index.
+
+    :param index: The updated index.
+
+    :return: The row of `previous` for each row of `index` (`-1` for the rows
+        of new or modified images).
+    """
+    import numpy as np
+
+    previous_starts: dict[str, int] = {}
+    for i, image_hash in enumerate(previous.hashes):
+        previous_starts[image_hash] = int(previous.offsets[i])
+    starts = np.array(
+        [previous_starts.get(image_hash, -1) for image_hash in index.hashes],
+        dtype=np.int64,
+    )
+    counts = np.diff(index.offsets)
+    rows = np.arange(index.faces, dtype=np.int64)
+    rows += np.repeat(starts - index.offsets[:-1], counts)
+    rows[np.repeat(starts < 0, counts)] = -1
+    return rows
+
+
+def train_ivf_index(root_dir: str, index: GalleryIndex) -> ivf.IvfIndex:
+    """Builds the approximate index of a gallery index and stores it.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param index: The stored gallery index.
+
+    :return: The approximate index.
+    """
+    ivf_index = ivf.build_ivf_index(index.encodings)
+    ivf_index.generation = index.generation
+    ivf.save_ivf_index(root_dir, ivf_index)
+    return ivf_index
+
+
+def load_ivf_index(root_dir: str, index: GalleryIndex) -> ivf.IvfIndex:
+    """Returns the approximate index of a gallery index, building it if it is
+    missing or outdated or if the gallery has grown too much since the index
+    was trained.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param index: The stored gallery index.
+
+    :return: The approximate index.
+    """
+    ivf_index = ivf.read_ivf_index(root_dir)
+    if (
+        ivf_index is None
+        or ivf_index.generation != index.generation
+        or ivf.needs_training(ivf_index, index.faces)
+    ):
+        ivf_index = train_ivf_index(root_dir, index)
+    return ivf_index
+
+
+def update_gallery_index(
+    root_dir: str, images: list[tuple[str, str]]
+) -> GalleryIndex:
+    """Returns the up-to-date gallery index, updating the stored index if the
+    images or their content changed.
+
+    An existing approximate index is updated as well: the faces of new images
+    are added to it, or it is trained again if the gallery has grown too much.
+
+    :param root_dir: The root directory containing the cache.
+
+    :param images: The images of the gallery (absolute paths) and their
+        content hashes.
+
+    :return: The gallery index.
+    """
+    previous = read_gallery_index(root_dir)
+    if (
+        previous is not None
+        and list(zip(previous.images, previous.hashes)) == images
+    ):
+        return previous
+    index = build_gallery_index(root_dir, images, previous)
+    save_gallery_index(root_dir, index)
+
+    ivf_index = ivf.read_ivf_index(root_dir)
+    if ivf_index is None:
+        return index
+    if (
+        previous is not None
+        and ivf_index.generation == previous.generation
+        and not ivf.needs_training(ivf_index, index.faces)
+    ):
+        ivf_index = ivf.update_ivf_index(
+            ivf_index, index.encodings, previous_rows(previous, index)
+        )
+        ivf_index.generation = index.generation
+        ivf.save_ivf_index(root_dir, ivf_index)
+    else:
+        train_ivf_index(root_dir, index)
+    return index
+
+
+def face_distances(encodings: Any, norms: Any, query: Any) -> Any:
+    """Calculates the euclidean distance of faces to the closest face in
+    question.
+
+    :param encodings: The faces (one per row).
+
+    :param norms: The squared euclidean norm of each face.
+
+    :param query: The faces in question (one per row).
+
+    :return: The distance of each face.
+    """
+    import numpy as np
+
+    # |a - b|^2 = |a|^2 + |b|^2 - 2ab, for all faces at once
+    squared = encodings @ (-2.0 * query.T)
+    squared += norms[:, np.newaxis]
+    squared += np.einsum("ij,ij->i", query, query)[np.newaxis, :]
+    return np.sqrt(np.maximum(squared.min(axis=1), 0.0))
+
+
+def search_gallery(
+    index: GalleryIndex,
+    query_encodings: Any,
+    tolerance: float,
+    limit: int | None = None,
+    ivf_index: ivf.IvfIndex | None = None,
+    nprobe: int = ivf.DEFAULT_NPROBE,
+) -> list[tuple[str, float]]:
+    """Finds the images showing any of the faces in question.
+
+    Without an approximate index, the euclidean distances of all faces of the
+    gallery are calculated with a single matrix product over the
+    (memory-mapped) gallery matrix. With an approximate index, only the faces
+    in the closest lists are compared; their distances are exact, but matching
+    faces in other lists are missed.
+
+    :param index: The gallery index.
+
+    :param query_encodings: The encodings of the faces to search for (one per
+        row).
+
+    :param tolerance: The maximum distance to be considered a match.
+
+    :param limit: The maximum number of images returned.
+
+    :param ivf_index: The approximate index of the gallery index.
+
+    :param nprobe: The number of lists of the approximate index searched for
+        each face. If it is at least the number of lists, all faces are
+        compared.
+
+    :return: The matching images and the distance of their closest face,
+        closest first.
+    """
+    import numpy as np
+
+    query = np.asarray(query_encodings, dtype=GALLERY_DTYPE).reshape(
+        (-1, storage.ENCODING_DIMENSION)
+    )
+    if index.faces == 0 or len(query) == 0:
+        return []
+
+    if ivf_index is not None and nprobe < ivf_index.lists:
+        rows = ivf.probe(ivf_index, query, nprobe)
+        if len(rows) == 0:
+            return []
+        distances = face_distances(
+            index.encodings[rows], index.norms[rows], query
+        )
+        # The rows are sorted, so the rows of every image are adjacent
+        row_images = np.searchsorted(index.offsets, rows, side="right") - 1
+        starts = np.flatnonzero(np.diff(row_images, prepend=-1))
+        image_ids = row_images[starts]
+    else:
+        distances = face_distances(index.encodings, index.norms, query)
+        # Images without faces have no rows
+        image_ids = np.flatnonzero(np.diff(index.offsets))
+        starts = index.offsets[image_ids]
+
+    # The closest face of every image
+    image_distances = np.minimum.reduceat(distances, starts)
+    matches = np.flatnonzero(image_distances <= tolerance)
+    order = matches[np.argsort(image_distances[matches], kind="stable")]
+    if limit is not None:
+        order = order[:limit]
+    return [
+        (index.images[image_ids[i]], float(image_distances[i])) for i in order
+    ]
@@ -0,0 +1,423 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The classification server.
+
+`cutyx serve` keeps the face model, the album indexes and the cache state of a
+gallery loaded and answers requests on a Unix domain socket. The CLI forwards
+commands to a running server transparently and falls back to processing them
+itself if no server is running or the server serves another gallery.
+
+The protocol consists of JSON lines: every request is a single line containing
+an object with the `command` and its `args`, which is answered by a single line
+containing either `{"ok": true, "result": ...}` or
+`{"ok": false, "error": "...", "unsupported": bool}`. Unsupported requests are
+processed by the CLI itself.
+"""
+
+import json
+import os
+import os.path
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import tempfile
+from typing import Any, Callable
+
+from rich import print
+
+from cutyx import lib
+from cutyx.__version__ import __version__
+from cutyx.exceptions import FacesException
+from cutyx.faces import DetectionOptions
+from cutyx.watch import Watcher
+
+SOCKET_ENV_VAR = "CUTYX_SOCKET"
+"""Environment variable overriding the path of the server socket."""
+
+CONNECT_TIMEOUT_SECONDS = 1.0
+"""Time to wait for the connection to a server."""
+
+RESPONSE_TIMEOUT_SECONDS = 600.0
+"""Time to wait for the response of a server, after which the command is
+processed locally."""
+
+TIMEOUT_ENV_VAR = "CUTYX_SERVER_TIMEOUT"
+"""Environment variable overriding the time to wait for a response (seconds)."""
+
+
+def default_socket_path() -> str:
+    """Returns the path of the server socket.
+
+    Defaults to `cutyx-<uid>.sock` in the runtime directory of the user and can
+    be changed with the `CUTYX_SOCKET` environment variable.
+    """
+    path = os.environ.get(SOCKET_ENV_VAR)
+    if path:
+        return path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(runtime_dir, f"cutyx-{os.getuid()}.sock")
+
+
+def is_own_socket(path: str) -> bool:
+    """Returns whether a path is a socket of the current user.
+
+    Sockets of other users are never used, as the default path in the
+    temporary directory could be created by anyone to intercept requests.
+    """
+    try:
+        path_stat = os.stat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(path_stat.st_mode) and path_stat.st_uid == os.getuid()
+
+
+class UnsupportedRequest(FacesException):
+    """The server can not process a request, the client has to process it."""
+
+
+class ClassificationServer:
+    """Processes the requests for a loaded gallery."""
+
+    def __init__(self, watcher: Watcher) -> None:
+        """
+        :param watcher: The loaded gallery.
+        """
+        self.watcher = watcher
+        self.commands: dict[str, Callable[[dict[str, Any]], Any]] = {
+            "ping": self.ping,
+            "classify": self.classify,
+            "process-images": self.process_images,
+            "match-names": self.match_names,
+            "match-faces": self.match_faces,
+        }
+
+    def handle(self, request: dict[str, Any]) -> dict[str, Any]:
+        """Processes a single request.
+
+        :param request: The request with the `command` and its `args`.
+
+        :return: The response.
+        """
+        command = self.commands.get(request.get("command", ""))
+        if command is None:
+            return {
+                "ok": False,
+                "error": f"Unknown command '{request.get('command')}'.",
+                "unsupported": True,
+            }
+        try:
+            result = command(request.get("args", {}))
+        except UnsupportedRequest as e:
+            return {"ok": False, "error": str(e), "unsupported": True}
+        except (FacesException, OSError) as e:
+            return {"ok": False, "error": str(e), "unsupported": False}
+        except (KeyError, TypeError, ValueError) as e:
+            # Malformed arguments
+            return {
+                "ok": False,
+                "error": f"Invalid request ({type(e).__name__}: {e}).",
+                "unsupported": False,
+            }
+        finally:
+            self.watcher.save()
+        return {"ok": True, "result": result}
+
+    def ping(self, args: dict[str, Any]) -> Any:
+        """Returns the version and the directories of the server."""
+        return {
+            "version": __version__,
+            "root_dir": self.watcher.root_dir,
+            "albums_root_dir": self.watcher.albums_root_dir,
+        }
+
+    def classify(self, args: dict[str, Any]) -> Any:
+        """Returns the matching albums of `images` without changing the albums."""
+        images = self._images(args)
+        self.watcher.refresh()
+        self.watcher.update_cache(images)
+        return {
+            image: [list(match) for match in self.watcher.classify(image)]
+            for image in images
+        }
+
+    def process_images(self, args: dict[str, Any]) -> Any:
+        """Classifies `images` and synchronises them in all albums (see
+        `lib.process_images`)."""
+        images = self._images(args)
+        self._check_albums_root_dir(args.get("albums_root_dir"))
+        root_dir = args.get("root_dir")
+        if root_dir is not None and os.path.abspath(root_dir) != (
+            self.watcher.root_dir
+        ):
+            raise UnsupportedRequest("The server uses another cache.")
+        link_mode = lib.get_link_mode(link_mode=args.get("link_mode"))
+        self.watcher.refresh()
+        report = self.watcher.update_images(images, link_mode=link_mode)
+        return {
+            "added": report.added,
+            "updated": report.updated,
+            "removed": report.removed,
+            "unchanged": report.unchanged,
+        }
+
+    def match_names(self, args: dict[str, Any]) -> Any:
+        """Adds a name rule to an album (see `lib.match_names`)."""
+        album_dir = self._album_dir(args)
+        lib.match_names(
+            album_dir,
+            args["text"],
+            use_regex=args.get("use_regex", False),
+            use_fuzzy=args.get("use_fuzzy", False),
+            fuzzy_min_ratio=args.get("fuzzy_min_ratio", 60),
+            rule_name=args.get("rule_name"),
+            quiet=True,
+        )
+        self.watcher.reload_albums([album_dir])
+        return None
+
+    def match_faces(self, args: dict[str, Any]) -> Any:
+        """Adds the faces of a training image to an album (see `lib.match_faces`)."""
+        album_dir = self._album_dir(args)
+        lib.match_faces(
+            album_dir,
+            args["training_image_path"],
+            training_data_prefix=args.get("training_data_prefix"),
+            quiet=True,
+            detection=self.watcher.detection,
+        )
+        self.watcher.reload_albums([album_dir])
+        return None
+
+    def _images(self, args: dict[str, Any]) -> list[str]:
+        """Returns the absolute paths of the images of a request, which have to
+        be located in the root directory of the server."""
+        images = [os.path.abspath(image) for image in args.get("images", [])]
+        for image in images:
+            if not image.startswith(self.watcher.root_dir + os.sep):
+                raise UnsupportedRequest(
+                    f"Image '{image}' is not located in the root directory "
+                    "of the server."
+                )
+            lib.check_valid_image(image)
+        return images
+
+    def _check_albums_root_dir(self, albums_root_dir: str | None) -> None:
+        """Requires the albums root of a request to be the one of the server."""
+        if albums_root_dir is not None and (
+            os.path.abspath(albums_root_dir) != self.watcher.albums_root_dir
+        ):
+            raise UnsupportedRequest("The server uses another albums root.")
+
+    def _album_dir(self, args: dict[str, Any]) -> str:
+        """Returns the album of a request, which has to be located in the albums
+        root of the server."""
+        album_dir = os.path.abspath(str(args["album_dir"]))
+        root = self.watcher.albums_root_dir
+        if album_dir != root and not album_dir.startswith(root + os.sep):
+            raise UnsupportedRequest(
+                "The album is not located in the albums root of the server."
+            )
+        return album_dir
+
+
+def read_message(f: Any) -> Any:
+    """Reads a single JSON line.
+
+    :return: The decoded message or `None` at the end of the stream.
+    """
+    line = f.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+def write_message(f: Any, message: Any) -> None:
+    """Writes a single JSON line."""
+    f.write(json.dumps(message).encode("utf-8") + b"\n")
+    f.flush()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Answers all requests of a connection."""
+
+    server: "_UnixServer"
+
+    def handle(self) -> None:
+        while True:
+            try:
+                request = read_message(self.rfile)
+                valid = request is None or isinstance(request, dict)
+            except ValueError:
+                valid = False
+            if not valid:
+                write_message(
+                    self.wfile, {"ok": False, "error": "Invalid request."}
+                )
+                return
+            if request is None:
+                return
+            write_message(
+                self.wfile, self.server.classification_server.handle(request)
+            )
+
+
+class _UnixServer(socketserver.UnixStreamServer):
+    """A Unix socket server processing one connection at a time."""
+
+    def __init__(
+        self, path: str, classification_server: ClassificationServer
+    ) -> None:
+        self.classification_server = classification_server
+        super().__init__(path, _RequestHandler)
+
+    def server_bind(self) -> None:
+        # The socket is created accessible by the current user only, there is
+        # no time span in which other users could connect
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+
+def serve(
+    root_dir: str = ".",
+    albums_root_dir: str = ".",
+    socket_path: str | None = None,
+    link_mode: str = "copy",
+    quiet: bool = False,
+    detection: DetectionOptions | None = None,
+) -> None:
+    """Runs the classification server until interrupted.
+
+    :param socket_path: The path of the server socket. See
+        `default_socket_path` if `None`.
+
+    See `watch.Watcher` for the other parameters.
+    """
+    if socket_path is None:
+        socket_path = default_socket_path()
+    if request("ping", socket_path=socket_path) is not None:
+        raise FacesException(
+            f"A server is already running on the socket '{socket_path}'."
+        )
+    if os.path.lexists(socket_path):
+        if not is_own_socket(socket_path):
+            raise FacesException(
+                f"The path '{socket_path}' is no socket of the current user."
+            )
+        os.remove(socket_path)
+
+    watcher = Watcher(
+        root_dir,
+        albums_root_dir,
+        link_mode=link_mode,
+        quiet=quiet,
+        detection=detection,
+    )
+    watcher.start(update_albums=False)
+    server = _UnixServer(socket_path, ClassificationServer(watcher))
+    print(
+        f"[green]++ Serving '{watcher.root_dir}' on '{socket_path}' ++[/green]"
+    )
+    # Terminate gracefully (removing the socket) on SIGTERM as well
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        watcher.save()
+
+
+def response_timeout() -> float:
+    """Returns the time to wait for the response of a server in seconds.
+
+    Defaults to `RESPONSE_TIMEOUT_SECONDS` and can be changed with the
+    `CUTYX_SERVER_TIMEOUT` environment variable.
+    """
+    value = os.environ.get(TIMEOUT_ENV_VAR)
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            raise FacesException(
+                f"Invalid server timeout '{value}' in {TIMEOUT_ENV_VAR}."
+            )
+    return RESPONSE_TIMEOUT_SECONDS
+
+
+def request(
+    command: str,
+    args: dict[str, Any] | None = None,
+    socket_path: str | None = None,
+    timeout: float | None = None,
+) -> Any:
+    """Sends a request to a running server.
+
+    :param command: The command.
+
+    :param args: The arguments of the command.
+
+    :param socket_path: The path of the server socket. See
+        `default_socket_path` if `None`.
+
+    :param timeout: The time to wait for the response in seconds. See
+        `response_timeout` if `None`.
+
+    :return: The response or `None` if no server of the current user is
+        running or it did not answer properly in time.
+    """
+    if socket_path is None:
+        socket_path = default_socket_path()
+    if timeout is None:
+        timeout = response_timeout()
+    if not is_own_socket(socket_path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(CONNECT_TIMEOUT_SECONDS)
+            sock.connect(socket_path)
+            sock.settimeout(timeout)
+            with sock.makefile("rwb") as f:
+                write_message(f, {"command": command, "args": args or {}})
+                response = read_message(f)
+    except (OSError, ValueError):
+        # Includes timeouts and malformed or truncated responses
+        return None
+    if not isinstance(response, dict):
+        return None
+    return response
+
+
+def forward(
+    command: str, args: dict[str, Any], socket_path: str | None = None
+) -> Any:
+    """Forwards a command to a running server.
+
+    :return: The response of the server or `None` if the command has to be
+        processed locally (no server running or the request is unsupported).
+    """
+    response = request(command, args, socket_path=socket_path)
+    if response is None or response.get("unsupported"):
+        return None
+    if not response.get("ok"):
+        raise FacesException(response.get("error", "Server error."))
+    return response
@@ -0,0 +1,282 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""The SQLite store of the cache.
+
+Instead of one file per image, all face encodings are stored in a single
+database file (in WAL mode, so readers do not block the writer) together with
+the fingerprint index::
+
+    encodings(image_hash, encodings, backend, created, accessed)
+    fingerprints(path, size, mtime_ns, inode, image_hash)
+
+The encodings are stored in the format of `cutyx.storage`. Writes are committed
+in batches (see `COMMIT_BATCH_SIZE` and `COMMIT_INTERVAL_SECONDS`) and when the
+cache is flushed, so updating the cache does not wait for a commit per image.
+"""
+
+import os
+import os.path
+import sqlite3
+import threading
+import time
+from typing import Any, Iterator
+
+from cutyx import storage
+from cutyx.exceptions import FacesException
+
+SCHEMA_VERSION = 1
+
+COMMIT_BATCH_SIZE = 256
+"""Maximum number of written entries per transaction."""
+
+COMMIT_INTERVAL_SECONDS = 1.0
+"""Maximum time written entries stay uncommitted while the cache is updated."""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS encodings (
+    image_hash TEXT PRIMARY KEY,
+    encodings BLOB NOT NULL,
+    backend TEXT,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS encodings_accessed ON encodings (accessed);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    image_hash TEXT NOT NULL
+);
+"""
+
+
+class SqliteCache:
+    """A cache database. The methods may be called from several threads."""
+
+    def __init__(
+        self,
+        path: str,
+        backend: str | None = None,
+        access_interval: float = 0,
+    ) -> None:
+        """
+        :param path: The database file (created if it does not exist).
+
+        :param backend: The identity of the face backend stored with new
+            entries.
+
+        :param access_interval: Minimum time in seconds between two updates
+            of the last access time of an entry.
+        """
+        self.path = path
+        self.backend = backend
+        self.access_interval = access_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.RLock()
+        self._pending = 0
+        self._transaction_start = 0.0
+        self._accessed: set[str] = set()
+        # Transactions are started explicitly to batch the writes
+        self._connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        try:
+            self._setup()
+        except sqlite3.DatabaseError as e:
+            self._connection.close()
+            raise FacesException(f"Cache database '{path}' is unusable: {e}")
+
+    def _setup(self) -> None:
+        connection = self._connection
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            raise sqlite3.DatabaseError(f"unsupported version {version}")
+        # Only effective before the first table is created, afterwards the
+        # file shrinks when entries are removed
+        connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.executescript(_SCHEMA)
+        connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _begin(self) -> None:
+        if not self._connection.in_transaction:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._transaction_start = time.monotonic()
+
+    def _commit(self) -> None:
+        if self._connection.in_transaction:
+            self._connection.execute("COMMIT")
+        self._pending = 0
+
+    def _mark_accessed(self, image_hash: str, accessed: float) -> None:
+        if time.time() - accessed > self.access_interval:
+            self._accessed.add(image_hash)
+
+    def contains(self, image_hash: str) -> bool:
+        """Checks whether the encodings of an image are stored.
+
+        :param image_hash: The hash of the image content.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT accessed FROM encodings WHERE image_hash = ?",
+                (image_hash,),
+            ).fetchone()
+            if row is None:
+                return False
+            self._mark_accessed(image_hash, row[0])
+            return True
+
+    def read(self, image_hash: str) -> Any | None:
+        """Reads the face encodings of an image.
+
+        :param image_hash: The hash of the image content.
+
+        :return: A matrix of the face encodings or `None` if the image is not
+            stored (or the entry is unreadable).
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT encodings, accessed FROM encodings"
+                " WHERE image_hash = ?",
+                (image_hash,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._mark_accessed(image_hash, row[1])
+        try:
+            return storage.unpack_encodings(
+                row[0], f"Cache entry '{image_hash}'"
+            )
+        except FacesException:
+            return None
+
+    def write(
+        self, image_hash: str, encodings: Any, accessed: float | None = None
+    ) -> None:
+        """Stores the face encodings of an image.
+
+        The entry is committed with the next batch (or `flush`). Writers have
+        to flush when they pause writing, the database is locked until the
+        entries are committed.
+
+        :param image_hash: The hash of the image content.
+
+        :param encodings: The face encodings of the image.
+
+        :param accessed: The last access time of the entry (defaults to now).
+        """
+        data = storage.pack_encodings(encodings)
+        now = time.time()
+        with self._lock:
+            self._begin()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO encodings VALUES (?, ?, ?, ?, ?)",
+                (
+                    image_hash,
+                    data,
+                    self.backend,
+                    now,
+                    accessed if accessed is not None else now,
+                ),
+            )
+            self._accessed.discard(image_hash)
+            self._pending += 1
+            if (
+                self._pending >= COMMIT_BATCH_SIZE
+                or time.monotonic() - self._transaction_start
+                > COMMIT_INTERVAL_SECONDS
+            ):
+                self._commit()
+
+    def flush(self) -> None:
+        """Commits all written entries and the access times of read
+        entries."""
+        with self._lock:
+            if self._accessed:
+                self._begin()
+                now = time.time()
+                self._connection.executemany(
+                    "UPDATE encodings SET accessed = ? WHERE image_hash = ?",
+                    ((now, image_hash) for image_hash in self._accessed),
+                )
+                self._accessed.clear()
+            self._commit()
+
+    def entries(self) -> Iterator[tuple[str, int, float]]:
+        """Lists the stored entries.
+
+        :return: The content hash, the size in bytes and the last access time
+            of each entry.
+        """
+        with self._lock:
+            self.flush()
+            rows = self._connection.execute(
+                "SELECT image_hash, length(encodings), accessed FROM encodings"
+            ).fetchall()
+        for image_hash, size, accessed in rows:
+            yield image_hash, size, accessed
+
+    def remove(self, image_hashes: list[str]) -> None:
+        """Removes entries and releases their space.
+
+        :param image_hashes: The content hashes of the entries.
+        """
+        with self._lock:
+            self._begin()
+            self._connection.executemany(
+                "DELETE FROM encodings WHERE image_hash = ?",
+                ((image_hash,) for image_hash in image_hashes),
+            )
+            self._accessed.difference_update(image_hashes)
+            self._commit()
+            # Run to completion (`execute` would release a single page only)
+            self._connection.executescript("PRAGMA incremental_vacuum;")
+
+    def read_fingerprints(self) -> dict[str, list[Any]]:
+        """Reads the fingerprint index (see `cutyx.fingerprints`).
+
+        :return: The content hash and the fingerprint by path.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, size, mtime_ns, inode, image_hash"
+                " FROM fingerprints"
+            ).fetchall()
+        return {row[0]: list(row[1:]) for row in rows}
+
+    def write_fingerprints(self, entries: dict[str, list[Any]]) -> None:
+        """Replaces the fingerprint index.
+
+        :param entries: The content hash and the fingerprint by path.
+        """
+        with self._lock:
+            self._begin()
+            self._connection.execute("DELETE FROM fingerprints")
+            self._connection.executemany(
+                "INSERT INTO fingerprints VALUES (?, ?, ?, ?, ?)",
+                ((path, *entry) for path, entry in entries.items()),
+            )
+            self._commit()
+
+    def close(self) -> None:
+        """Flushes and closes the database."""
+        with self._lock:
+            self.flush()
+            self._connection.close()
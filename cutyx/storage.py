@@ -0,0 +1,246 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Storage format of face encodings.
+
+All face encodings of one image are stored in a single file with a small,
+fixed-size header followed by the raw encodings as little-endian float matrix
+(one encoding per row)::
+
+    magic     8 bytes   b"CUTYXENC"
+    version   uint16
+    dtype     uint8     1 = float32, 2 = float64
+    reserved  uint8
+    count     uint32    number of encodings (rows)
+    dimension uint32    size of a single encoding (columns)
+    padding   12 bytes  (the data starts at offset 32)
+
+The same format is used for the encodings stored in the cache database (see
+`cutyx.sqlite_cache`).
+
+Older versions of `CutyX` stored every encoding in its own file as pickled
+object embedded in JSON. These files can still be read and migrated.
+"""
+
+import json
+import os
+import os.path
+import struct
+from typing import Any
+
+from cutyx.constants import LEGACY_ENCODING_FILE_EXT
+from cutyx.exceptions import FacesException
+
+ENCODINGS_MAGIC = b"CUTYXENC"
+ENCODINGS_FORMAT_VERSION = 1
+ENCODINGS_HEADER = struct.Struct("<8sHBBII12x")
+ENCODING_DIMENSION = 128
+
+_DTYPE_CODES: dict[int, str] = {1: "<f4", 2: "<f8"}
+
+
+def _dtype_code(dtype: Any) -> int:
+    import numpy as np
+
+    for code, known_dtype in _DTYPE_CODES.items():
+        if np.dtype(dtype) == known_dtype:
+            return code
+    raise FacesException(f"Unsupported encoding data type '{dtype}'.")
+
+
+def _encodings_matrix(encodings: Any, code: int) -> Any:
+    import numpy as np
+
+    dtype = _DTYPE_CODES[code]
+    if isinstance(encodings, np.ndarray) and encodings.ndim == 2:
+        # Large matrices are not copied row by row
+        return np.ascontiguousarray(encodings, dtype=dtype)
+    if len(encodings) == 0:
+        return np.empty((0, ENCODING_DIMENSION), dtype=dtype)
+    return np.vstack([np.asarray(e, dtype=dtype) for e in encodings])
+
+
+def _pack_header(code: int, data: Any) -> bytes:
+    return ENCODINGS_HEADER.pack(
+        ENCODINGS_MAGIC,
+        ENCODINGS_FORMAT_VERSION,
+        code,
+        0,
+        data.shape[0],
+        data.shape[1],
+    )
+
+
+def pack_encodings(encodings: Any, dtype: Any = "<f8") -> bytes:
+    """Serialises all face encodings of an image (header and data).
+
+    :param encodings: The face encodings (a list of encodings or a matrix).
+
+    :param dtype: The floating point type to store the encodings with
+        (`float32` or `float64`).
+
+    :return: The serialised encodings.
+    """
+    code = _dtype_code(dtype)
+    data = _encodings_matrix(encodings, code)
+    packed: bytes = _pack_header(code, data) + data.tobytes()
+    return packed
+
+
+def unpack_encodings(data: bytes, name: str = "Encodings") -> Any:
+    """Deserialises the face encodings serialised with `pack_encodings`.
+
+    :param data: The serialised encodings.
+
+    :param name: Describes the origin of the data for error messages.
+
+    :return: A read-only matrix with one encoding per row.
+    """
+    import numpy as np
+
+    if len(data) < ENCODINGS_HEADER.size:
+        raise FacesException(f"{name} is truncated.")
+    magic, version, code, _, count, dimension = ENCODINGS_HEADER.unpack_from(
+        data
+    )
+    if magic != ENCODINGS_MAGIC:
+        raise FacesException(f"{name} contains no encodings.")
+    if version != ENCODINGS_FORMAT_VERSION or code not in _DTYPE_CODES:
+        raise FacesException(f"{name} has an unsupported format.")
+    dtype = np.dtype(_DTYPE_CODES[code])
+    if len(data) != ENCODINGS_HEADER.size + count * dimension * dtype.itemsize:
+        raise FacesException(f"{name} is truncated.")
+    return np.frombuffer(
+        data, dtype, count=count * dimension, offset=ENCODINGS_HEADER.size
+    ).reshape((count, dimension))
+
+
+def write_encodings(path: str, encodings: Any, dtype: Any = "<f8") -> None:
+    """Writes all face encodings of an image to a single file.
+
+    The file is written to a temporary file first and then moved into place,
+    so readers never see a partially written file.
+
+    :param path: The output file.
+
+    :param encodings: The face encodings (a list of encodings or a matrix).
+
+    :param dtype: The floating point type to store the encodings with
+        (`float32` or `float64`).
+    """
+    code = _dtype_code(dtype)
+    data = _encodings_matrix(encodings, code)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_pack_header(code, data))
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def read_encodings(path: str, mmap: bool = True) -> Any:
+    """Reads all face encodings of an image.
+
+    :param path: The encodings file.
+
+    :param mmap: Whether to memory-map the file instead of reading it.
+
+    :return: A read-only matrix with one encoding per row.
+    """
+    import numpy as np
+
+    with open(path, "rb") as f:
+        header = f.read(ENCODINGS_HEADER.size)
+        if len(header) != ENCODINGS_HEADER.size:
+            raise FacesException(f"Encodings file '{path}' is truncated.")
+        magic, version, code, _, count, dimension = ENCODINGS_HEADER.unpack(
+            header
+        )
+        if magic != ENCODINGS_MAGIC:
+            raise FacesException(f"File '{path}' is no encodings file.")
+        if version != ENCODINGS_FORMAT_VERSION or code not in _DTYPE_CODES:
+            raise FacesException(
+                f"Encodings file '{path}' has an unsupported format."
+            )
+        dtype = np.dtype(_DTYPE_CODES[code])
+        if count == 0:
+            return np.empty((0, dimension), dtype=dtype)
+        if mmap:
+            try:
+                return np.memmap(
+                    f,
+                    dtype=dtype,
+                    mode="r",
+                    offset=ENCODINGS_HEADER.size,
+                    shape=(count, dimension),
+                )
+            except ValueError:
+                raise FacesException(f"Encodings file '{path}' is truncated.")
+        # The buffer of the read bytes is immutable, hence the array as well
+        data = np.frombuffer(f.read(count * dtype.itemsize * dimension), dtype)
+        if len(data) != count * dimension:
+            raise FacesException(f"Encodings file '{path}' is truncated.")
+        return data.reshape((count, dimension))
+
+
+def read_legacy_encodings(legacy_dir: str) -> Any:
+    """Reads face encodings stored in the legacy format (one pickled encoding
+    per file).
+
+    :param legacy_dir: The directory containing the legacy encoding files.
+
+    :return: A matrix with one encoding per row.
+    """
+    import pickle
+
+    import numpy as np
+
+    encodings = []
+    for file in sorted(os.listdir(legacy_dir)):
+        if not file.endswith(LEGACY_ENCODING_FILE_EXT):
+            continue
+        with open(os.path.join(legacy_dir, file), "r") as f:
+            encodings.append(
+                pickle.loads(json.loads(f.read()).encode("latin-1"))
+            )
+    if not encodings:
+        return np.empty((0, ENCODING_DIMENSION), dtype=np.float64)
+    return np.vstack([np.asarray(e, dtype=np.float64) for e in encodings])
+
+
+def has_legacy_encodings(directory: str) -> bool:
+    """Checks whether a directory contains encodings in the legacy format."""
+    return any(
+        f.endswith(LEGACY_ENCODING_FILE_EXT) for f in os.listdir(directory)
+    )
+
+
+def migrate_legacy_encodings(legacy_dir: str, path: str) -> Any:
+    """Converts encodings in the legacy format to a single encodings file.
+
+    The legacy files are removed after the new file was written.
+
+    :param legacy_dir: The directory containing the legacy encoding files.
+
+    :param path: The encodings file to be written.
+
+    :return: The migrated encodings.
+    """
+    encodings = read_legacy_encodings(legacy_dir)
+    write_encodings(path, encodings)
+    for file in os.listdir(legacy_dir):
+        if file.endswith(LEGACY_ENCODING_FILE_EXT):
+            os.remove(os.path.join(legacy_dir, file))
+    return encodings
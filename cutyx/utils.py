@@ -19,6 +19,12 @@ import os
 import os.path
 import shutil
 
+LINK_MODES = ("copy", "symlink", "hardlink", "reflink")
+"""The supported ways to add an image to an album."""
+
+FICLONE = 0x40049409
+"""The Linux ioctl cloning a whole file (`_IOW(0x94, 9, int)`)."""
+
 
 def copyfile(src: str, dest: str) -> None:
     """Copies a file.
@@ -53,3 +59,88 @@ def mksymlink(target: str, linkpath: str) -> None:
     except FileNotFoundError:
         pass
     os.symlink(os.path.relpath(target, os.path.dirname(linkpath)), linkpath)
+
+
+def mkhardlink(target: str, linkpath: str) -> None:
+    """Creates a hardlink. Falls back to cloning the file (see `clonefile`)
+    if the file system does not support hardlinks or both paths are on
+    different file systems.
+
+    :param target: The target file to be linked to.
+
+    :param linkpath: The path of the generated link.
+    """
+    try:
+        os.remove(linkpath)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(target, linkpath)
+    except OSError:
+        clonefile(target, linkpath)
+
+
+def clonefile(src: str, dest: str) -> None:
+    """Copies a file, sharing the data blocks with the source file if possible.
+
+    On file systems supporting it (e.g. btrfs or XFS) a copy-on-write clone
+    (reflink) is created, which takes neither time nor space. Otherwise the data
+    is copied inside the kernel with `copy_file_range` and finally with a
+    regular copy.
+
+    :param src: The source file.
+
+    :param dest: The target file.
+    """
+    try:
+        os.remove(dest)
+    except FileNotFoundError:
+        pass
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+        if not _reflink(fsrc.fileno(), fdest.fileno()):
+            if not _copy_file_range(fsrc.fileno(), fdest.fileno()):
+                fdest.seek(0)
+                fdest.truncate()
+                fsrc.seek(0)
+                shutil.copyfileobj(fsrc, fdest)
+    shutil.copystat(
+        src,
+        dest,
+    )
+
+
+def _reflink(src_fd: int, dest_fd: int) -> bool:
+    """Clones a file with the `FICLONE` ioctl.
+
+    :return: `True` if the file was cloned.
+    """
+    try:
+        import fcntl
+
+        fcntl.ioctl(dest_fd, FICLONE, src_fd)
+        return True
+    except (ImportError, OSError):
+        return False
+
+
+def _copy_file_range(src_fd: int, dest_fd: int) -> bool:
+    """Copies a file inside the kernel with `copy_file_range`.
+
+    :return: `True` if the file was copied.
+    """
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is None:
+        return False
+    size = os.fstat(src_fd).st_size
+    offset = 0
+    try:
+        while offset < size:
+            copied = copy_file_range(
+                src_fd, dest_fd, size - offset, offset, offset
+            )
+            if copied == 0:
+                break
+            offset += copied
+    except OSError:
+        return False
+    return offset == size
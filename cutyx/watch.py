@@ -0,0 +1,418 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Continuous classification of a gallery.
+
+The watcher keeps the album indexes, the name rules, the face model and the cache
+state loaded and classifies images as soon as they are added, modified or
+removed. A change of the rules of an album (in its faces directory) only
+re-evaluates that album.
+
+File system events are received with the optional `watchdog` package
+(`pip install cutyx[watch]`).
+"""
+
+import os
+import os.path
+import threading
+import time
+from typing import Any
+
+from rich import print
+
+from cutyx import albums, cache, lib, scanner
+from cutyx.constants import (
+    ALBUM_INDEX_FILE_NAME,
+    CACHE_BASE_NAME,
+    FACES_DIR_NAME,
+)
+from cutyx.exceptions import FacesException
+from cutyx.faces import DetectionOptions
+from cutyx.fingerprints import FingerprintIndex
+from cutyx.journal import DecisionJournal
+from cutyx.names import NameMatcher
+from cutyx.scanner import GallerySnapshot
+
+DEBOUNCE_SECONDS = 2.0
+"""Time without further events after which a changed file is processed, so that
+files are not read while they are still being written."""
+
+POLL_INTERVAL_SECONDS = 0.5
+"""Interval in which the collected events are checked."""
+
+
+class Watcher:
+    """The loaded state of a gallery which is kept up to date incrementally."""
+
+    def __init__(
+        self,
+        root_dir: str = ".",
+        albums_root_dir: str = ".",
+        link_mode: str = "copy",
+        use_cache: bool = True,
+        quiet: bool = False,
+        detection: DetectionOptions | None = None,
+    ) -> None:
+        """
+        :param root_dir: The root path containing the images to be organised.
+
+        :param albums_root_dir: The root path containing the albums.
+
+        :param link_mode: How images are added to the albums (see
+            `lib.get_link_mode`).
+
+        :param use_cache: Whether the cache should be used.
+
+        :param quiet: Whether additional verbose output should be generated.
+
+        :param detection: The face detection options (see `lib.update_cache`).
+        """
+        self.root_dir = os.path.abspath(root_dir)
+        self.albums_root_dir = os.path.abspath(albums_root_dir)
+        self.link_mode = lib.get_link_mode(link_mode=link_mode)
+        self.use_cache = use_cache
+        self.quiet = quiet
+        self.detection = detection
+        self.images: dict[str, None] = {}
+        self.album_indexes: dict[str, albums.AlbumIndex] = {}
+        self.fingerprints: FingerprintIndex | None = None
+        self.journal: DecisionJournal | None = None
+        self._training_data: Any = None
+        self._name_matcher = NameMatcher([])
+
+    def start(self, update_albums: bool = True) -> None:
+        """Scans the gallery and loads the albums.
+
+        :param update_albums: Whether to bring all albums up to date.
+        """
+        snapshot = scanner.scan(self.root_dir)
+        if self.albums_root_dir == self.root_dir:
+            albums_snapshot = snapshot
+        else:
+            albums_snapshot = scanner.scan(self.albums_root_dir)
+        self.images = dict.fromkeys(snapshot.images)
+        self.album_indexes = {
+            album_dir: albums.load_album_index(album_dir)
+            for album_dir in albums_snapshot.album_dirs
+        }
+        if self.use_cache:
+            self.fingerprints = FingerprintIndex.load(self.root_dir)
+            self.update_cache(list(self.images))
+            # The cached encodings are compared with the backend of the cache
+            self.detection = lib.resolve_detection_options(
+                self.root_dir, self.detection
+            )
+            self.journal = DecisionJournal.load(
+                self.root_dir, cache.read_cache_config(self.root_dir)
+            )
+        self._compile()
+        if update_albums:
+            self.update_albums(list(self.album_indexes))
+        self.save()
+
+    def save(self) -> None:
+        """Stores the fingerprints and decisions."""
+        if self.fingerprints is not None:
+            self.fingerprints.save()
+        if self.journal is not None:
+            self.journal.save()
+
+    def handle_changes(self, paths: set[str]) -> None:
+        """Processes changed paths.
+
+        :param paths: The created, modified, moved or deleted paths.
+        """
+        changed_albums: set[str] = set()
+        changed_images: set[str] = set()
+        for path in paths:
+            components = path.split(os.sep)
+            if FACES_DIR_NAME in components:
+                if os.path.basename(path).startswith(ALBUM_INDEX_FILE_NAME):
+                    continue
+                album_dir = os.sep.join(
+                    components[: components.index(FACES_DIR_NAME)]
+                )
+                if album_dir == self.albums_root_dir or album_dir.startswith(
+                    self.albums_root_dir + os.sep
+                ):
+                    changed_albums.add(album_dir)
+            elif CACHE_BASE_NAME in components:
+                continue
+            elif os.path.dirname(path) in self.album_indexes:
+                # Album contents (which are written by the watcher itself)
+                continue
+            elif os.path.isdir(path):
+                # A directory was created or moved into the gallery
+                if not scanner.is_ignored(
+                    self.root_dir, os.path.join(path, "-")
+                ):
+                    changed_images.update(scanner.scan(path).images)
+            elif scanner.has_image_extension(path):
+                if not scanner.is_ignored(self.root_dir, path):
+                    changed_images.add(path)
+            elif not os.path.exists(path):
+                # A directory was deleted or moved out of the gallery
+                changed_images.update(
+                    image
+                    for image in self.images
+                    if image.startswith(path + os.sep)
+                )
+
+        if changed_albums:
+            self.update_albums(self.reload_albums(sorted(changed_albums)))
+        if changed_images:
+            self.update_images(sorted(changed_images))
+        self.save()
+
+    def reload_albums(self, album_dirs: list[str]) -> list[str]:
+        """Loads the rules of new or changed albums again.
+
+        :param album_dirs: The album directories.
+
+        :return: The album directories which still exist.
+        """
+        for album_dir in album_dirs:
+            if os.path.isdir(os.path.join(album_dir, FACES_DIR_NAME)):
+                self.album_indexes[album_dir] = albums.load_album_index(
+                    album_dir
+                )
+            else:
+                self.album_indexes.pop(album_dir, None)
+        self._compile()
+        return [d for d in album_dirs if d in self.album_indexes]
+
+    def refresh(self) -> list[str]:
+        """Reloads the known albums whose rules were changed by someone else.
+
+        :return: The changed album directories which still exist.
+        """
+        changed = [
+            album_dir
+            for album_dir, index in self.album_indexes.items()
+            if index.signature != albums.faces_dir_signature(album_dir)
+        ]
+        if not changed:
+            return []
+        return self.reload_albums(changed)
+
+    def update_albums(self, album_dirs: list[str]) -> lib.SyncReport:
+        """Evaluates all images against the rules of some albums and synchronises
+        these albums.
+
+        :param album_dirs: The album directories.
+
+        :return: The changes done to the albums.
+        """
+        if not self.quiet and album_dirs:
+            print(
+                f"[green]++ Evaluate {len(self.images)} images for "
+                f"{len(album_dirs)} albums ++[/green]"
+            )
+        album_contents: dict[str, dict[str, str]] = {d: {} for d in album_dirs}
+        self._name_matcher.prepare(list(self.images))
+        selected = set(album_dirs)
+        for image in self.images:
+            for album_dir, _, _ in self.classify(image, album_dirs):
+                if album_dir in selected:
+                    album_contents[album_dir][os.path.basename(image)] = image
+        return lib.handle_sync(
+            album_contents, link_mode=self.link_mode, quiet=self.quiet
+        )
+
+    def update_images(
+        self, paths: list[str], link_mode: str | None = None
+    ) -> lib.SyncReport:
+        """Classifies changed images and synchronises them in all albums.
+
+        :param paths: The changed (or deleted) images.
+
+        :param link_mode: How images are added to the albums. Defaults to the
+            link mode of the watcher.
+
+        :return: The changes done to the albums.
+        """
+        existing = [path for path in paths if os.path.isfile(path)]
+        for path in paths:
+            if path in existing:
+                self.images[path] = None
+            else:
+                self.images.pop(path, None)
+        if not self.quiet:
+            print(f"[green]++ Process {len(paths)} changed images ++[/green]")
+        if existing:
+            self.update_cache(existing)
+
+        album_contents: dict[str, dict[str, str]] = {
+            d: {} for d in self.album_indexes
+        }
+        for image in existing:
+            for album_dir, _, _ in self.classify(image):
+                album_contents[album_dir][os.path.basename(image)] = image
+        return lib.handle_sync(
+            album_contents,
+            only_process_files=set(paths),
+            link_mode=link_mode or self.link_mode,
+            quiet=self.quiet,
+        )
+
+    def _compile(self) -> None:
+        """Compiles the rules of all albums."""
+        album_indexes = list(self.album_indexes.values())
+        self._training_data = lib.load_training_encodings(
+            album_indexes, self.detection
+        )
+        self._name_matcher = NameMatcher(album_indexes)
+
+    def update_cache(self, images: list[str]) -> None:
+        """Calculates the face encodings of images which are not cached yet."""
+        if self.fingerprints is None:
+            return
+        lib.update_cache(
+            self.root_dir,
+            quiet=True,
+            fingerprints=self.fingerprints,
+            detection=self.detection,
+            snapshot=GallerySnapshot(self.root_dir, images=images),
+        )
+
+    def classify(
+        self, image: str, album_dirs: list[str] | None = None
+    ) -> list[tuple[str, str, str]]:
+        """Evaluates the rules of the albums for an image.
+
+        :param image: The image (which has to be in the cache already if the
+            cache is used).
+
+        :param album_dirs: The albums to evaluate. All albums if `None`, more
+            albums may be returned if decisions are taken from the journal.
+
+        :return: The matching albums (see `lib.classify_image`).
+        """
+        if album_dirs is None:
+            album_dirs = list(self.album_indexes)
+        cache_root_dir = self.root_dir if self.use_cache else None
+        if self.journal is not None and self.fingerprints is not None:
+            # Decisions of albums with unchanged rules are taken from the journal
+            matched = lib.classify_image_with_journal(
+                image,
+                list(self.album_indexes.values()),
+                self.journal,
+                self.fingerprints,
+                cache_root_dir=cache_root_dir,
+                quiet=True,
+                training_data=self._training_data,
+                detection=self.detection,
+                name_matcher=self._name_matcher,
+            )
+        else:
+            matched = lib.classify_image(
+                image,
+                [self.album_indexes[d] for d in album_dirs],
+                cache_root_dir=cache_root_dir,
+                quiet=True,
+                training_data=self._training_data,
+                detection=self.detection,
+                name_matcher=self._name_matcher,
+            )
+        return matched
+
+
+class _EventCollector:
+    """Collects the paths of file system events (a `watchdog` event handler)."""
+
+    def __init__(self) -> None:
+        self.pending: dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def dispatch(self, event: Any) -> None:
+        paths = [event.src_path, getattr(event, "dest_path", "")]
+        with self.lock:
+            for path in paths:
+                if path:
+                    self.pending[os.fsdecode(path)] = time.monotonic()
+
+    def pop_settled(self, debounce: float) -> set[str]:
+        """Returns the paths without events during the last `debounce` seconds."""
+        now = time.monotonic()
+        with self.lock:
+            settled = {
+                path
+                for path, last_event in self.pending.items()
+                if now - last_event >= debounce
+            }
+            for path in settled:
+                del self.pending[path]
+        return settled
+
+
+def watch(
+    root_dir: str = ".",
+    albums_root_dir: str = ".",
+    link_mode: str = "copy",
+    use_cache: bool = True,
+    quiet: bool = False,
+    detection: DetectionOptions | None = None,
+    debounce: float = DEBOUNCE_SECONDS,
+) -> None:
+    """Watches a gallery and keeps its albums up to date until interrupted.
+
+    :param debounce: Time in seconds without further events after which a
+        changed file is processed.
+
+    See `Watcher` for the other parameters.
+    """
+    try:
+        from watchdog.observers import Observer  # type: ignore
+    except ImportError as e:
+        raise FacesException(
+            "Watching requires the 'watchdog' package "
+            "(install it with 'pip install cutyx[watch]')."
+        ) from e
+
+    watcher = Watcher(
+        root_dir,
+        albums_root_dir,
+        link_mode=link_mode,
+        use_cache=use_cache,
+        quiet=quiet,
+        detection=detection,
+    )
+    watcher.start()
+
+    collector = _EventCollector()
+    observer: Any = Observer()
+    observer.schedule(collector, watcher.root_dir, recursive=True)
+    if not watcher.albums_root_dir.startswith(watcher.root_dir + os.sep) and (
+        watcher.albums_root_dir != watcher.root_dir
+    ):
+        observer.schedule(collector, watcher.albums_root_dir, recursive=True)
+    observer.start()
+    print(f"[green]++ Watching '{watcher.root_dir}' for changes ++[/green]")
+    try:
+        while True:
+            time.sleep(POLL_INTERVAL_SECONDS)
+            paths = collector.pop_settled(debounce)
+            if not paths:
+                continue
+            try:
+                watcher.handle_changes(paths)
+            except (FacesException, OSError) as e:
+                print(f"[red]++ {e} ++[/red]")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        observer.stop()
+        observer.join()
+        watcher.save()
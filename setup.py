@@ -63,11 +63,12 @@ setup_info = dict(
         "console_scripts": ["cutyx=cutyx.cli:main"],
     },
     package_dir={"": "."},
-    packages=find_packages(where="."),
+    packages=find_packages(where=".", exclude=["benchmarks", "benchmarks.*"]),
     python_requires=">=3.10",
     install_requires=read_requirements("requirements.txt"),
     extras_require={
         "dev": read_requirements("requirements-dev.txt"),
+        "watch": read_requirements("requirements-watch.txt"),
     },
     cmdclass={},
 )
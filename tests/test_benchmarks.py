@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+
+from benchmarks.gallery import GalleryConfig
+from benchmarks.run import run_benchmark
+from cutyx.backends import read_fake_persons
+
+
+def album_files(album_dir: str) -> set[str]:
+    return {f for f in os.listdir(album_dir) if not f.startswith(".")}
+
+
+class TestBenchmark:
+    def test_run_on_small_gallery(self) -> None:
+        config = GalleryConfig(
+            images=60, albums=3, name_rules=3, depth=1, fanout=2
+        )
+        results = run_benchmark("bench", config)
+
+        assert [r.name for r in results] == [
+            "generate",
+            "scan",
+            "hash",
+            "encode",
+            "match-names",
+            "process",
+            "process-unchanged",
+            "process-changed",
+        ]
+        assert all(r.items == 60 and r.seconds >= 0 for r in results)
+
+        # The fake backend recognises the persons in the synthetic images,
+        # the first rule ('beach') belongs to the first album
+        expected = {
+            os.path.basename(image)
+            for root, _, files in os.walk("bench/gallery")
+            for image in (os.path.join(root, f) for f in files)
+            if image.endswith(".jpg")
+            and (0 in read_fake_persons(image) or "_beach" in image)
+        }
+        assert expected
+        assert album_files("bench/albums/album-0000") == expected
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import time
+
+from cutyx import albums
+from cutyx.constants import ALBUM_INDEX_FILE_NAME, FACES_DIR_NAME
+from cutyx.lib import match_names
+
+
+class TestAlbumIndex:
+    def test_index_is_stored_by_match_names(self) -> None:
+        match_names("albums/a", "linus", quiet=True)
+
+        assert os.path.exists(
+            os.path.join("albums/a", FACES_DIR_NAME, ALBUM_INDEX_FILE_NAME)
+        )
+        index = albums.read_album_index("albums/a")
+        assert index is not None
+        assert [r["text"] for r in index.name_rules] == ["linus"]
+        assert index.encodings.shape == (0, 128)
+
+    def test_index_is_rebuilt_when_rules_change(self) -> None:
+        match_names("albums/a", "linus", quiet=True)
+        stored = albums.read_album_index("albums/a")
+        assert stored is not None
+
+        # Add a rule behind the back of the index
+        time.sleep(0.01)
+        with open(
+            os.path.join("albums/a", FACES_DIR_NAME, "x.names"), "w"
+        ) as f:
+            f.write(
+                '{"text": "guido", "use_regex": false, '
+                '"use_fuzzy": false, "fuzzy_min_ratio": 60}'
+            )
+
+        index = albums.load_album_index("albums/a")
+        assert index.signature != stored.signature
+        assert sorted(r["text"] for r in index.name_rules) == [
+            "guido",
+            "linus",
+        ]
+
+    def test_unreadable_index_is_ignored(self) -> None:
+        match_names("albums/a", "linus", quiet=True)
+        with open(albums.album_index_path("albums/a"), "w") as f:
+            f.write("garbage")
+
+        assert albums.read_album_index("albums/a") is None
+        index = albums.load_album_index("albums/a")
+        assert [r["text"] for r in index.name_rules] == ["linus"]
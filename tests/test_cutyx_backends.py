@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+from typing import Any
+
+import numpy as np
+import pytest
+
+from cutyx import backends, faces
+from cutyx.exceptions import FacesException
+from cutyx.lib import (
+    make_detection_options,
+    match_faces,
+    process_directory,
+    update_cache,
+)
+
+FAKE = faces.DetectionOptions(backend="fake")
+
+
+def write_image(path: str, persons: list[int]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    backends.write_fake_image(path, persons, size=64)
+
+
+def album_files(album_dir: str) -> list[str]:
+    return sorted(f for f in os.listdir(album_dir) if not f.startswith("."))
+
+
+class CountingBackend(backends.FakeBackend):
+    identity = "counting"
+
+    def __init__(self) -> None:
+        self.batches: list[list[str]] = []
+
+    def encode_images(
+        self, image_paths: list[str], options: faces.DetectionOptions
+    ) -> list[Any]:
+        self.batches.append(image_paths)
+        return super().encode_images(image_paths, options)
+
+
+class TestRegistry:
+    def test_builtin_and_registered_backends(self) -> None:
+        assert {"face_recognition", "fake"} <= set(
+            backends.available_backends()
+        )
+        assert backends.get_backend().identity == "face_recognition"
+        assert backends.get_backend("fake") is backends.get_backend("fake")
+
+        backends.register_backend("counting", CountingBackend)
+        assert "counting" in backends.available_backends()
+        assert isinstance(backends.get_backend("counting"), CountingBackend)
+        assert make_detection_options(backend="counting") == (
+            faces.DetectionOptions(backend="counting")
+        )
+
+        with pytest.raises(FacesException):
+            backends.get_backend("unknown")
+        with pytest.raises(FacesException):
+            make_detection_options(backend="unknown")
+
+
+class TestFakeBackend:
+    def test_deterministic_encodings(self) -> None:
+        write_image("a/one.jpg", [1, 2])
+        write_image("a/two.jpg", [2])
+        write_image("a/none.jpg", [])
+        backend = backends.get_backend("fake")
+
+        one, two, none = backend.encode_images(
+            ["a/one.jpg", "a/two.jpg", "a/none.jpg"], FAKE
+        )
+        assert len(one) == 2 and len(two) == 1 and len(none) == 0
+        assert np.array_equal(
+            one[0], backend.encode_images(["a/one.jpg"], FAKE)[0][0]
+        )
+        matches = backend.compare_faces(
+            faces.stack_encodings(one), faces.stack_encodings(two)
+        )
+        assert matches.tolist() == [[False], [True]]
+
+
+class TestBackendCache:
+    def test_process_with_batches(self) -> None:
+        backend = CountingBackend()
+        backends.register_backend("counting", lambda: backend)
+        detection = faces.DetectionOptions(backend="counting")
+        for i in range(20):
+            write_image(f"gallery/img{i:02d}.jpg", [i % 4])
+        write_image("training/person1.jpg", [1])
+        match_faces("albums/a", "training/person1.jpg", detection=detection)
+
+        process_directory(
+            "gallery",
+            "albums",
+            symlink=False,
+            quiet=True,
+            detection=detection,
+        )
+        assert album_files("albums/a") == [
+            "img01.jpg",
+            "img05.jpg",
+            "img09.jpg",
+            "img13.jpg",
+            "img17.jpg",
+        ]
+        # The training image and the gallery images in batches
+        assert backend.batches[0] == ["training/person1.jpg"]
+        assert sum(len(batch) for batch in backend.batches[1:]) == 20
+        assert max(len(batch) for batch in backend.batches) <= 16
+
+    def test_backend_identity_is_stored(self) -> None:
+        write_image("gallery/img.jpg", [1])
+        update_cache("gallery", quiet=True, detection=FAKE)
+
+        # The cache can not be used with another backend
+        with pytest.raises(FacesException):
+            update_cache(
+                "gallery", quiet=True, detection=faces.DetectionOptions()
+            )
+        update_cache("gallery", quiet=True)
+
+        # A backend with a changed identity (e.g. model) is rejected as well
+        class ChangedBackend(backends.FakeBackend):
+            identity = "fake-v2"
+
+        backends.register_backend("fake", ChangedBackend)
+        try:
+            with pytest.raises(FacesException):
+                update_cache("gallery", quiet=True, detection=FAKE)
+        finally:
+            backends.register_backend("fake", backends.FakeBackend)
+
+    def test_training_data_of_other_backends_is_rejected(self) -> None:
+        write_image("gallery/img.jpg", [1])
+        write_image("training/person1.jpg", [1])
+        match_faces("albums/a", "training/person1.jpg", detection=FAKE)
+        update_cache("gallery", quiet=True, detection=FAKE)
+        process_directory("gallery", "albums", symlink=False, quiet=True)
+        assert album_files("albums/a") == ["img.jpg"]
+
+        class OtherBackend(backends.FakeBackend):
+            identity = "other"
+
+        backends.register_backend("other", OtherBackend)
+        other = faces.DetectionOptions(backend="other")
+        write_image("gallery2/img.jpg", [1])
+        update_cache("gallery2", quiet=True, detection=other)
+        with pytest.raises(FacesException, match="face backend 'fake'"):
+            process_directory("gallery2", "albums", symlink=False, quiet=True)
+
+        # Training data calculated with the backend of the cache is accepted
+        match_faces("albums/a", "training/person1.jpg", detection=other)
+        process_directory("gallery2", "albums", symlink=False, quiet=True)
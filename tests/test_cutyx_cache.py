@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+from cutyx import backends, cache, faces
+from cutyx.exceptions import FacesException
+from cutyx.fingerprints import hash_file
+from cutyx.lib import collect_cache_garbage, parse_size, process_directory
+
+FAKE = faces.DetectionOptions(backend="fake")
+
+DAY = 24 * 60 * 60
+
+
+def write_entry(image_hash: str, size: int, age: float) -> str:
+    cache.write_cached_encodings(".", image_hash, np.zeros((size, 128)))
+    path = cache.cached_encodings_path(".", image_hash)
+    timestamp = time.time() - age
+    os.utime(path, (timestamp, timestamp))
+    return path
+
+
+def cached_hashes() -> list[str]:
+    return sorted(
+        str(entry.image_hash) for entry in cache.iter_cache_entries(".")
+    )
+
+
+class TestAccessTime:
+    def test_lookup_marks_entries_accessed(self) -> None:
+        old = write_entry("old", 1, 2 * DAY)
+        recent = write_entry("recent", 1, 60)
+        recent_mtime = os.stat(recent).st_mtime
+
+        assert cache.lookup(".", "old") == old
+        assert cache.lookup(".", "recent") == recent
+        assert time.time() - os.stat(old).st_mtime < 60
+        # Recently used entries are not written again
+        assert os.stat(recent).st_mtime == recent_mtime
+
+
+class TestCollectGarbage:
+    def test_orphans(self) -> None:
+        write_entry("a", 1, 0)
+        write_entry("b", 1, 0)
+        os.makedirs(cache.legacy_cache_dir(".", "c"))
+
+        report = cache.collect_garbage(".", live_hashes={"a"}, dry_run=True)
+        assert sorted(str(e.image_hash) for e in report.removed) == ["b", "c"]
+        assert cached_hashes() == ["a", "b", "c"]
+
+        cache.collect_garbage(".", live_hashes={"a"})
+        assert cached_hashes() == ["a"]
+
+        # Orphans are kept if the gallery is not known
+        write_entry("b", 1, 0)
+        cache.collect_garbage(".")
+        assert cached_hashes() == ["a", "b"]
+
+    def test_max_age(self) -> None:
+        write_entry("new", 1, DAY)
+        write_entry("old", 1, 10 * DAY)
+
+        report = cache.collect_garbage(".", max_age=5 * DAY)
+        assert [e.image_hash for e in report.removed] == ["old"]
+        assert cached_hashes() == ["new"]
+
+    def test_max_size_evicts_least_recently_used(self) -> None:
+        sizes = {}
+        for i, age in enumerate([3, 1, 4, 2]):
+            path = write_entry(f"e{i}", 10, age * DAY)
+            sizes[f"e{i}"] = os.path.getsize(path)
+
+        report = cache.collect_garbage(".", max_size=sizes["e1"] + sizes["e3"])
+        assert [e.image_hash for e in report.removed] == ["e2", "e0"]
+        assert report.kept == 2
+        assert report.kept_size == sizes["e1"] + sizes["e3"]
+        assert cached_hashes() == ["e1", "e3"]
+
+    def test_temporary_files(self) -> None:
+        path = write_entry("a", 1, 0)
+        for name, age in (("new.tmp", 60), ("old.tmp", 2 * DAY)):
+            tmp_path = os.path.join(os.path.dirname(path), name)
+            with open(tmp_path, "wb") as f:
+                f.write(b"x" * 100)
+            timestamp = time.time() - age
+            os.utime(tmp_path, (timestamp, timestamp))
+
+        report = cache.collect_garbage(".", live_hashes=set(), max_size=0)
+        assert sorted(
+            os.path.basename(str(e.path)) for e in report.removed
+        ) == [
+            "a.encodings",
+            "old.tmp",
+        ]
+        assert os.listdir(os.path.dirname(path)) == ["new.tmp"]
+
+
+class TestCollectCacheGarbage:
+    def test_removes_entries_of_deleted_images(self) -> None:
+        os.makedirs("images")
+        for i in range(3):
+            backends.write_fake_image(f"images/image{i}.jpg", [i], size=64)
+        hashes = [hash_file(f"images/image{i}.jpg") for i in range(3)]
+        deleted = hashes[0]
+        os.makedirs("album/.faces.d")
+
+        process_directory(quiet=True, detection=FAKE)
+        assert cached_hashes() == sorted(hashes)
+
+        os.remove("images/image0.jpg")
+        report = collect_cache_garbage(quiet=True)
+        assert [e.image_hash for e in report.removed] == [deleted]
+        assert cached_hashes() == sorted(set(hashes) - {deleted})
+
+    def test_run_with_gc(self) -> None:
+        os.makedirs("images")
+        backends.write_fake_image("images/image.jpg", [1], size=64)
+        os.makedirs("album/.faces.d")
+        write_entry("orphan", 1, 0)
+
+        process_directory(quiet=True, detection=FAKE)
+        assert "orphan" in cached_hashes()
+        process_directory(quiet=True, detection=FAKE, gc=True)
+        assert cached_hashes() == [
+            hash_file("images/image.jpg", cache.hash_algorithm("."))
+        ]
+
+    def test_invalid_limits(self) -> None:
+        with pytest.raises(FacesException):
+            collect_cache_garbage(max_size=-1, quiet=True)
+
+
+class TestParseSize:
+    @pytest.mark.parametrize(
+        "size, expected",
+        [
+            ("1000", 1000),
+            ("2K", 2048),
+            ("500M", 500 << 20),
+            ("1.5GiB", 3 << 29),
+            ("1 tb", 1 << 40),
+        ],
+    )
+    def test_valid(self, size: str, expected: int) -> None:
+        assert parse_size(size) == expected
+
+    @pytest.mark.parametrize("size", ["", "M", "-1", "2X"])
+    def test_invalid(self, size: str) -> None:
+        with pytest.raises(FacesException):
+            parse_size(size)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import face_recognition  # type: ignore
+import numpy as np
+import pytest
+from PIL import Image
+
+from cutyx import faces
+from cutyx.exceptions import FacesException
+from cutyx.lib import make_detection_options
+
+
+class TestDistanceMatrix:
+    def test_distance_matrix_matches_pairwise(self) -> None:
+        rng = np.random.default_rng(42)
+        known = rng.normal(scale=0.1, size=(7, 128))
+        query = rng.normal(scale=0.1, size=(3, 128))
+
+        distances = faces.face_distance_matrix(known, query)
+
+        assert distances.shape == (7, 3)
+        for col in range(3):
+            expected = face_recognition.face_distance(known, query[col])
+            assert np.allclose(distances[:, col], expected)
+
+    def test_compare_faces_matrix(self) -> None:
+        known = np.zeros((2, 128))
+        known[1, 0] = 1.0
+        query = np.zeros((1, 128))
+        query[0, 0] = 0.5
+
+        matches = faces.compare_faces_matrix(known, query)
+        assert matches.tolist() == [[True], [True]]
+
+        matches = faces.compare_faces_matrix(known, query, tolerance=0.4)
+        assert matches.tolist() == [[False], [False]]
+
+    def test_empty_matrices(self) -> None:
+        known = faces.stack_encodings([])
+        query = np.zeros((2, 128))
+
+        assert faces.face_distance_matrix(known, query).shape == (0, 2)
+        assert not faces.compare_faces_matrix(known, query).any()
+
+
+class TestDetectionOptions:
+    def test_load_downscaled(self) -> None:
+        Image.new("RGB", (3000, 2000), (200, 100, 50)).save("big.jpg")
+
+        image = faces.load_image_file("big.jpg", max_dimension=600)
+        assert image.shape == (400, 600, 3)
+
+        image = faces.load_image_file("big.jpg", max_dimension=5000)
+        assert image.shape == (2000, 3000, 3)
+
+        image = faces.load_image_file("big.jpg")
+        assert image.shape == (2000, 3000, 3)
+
+    def test_make_detection_options(self) -> None:
+        assert make_detection_options() is None
+        assert make_detection_options(max_dimension=1024) == (
+            faces.DetectionOptions(max_dimension=1024)
+        )
+        options = faces.DetectionOptions(model="cnn", upsample=0)
+        assert make_detection_options(model="cnn", upsample=0) == options
+        assert faces.DetectionOptions.from_dict(options.as_dict()) == options
+
+        with pytest.raises(FacesException):
+            make_detection_options(model="unknown")
+        with pytest.raises(FacesException):
+            make_detection_options(max_dimension=0)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import hashlib
+import os
+
+from cutyx import cache
+from cutyx.constants import FACES_CACHE_DIR_NAME
+from cutyx.fingerprints import FingerprintIndex, hash_file
+
+
+def write_file(path: str, content: bytes, mtime: int = 1000000000) -> None:
+    with open(path, "wb") as f:
+        f.write(content)
+    os.utime(path, (mtime, mtime))
+
+
+class TestHashFile:
+    def test_hash_algorithms(self) -> None:
+        write_file("a.jpg", b"a" * 3000000)
+
+        assert (
+            hash_file("a.jpg", "md5")
+            == hashlib.md5(b"a" * 3000000).hexdigest()
+        )
+        assert (
+            hash_file("a.jpg", "blake2b")
+            == hashlib.blake2b(b"a" * 3000000, digest_size=16).hexdigest()
+        )
+
+
+class TestFingerprintIndex:
+    def test_unchanged_files_are_not_rehashed(self) -> None:
+        write_file("a.jpg", b"first")
+        index = FingerprintIndex.load(".")
+        first_hash = index.hash("a.jpg")
+        index.save()
+
+        # Same size and modification time => the stored hash is used
+        write_file("a.jpg", b"other")
+        index = FingerprintIndex.load(".")
+        assert index.hash("a.jpg") == first_hash
+
+        # A modified file is hashed again
+        write_file("a.jpg", b"changed", mtime=1000000001)
+        assert index.hash("a.jpg") == hash_file("a.jpg")
+
+    def test_recently_modified_files_are_not_remembered(self) -> None:
+        with open("a.jpg", "wb") as f:
+            f.write(b"first")
+        index = FingerprintIndex.load(".")
+        index.hash("a.jpg")
+
+        assert not index.entries
+
+    def test_hash_algorithm_of_legacy_cache(self) -> None:
+        assert cache.hash_algorithm(".") == "blake2b"
+
+        os.makedirs(FACES_CACHE_DIR_NAME)
+        assert cache.hash_algorithm(".") == "md5"
+
+        cache.ensure_cache_config(".")
+        assert FingerprintIndex.load(".").algorithm == "md5"
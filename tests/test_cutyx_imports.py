@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import cutyx
+
+FACE_MODULES = {"face_recognition", "dlib", "PIL"}
+FUZZY_MODULES = {"rapidfuzz", "thefuzz"}
+
+IMPORT_BUDGETS = [
+    (["--help"], FACE_MODULES | FUZZY_MODULES | {"numpy"}),
+    (["--version"], FACE_MODULES | FUZZY_MODULES | {"numpy"}),
+    (["clear-cache"], FACE_MODULES | FUZZY_MODULES | {"numpy"}),
+    (["cache", "gc"], FACE_MODULES | FUZZY_MODULES | {"numpy"}),
+    (["match", "name", "linus", "albums/a"], FACE_MODULES | FUZZY_MODULES),
+]
+"""Modules which must not be imported by a CLI command."""
+
+
+def imported_modules(args: list[str]) -> set[str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(cutyx.__file__))
+    env["CUTYX_SOCKET"] = os.path.abspath("no-server.sock")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "cutyx.cli", *args],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+    return {
+        line.rsplit("|", 1)[1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:") and "|" in line
+    }
+
+
+class TestImportTime:
+    @pytest.mark.parametrize("args,forbidden", IMPORT_BUDGETS)
+    def test_cli_defers_heavy_imports(
+        self, args: list[str], forbidden: set[str]
+    ) -> None:
+        modules = imported_modules(args)
+        assert "cutyx.cli_match" in modules
+        assert {m.split(".")[0] for m in modules} & forbidden == set()
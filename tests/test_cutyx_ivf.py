@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+from typing import Any
+
+import numpy as np
+
+from cutyx import backends, faces, ivf, search
+from cutyx.lib import search_images, update_cache
+from cutyx.watch import Watcher
+
+FAKE = faces.DetectionOptions(backend="fake")
+
+
+def clustered_gallery(
+    faces_per_person: int = 20, persons: int = 50, seed: int = 0
+) -> search.GalleryIndex:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 0.1, (persons, 128))
+    matrix = np.repeat(centers, faces_per_person, axis=0)
+    matrix += rng.normal(0, 0.02, matrix.shape)
+    matrix = matrix.astype(np.float32)
+    offsets = np.arange(len(matrix) + 1, dtype=np.int64)
+    return search.GalleryIndex(
+        [f"image{i}" for i in range(len(matrix))],
+        [f"hash{i}" for i in range(len(matrix))],
+        offsets,
+        matrix,
+        np.einsum("ij,ij->i", matrix, matrix),
+    )
+
+
+class TestIvfIndex:
+    def test_build(self) -> None:
+        index = clustered_gallery()
+        ivf_index = ivf.build_ivf_index(index.encodings)
+        assert ivf_index.lists == ivf.list_count(1000) == 32
+        assert ivf_index.trained_faces == 1000
+        assert len(ivf_index.assignments) == 1000
+        assert not np.isnan(ivf_index.centroids).any()
+        # Every row is in exactly one list
+        assert sorted(ivf_index.order.tolist()) == list(range(1000))
+        assert ivf_index.list_offsets[-1] == 1000
+        np.testing.assert_array_equal(
+            ivf_index.assignments,
+            ivf.assign(ivf_index.centroids, index.encodings),
+        )
+
+    def test_small_and_empty(self) -> None:
+        ivf_index = ivf.build_ivf_index(np.ones((3, 128), dtype=np.float32))
+        assert ivf_index.lists == 2
+        assert not np.isnan(ivf_index.centroids).any()
+
+        ivf_index = ivf.build_ivf_index(np.empty((0, 128), dtype=np.float32))
+        assert len(ivf_index.assignments) == 0
+        assert ivf.needs_training(ivf_index, 1)
+        assert not ivf.needs_training(ivf_index, 0)
+
+    def test_search(self) -> None:
+        index = clustered_gallery()
+        ivf_index = ivf.build_ivf_index(index.encodings)
+        query = index.encodings[[0, 500]] + 0.01
+        exact = search.search_gallery(index, query, tolerance=0.4)
+        assert len(exact) == 40
+
+        # Probing all lists is an exhaustive search
+        assert (
+            search.search_gallery(
+                index, query, 0.4, ivf_index=ivf_index, nprobe=ivf_index.lists
+            )
+            == exact
+        )
+        # The clusters of the persons are found with a few lists as well,
+        # with exact distances
+        approximate = search.search_gallery(
+            index, query, 0.4, ivf_index=ivf_index, nprobe=2
+        )
+        assert len(approximate) >= 38
+        assert {image for image, _ in approximate} <= {
+            image for image, _ in exact
+        }
+
+        rows = ivf.probe(ivf_index, query, 1)
+        assert len(rows) < 1000
+        assert rows.tolist() == sorted(rows.tolist())
+
+    def test_update(self) -> None:
+        index = clustered_gallery()
+        ivf_index = ivf.build_ivf_index(index.encodings[:500])
+
+        # The first rows were removed, new rows were appended
+        previous_rows = np.arange(100, 600)
+        previous_rows[400:] = -1
+        updated = ivf.update_ivf_index(
+            ivf_index, index.encodings[100:600], previous_rows
+        )
+        assert updated.trained_faces == 500
+        assert updated.centroids is ivf_index.centroids
+        np.testing.assert_array_equal(
+            updated.assignments[:400], ivf_index.assignments[100:]
+        )
+        np.testing.assert_array_equal(
+            updated.assignments[400:],
+            ivf.assign(ivf_index.centroids, index.encodings[500:600]),
+        )
+
+    def test_save_and_read(self) -> None:
+        assert ivf.read_ivf_index(".") is None
+        ivf_index = ivf.build_ivf_index(clustered_gallery().encodings)
+        ivf_index.generation = "generation"
+        ivf.save_ivf_index(".", ivf_index)
+
+        stored = ivf.read_ivf_index(".")
+        assert stored is not None
+        assert stored.generation == "generation"
+        assert stored.trained_faces == ivf_index.trained_faces
+        np.testing.assert_array_equal(stored.centroids, ivf_index.centroids)
+        np.testing.assert_array_equal(stored.order, ivf_index.order)
+
+        with open(ivf.ivf_index_path("."), "wb") as f:
+            f.write(b"garbage")
+        assert ivf.read_ivf_index(".") is None
+
+
+class TestGalleryUpdates:
+    def write_image(self, name: str, persons: list[int]) -> None:
+        backends.write_fake_image(f"gallery/{name}", persons, size=64)
+        # Recently modified files are not remembered by the fingerprints
+        os.utime(f"gallery/{name}", (1e9, 1e9))
+
+    def test_inserts(self) -> None:
+        os.makedirs("gallery")
+        for i in range(6):
+            self.write_image(f"image{i}.jpg", [i % 3, 10 + i])
+        backends.write_fake_image("query.jpg", [1], size=64)
+        update_cache("gallery", quiet=True, detection=FAKE)
+
+        # No approximate index is built unless asked for
+        search_images("query.jpg", "gallery", quiet=True)
+        assert ivf.read_ivf_index("gallery") is None
+
+        results = search_images("query.jpg", "gallery", ann=True, quiet=True)
+        assert sorted(os.path.basename(image) for image, _ in results) == [
+            "image1.jpg",
+            "image4.jpg",
+        ]
+        stored = ivf.read_ivf_index("gallery")
+        assert stored is not None
+        assert stored.trained_faces == 12
+
+        # New images are added by updating the cache, without training again
+        self.write_image("new.jpg", [1])
+        update_cache("gallery", quiet=True, detection=FAKE)
+        updated = ivf.read_ivf_index("gallery")
+        index = search.read_gallery_index("gallery")
+        assert updated is not None and index is not None
+        assert updated.generation == index.generation
+        assert updated.trained_faces == 12
+        assert len(updated.assignments) == index.faces == 13
+        np.testing.assert_array_equal(updated.centroids, stored.centroids)
+
+        results = search_images(
+            "query.jpg", "gallery", update=False, nprobe=1, quiet=True
+        )
+        assert "new.jpg" in [os.path.basename(image) for image, _ in results]
+
+        # Trained again once the gallery has grown too much
+        for i in range(40):
+            self.write_image(f"more{i}.jpg", [20 + i])
+        update_cache("gallery", quiet=True, detection=FAKE)
+        retrained = ivf.read_ivf_index("gallery")
+        assert retrained is not None
+        assert retrained.trained_faces == 53
+
+    def test_changed_images_keep_the_gallery(self) -> None:
+        os.makedirs("gallery")
+        for i in range(5):
+            self.write_image(f"image{i}.jpg", [1, 10 + i])
+        backends.write_fake_image("query.jpg", [1], size=64)
+        update_cache("gallery", quiet=True, detection=FAKE)
+        assert len(search_images("query.jpg", "gallery", quiet=True)) == 5
+
+        # Without an approximate index, updating the cache does not write
+        # the gallery index
+        index = search.read_gallery_index("gallery")
+        assert index is not None
+        self.write_image("image5.jpg", [1])
+        update_cache("gallery", quiet=True, detection=FAKE)
+        stored = search.read_gallery_index("gallery")
+        assert stored is not None and stored.generation == index.generation
+
+        search_images("query.jpg", "gallery", ann=True, quiet=True)
+        # The watcher (and the server) update the cache with the changed
+        # images only, which must not replace the gallery index
+        watcher = Watcher("gallery", "gallery", quiet=True, detection=FAKE)
+        watcher.start(update_albums=False)
+        self.write_image("new.jpg", [1])
+        watcher.update_images([os.path.abspath("gallery/new.jpg")])
+
+        results = search_images(
+            "query.jpg", "gallery", update=False, ann=True, quiet=True
+        )
+        assert len(results) == 6
+        ivf_index = ivf.read_ivf_index("gallery")
+        assert ivf_index is not None and len(ivf_index.assignments) == 11
+
+        # The next full update adds the new image
+        update_cache("gallery", quiet=True, detection=FAKE)
+        results = search_images(
+            "query.jpg", "gallery", update=False, ann=True, quiet=True
+        )
+        assert len(results) == 7
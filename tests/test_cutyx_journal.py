@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from cutyx.journal import DecisionJournal
+
+CONFIG = {"hash_algorithm": "blake2b"}
+
+
+class TestDecisionJournal:
+    def test_unknown_image_is_evaluated_against_all_albums(self) -> None:
+        journal = DecisionJournal.load(".", CONFIG)
+        known, stale = journal.lookup("h/a.jpg", {"A": "1", "B": "1"})
+        assert known == {}
+        assert stale == ["A", "B"]
+
+    def test_decisions_are_reused_until_rules_change(self) -> None:
+        journal = DecisionJournal.load(".", CONFIG)
+        journal.record("h/a.jpg", {"A": "1", "B": "1"}, {"A": ("faces", "x")})
+        journal.save()
+
+        journal = DecisionJournal.load(".", CONFIG)
+        known, stale = journal.lookup("h/a.jpg", {"A": "1", "B": "1"})
+        assert known == {"A": ("faces", "x")}
+        assert stale == []
+
+        # Changed rules of A and a new album C
+        known, stale = journal.lookup(
+            "h/a.jpg", {"A": "2", "B": "1", "C": "1"}
+        )
+        assert known == {}
+        assert stale == ["A", "C"]
+
+    def test_other_cache_config_discards_journal(self) -> None:
+        journal = DecisionJournal.load(".", CONFIG)
+        journal.record("h/a.jpg", {"A": "1"}, {"A": ("faces", "x")})
+        journal.save()
+
+        journal = DecisionJournal.load(".", {"hash_algorithm": "md5"})
+        assert journal.lookup("h/a.jpg", {"A": "1"}) == ({}, ["A"])
+
+    def test_prune_removes_unseen_images(self) -> None:
+        journal = DecisionJournal.load(".", CONFIG)
+        journal.record("h/a.jpg", {"A": "1"}, {})
+        journal.record("h/b.jpg", {"A": "1"}, {})
+        journal.save()
+
+        journal = DecisionJournal.load(".", CONFIG)
+        journal.lookup("h/a.jpg", {"A": "1"})
+        journal.prune()
+        journal.save()
+
+        journal = DecisionJournal.load(".", CONFIG)
+        assert set(journal.images) == {"h/a.jpg"}
+        assert len(journal.generations) == 1
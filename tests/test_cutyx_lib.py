@@ -16,15 +16,18 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import shutil
 
 import pytest
 
 from cutyx.exceptions import FacesException
 from cutyx.lib import (
+    is_album_image_up_to_date,
     match_faces,
     match_names,
     process_directory,
     process_image,
+    process_images,
 )
 from tests import download_images
 
@@ -53,6 +56,18 @@ class TestMatchFaces:
         ]
         assert len(files) == 3
 
+    def test_lib_match_faces_dir_jobs(self, gallery_path: str) -> None:
+        os.mkdir("albums")
+
+        img1 = os.path.join(gallery_path, "einstein1.jpg")
+        match_faces("albums/a", img1, training_data_prefix="albert")
+
+        process_directory(gallery_path, "albums", jobs=2)
+        files = [
+            file for file in os.listdir("albums/a") if not file.startswith(".")
+        ]
+        assert len(files) == 3
+
     def test_lib_match_faces_single(self, gallery_path: str) -> None:
         os.mkdir("albums")
 
@@ -113,3 +128,105 @@ class TestMatchNames:
             file for file in os.listdir("albums/a") if not file.startswith(".")
         ]
         assert len(files) == 2
+
+
+class TestProcessImages:
+    def test_lib_process_images_only_given_files(
+        self, gallery_path: str
+    ) -> None:
+        os.mkdir("albums")
+
+        match_names("albums/a", "linus")
+        images = sorted(
+            os.path.join(gallery_path, f)
+            for f in os.listdir(gallery_path)
+            if f.startswith("linus")
+        )
+
+        process_images(images[:1], "albums", use_cache=False)
+        files = [
+            file for file in os.listdir("albums/a") if not file.startswith(".")
+        ]
+        assert files == [os.path.basename(images[0])]
+
+        process_images(images, "albums", use_cache=False)
+        files = [
+            file for file in os.listdir("albums/a") if not file.startswith(".")
+        ]
+        assert sorted(files) == [os.path.basename(i) for i in images]
+
+
+class TestSync:
+    def test_lib_sync_only_writes_differences(self, gallery_path: str) -> None:
+        os.mkdir("albums")
+
+        match_names("albums/a", "linus")
+        with open("albums/a/stale.jpg", "w") as f:
+            f.write("stale")
+
+        report = process_directory(
+            gallery_path, "albums", sync=True, symlink=False
+        )
+        assert report is not None
+        assert len(report.added) == 2
+        assert report.removed == [os.path.abspath("albums/a/stale.jpg")]
+
+        report = process_directory(
+            gallery_path, "albums", sync=True, symlink=False
+        )
+        assert report is not None
+        assert report.added == report.updated == report.removed == []
+        assert report.unchanged == 2
+
+        # Switching to symlinks replaces the copies
+        report = process_directory(
+            gallery_path, "albums", sync=True, symlink=True
+        )
+        assert report is not None
+        assert len(report.updated) == 2
+        files = [
+            file for file in os.listdir("albums/a") if not file.startswith(".")
+        ]
+        assert len(files) == 2
+        assert all(os.path.islink(os.path.join("albums/a", f)) for f in files)
+
+    def test_lib_hardlink_fallback_copies_are_up_to_date(self) -> None:
+        with open("image.jpg", "wb") as f:
+            f.write(b"image")
+        os.link("image.jpg", "link.jpg")
+        # A copy, as made if the album is on another file system
+        shutil.copy2("image.jpg", "copy.jpg")
+
+        assert is_album_image_up_to_date("image.jpg", "link.jpg", "hardlink")
+        assert is_album_image_up_to_date("image.jpg", "copy.jpg", "hardlink")
+        assert not is_album_image_up_to_date("image.jpg", "link.jpg", "copy")
+
+        with open("image.jpg", "ab") as f:
+            f.write(b"modified")
+        assert not is_album_image_up_to_date(
+            "image.jpg", "copy.jpg", "hardlink"
+        )
+
+    def test_lib_sync_removes_images_without_any_match(
+        self, gallery_path: str
+    ) -> None:
+        shutil.copytree(gallery_path, "gallery")
+        os.mkdir("albums")
+
+        match_names("albums/a", "linus")
+        process_directory("gallery", "albums", sync=True, symlink=False)
+        assert "linus1.jpg" in os.listdir("albums/a")
+
+        for name in os.listdir("gallery"):
+            if name.startswith("linus"):
+                os.rename(
+                    os.path.join("gallery", name),
+                    os.path.join("gallery", "renamed-" + name[5:]),
+                )
+        # Nothing matches anymore, but the albums are synchronised anyway
+        with pytest.raises(FacesException):
+            process_directory("gallery", "albums", sync=True, symlink=False)
+        files = [
+            file for file in os.listdir("albums/a") if not file.startswith(".")
+        ]
+        assert files == []
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import re
+from typing import Any
+
+from thefuzz import fuzz  # type: ignore
+
+from cutyx.albums import AlbumIndex
+from cutyx.names import AhoCorasick, NameMatcher
+
+
+def rule(
+    text: str,
+    use_regex: bool = False,
+    use_fuzzy: bool = False,
+    fuzzy_min_ratio: int = 60,
+) -> dict[str, Any]:
+    return {
+        "text": text,
+        "use_regex": use_regex,
+        "use_fuzzy": use_fuzzy,
+        "fuzzy_min_ratio": fuzzy_min_ratio,
+    }
+
+
+def naive_match(index: AlbumIndex, image_path: str) -> str | None:
+    basename = os.path.basename(image_path)
+    for namedata in index.name_rules:
+        if namedata["use_regex"]:
+            if re.match(namedata["text"], basename):
+                return f"'{namedata['text']}'"
+        elif namedata["use_fuzzy"]:
+            if (
+                fuzz.token_sort_ratio(
+                    namedata["text"], os.path.splitext(basename)[0]
+                )
+                > namedata["fuzzy_min_ratio"]
+            ):
+                return f"'{namedata['text']}'"
+        elif namedata["text"].lower() in basename.lower():
+            return f"'{namedata['text']}'"
+    return None
+
+
+class TestAhoCorasick:
+    def test_overlapping_patterns(self) -> None:
+        automaton = AhoCorasick(["he", "she", "his", "hers", "x"])
+        assert automaton.search("ushers") == {0, 1, 3}
+        assert automaton.search("") == set()
+
+    def test_empty_pattern_matches_everything(self) -> None:
+        assert AhoCorasick([""]).search("abc") == {0}
+
+
+class TestNameMatcher:
+    def test_matches_like_single_rules(self) -> None:
+        indexes = [
+            AlbumIndex(
+                "a", "", name_rules=[rule("zzz"), rule("Linus"), rule("lin")]
+            ),
+            AlbumIndex(
+                "b",
+                "",
+                name_rules=[
+                    rule("^lin.*s", use_regex=True),
+                    rule("(a)\\1", use_regex=True),
+                    rule("(?i)EIN", use_regex=True),
+                ],
+            ),
+            AlbumIndex("c", "", name_rules=[rule("linux", use_fuzzy=True)]),
+            AlbumIndex("d", "", name_rules=[]),
+        ]
+        matcher = NameMatcher(indexes)
+        for name in [
+            "linus1.jpg",
+            "LINUS.png",
+            "aa.jpg",
+            "einstein.jpg",
+            "other.jpg",
+            "x/linux.jpg",
+        ]:
+            expected = {
+                index.album_dir: msg
+                for index in indexes
+                if (msg := naive_match(index, name)) is not None
+            }
+            assert matcher.match(name) == expected, name
+
+    def test_batched_fuzzy_scores_match_thefuzz(self) -> None:
+        texts = ["linux", "Linus Torvalds", "einstein", "ÄÖÜ bär", "", "a-b_c"]
+        names = [
+            "linus1.jpg",
+            "torvalds linus.jpg",
+            "Einstein (2).png",
+            "bär.jpg",
+            ".jpg",
+            "c b a.jpg",
+            "x.jpg",
+        ]
+        indexes = [
+            AlbumIndex(
+                f"{text}-{ratio}",
+                "",
+                name_rules=[rule(text, use_fuzzy=True, fuzzy_min_ratio=ratio)],
+            )
+            for text in texts
+            for ratio in (-1, 0, 40, 60, 67, 90, 100)
+        ]
+        matcher = NameMatcher(indexes)
+        matcher.prepare(names[:4])
+        for name in names:
+            expected = {
+                index.album_dir: msg
+                for index in indexes
+                if (msg := naive_match(index, name)) is not None
+            }
+            assert matcher.match(name) == expected, name
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+from typing import Any
+
+import pytest
+
+from cutyx import backends, cache, faces
+from cutyx.fingerprints import FingerprintIndex
+from cutyx.lib import encode_images
+from cutyx.pipeline import EncodingPipeline
+
+FAKE = faces.DetectionOptions(backend="fake")
+
+
+def write_images(root_dir: str, count: int) -> list[str]:
+    images = []
+    for i in range(count):
+        path = os.path.join(root_dir, "images", f"image{i}.jpg")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        backends.write_fake_image(path, [i], size=64)
+        images.append(path)
+    return images
+
+
+def make_pipeline(root_dir: str, encode: Any, **kwargs: Any) -> Any:
+    fingerprints = FingerprintIndex(None, cache.DEFAULT_HASH_ALGORITHM)
+    return EncodingPipeline(
+        root_dir, fingerprints, encode, FAKE, quiet=True, **kwargs
+    )
+
+
+class TestEncodingPipeline:
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_encodes_missing_images(self, tmp_path: Any, jobs: int) -> None:
+        root_dir = str(tmp_path)
+        images = write_images(root_dir, 12)
+        pipeline = make_pipeline(
+            root_dir, encode_images, jobs=jobs, batch_size=4
+        )
+        assert pipeline.run(images) == 12
+
+        fingerprints = FingerprintIndex(None, cache.DEFAULT_HASH_ALGORITHM)
+        for image, expected in zip(images, encode_images(images, FAKE)):
+            encodings = cache.read_cached_encodings(
+                root_dir, fingerprints.hash(image)
+            )
+            assert encodings is not None
+            assert encodings.tolist() == [list(e) for e in expected]
+
+        # Cached images are not encoded again
+        assert make_pipeline(root_dir, encode_images).run(images) == 0
+
+    def test_identical_images_are_encoded_once(self, tmp_path: Any) -> None:
+        root_dir = str(tmp_path)
+        images = write_images(root_dir, 3)
+        copies = []
+        for image in images:
+            copy = image.replace(".jpg", "-copy.jpg")
+            with open(image, "rb") as src, open(copy, "wb") as dst:
+                dst.write(src.read())
+            copies.append(copy)
+
+        encoded: list[str] = []
+
+        def encode(image_paths: list[str], detection: Any) -> list[Any]:
+            encoded.extend(image_paths)
+            return encode_images(image_paths, detection)
+
+        assert make_pipeline(root_dir, encode).run(images + copies) == 3
+        assert len(encoded) == 3
+
+    def test_small_queues(self, tmp_path: Any) -> None:
+        root_dir = str(tmp_path)
+        images = write_images(root_dir, 30)
+        pipeline = make_pipeline(
+            root_dir, encode_images, batch_size=3, queue_size=1
+        )
+        assert pipeline.run(images) == 30
+
+    def test_errors_abort_the_pipeline(self, tmp_path: Any) -> None:
+        root_dir = str(tmp_path)
+        images = write_images(root_dir, 20)
+
+        def encode(image_paths: list[str], detection: Any) -> list[Any]:
+            raise ValueError("broken image")
+
+        with pytest.raises(ValueError):
+            make_pipeline(root_dir, encode, queue_size=1).run(images)
+        assert all(
+            cache.lookup(root_dir, FingerprintIndex(None, "blake2b").hash(i))
+            is None
+            for i in images
+        )
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+
+from cutyx.constants import FACES_DIR_NAME
+from cutyx.ignore import IgnoreRules, parse_ignore_pattern
+from cutyx.scanner import scan
+
+
+def touch(path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write("")
+
+
+class TestScan:
+    def test_albums_and_images(self) -> None:
+        touch("gallery/a.jpg")
+        touch("gallery/notes.txt")
+        touch("gallery/sub/b.PNG")
+        touch("gallery/albums/x/" + FACES_DIR_NAME + "/rule.names")
+        touch("gallery/albums/x/c.jpeg")
+        touch("gallery/albums/x/nested/" + FACES_DIR_NAME + "/rule.names")
+        touch("gallery/albums/x/nested/d.jpg")
+
+        snapshot = scan("gallery")
+        assert snapshot.album_dirs == [
+            os.path.join("gallery", "albums", "x"),
+            os.path.join("gallery", "albums", "x", "nested"),
+        ]
+        assert sorted(snapshot.images) == [
+            os.path.join("gallery", "a.jpg"),
+            os.path.join("gallery", "sub", "b.PNG"),
+        ]
+        assert sorted(snapshot.album_images) == [
+            os.path.join("gallery", "albums", "x", "c.jpeg"),
+            os.path.join("gallery", "albums", "x", "nested", "d.jpg"),
+        ]
+
+    def test_symlink_cycles_are_visited_once(self) -> None:
+        touch("gallery/sub/a.jpg")
+        os.symlink("..", "gallery/sub/loop")
+        os.symlink("sub", "gallery/link")
+
+        snapshot = scan("gallery")
+        assert len(snapshot.images) == 1
+        assert os.path.basename(snapshot.images[0]) == "a.jpg"
+
+    def test_metadata_and_hidden_directories_are_pruned(self) -> None:
+        touch("gallery/" + FACES_DIR_NAME + "/x.jpg")
+        touch("gallery/.cutyx-cache.d/faces/y.jpg")
+        touch("gallery/.thumbnails/z.jpg")
+        touch("gallery/.photos/a.jpg")
+
+        assert scan("gallery").images == []
+
+        with open("gallery/.cutyxignore", "w") as f:
+            f.write("!.photos/\n")
+        assert scan("gallery").images == [
+            os.path.join("gallery", ".photos", "a.jpg")
+        ]
+
+    def test_ignore_files(self) -> None:
+        touch("gallery/raw/a.jpg")
+        touch("gallery/sub/raw/b.jpg")
+        touch("gallery/sub/c.jpg")
+        touch("gallery/sub/keep.jpg")
+        touch("gallery/sub/deeper/d.jpg")
+        touch("gallery/e.png")
+        with open("gallery/.cutyxignore", "w") as f:
+            f.write("# Comment\nraw/\n*.png\n")
+        with open("gallery/sub/.cutyxignore", "w") as f:
+            f.write("/*.jpg\n!keep.jpg\n")
+
+        assert sorted(scan("gallery").images) == [
+            os.path.join("gallery", "sub", "deeper", "d.jpg"),
+            os.path.join("gallery", "sub", "keep.jpg"),
+        ]
+
+
+class TestIgnoreRules:
+    def test_patterns(self) -> None:
+        rules = IgnoreRules(
+            tuple(
+                p
+                for p in (
+                    parse_ignore_pattern("**/exports/**"),
+                    parse_ignore_pattern("a/**/b.jpg"),
+                    parse_ignore_pattern("img?.[!p]pg"),
+                    parse_ignore_pattern("x/", base="sub"),
+                )
+                if p is not None
+            )
+        )
+        assert rules.is_ignored("exports/a.jpg")
+        assert rules.is_ignored("y/exports/z/a.jpg")
+        assert rules.is_ignored("a/b.jpg")
+        assert rules.is_ignored("a/c/d/b.jpg")
+        assert rules.is_ignored("q/img1.jpg")
+        assert not rules.is_ignored("img1.jpeg")
+        assert not rules.is_ignored("img12.jpg")
+        assert rules.is_ignored("sub/x", is_dir=True)
+        assert rules.is_ignored("sub/y/x", is_dir=True)
+        assert not rules.is_ignored("sub/x")
+        assert not rules.is_ignored("x", is_dir=True)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import resource
+from typing import Any
+
+import numpy as np
+import pytest
+
+from cutyx import backends, cache, faces, search, storage
+from cutyx.exceptions import FacesException
+from cutyx.lib import search_images, update_cache
+
+FAKE = faces.DetectionOptions(backend="fake")
+
+
+def write_gallery(persons: list[list[int]]) -> list[str]:
+    os.makedirs("gallery", exist_ok=True)
+    images = []
+    for i, image_persons in enumerate(persons):
+        path = os.path.abspath(f"gallery/image{i}.jpg")
+        backends.write_fake_image(path, image_persons, size=64)
+        images.append(path)
+    update_cache("gallery", quiet=True, detection=FAKE)
+    return images
+
+
+def basenames(results: list[tuple[str, float]]) -> list[str]:
+    return [os.path.basename(image) for image, _ in results]
+
+
+class TestSearchGallery:
+    def test_matches_brute_force(self) -> None:
+        rng = np.random.default_rng(0)
+        encodings = [rng.normal(0, 0.1, (n, 128)) for n in (2, 0, 3, 1, 4)]
+        offsets = np.cumsum([0] + [len(e) for e in encodings])
+        matrix = np.vstack(encodings).astype(np.float32)
+        index = search.GalleryIndex(
+            [f"image{i}" for i in range(5)],
+            [f"hash{i}" for i in range(5)],
+            offsets,
+            matrix,
+            np.einsum("ij,ij->i", matrix, matrix),
+        )
+        query = rng.normal(0, 0.1, (2, 128))
+
+        results = search.search_gallery(index, query, tolerance=10.0)
+        distances = faces.face_distance_matrix(matrix, query).min(axis=1)
+        expected = sorted(
+            (float(distances[offsets[i] : offsets[i + 1]].min()), f"image{i}")
+            for i in range(5)
+            if offsets[i] < offsets[i + 1]
+        )
+        assert [image for image, _ in results] == [i for _, i in expected]
+        assert [d for _, d in results] == pytest.approx(
+            [d for d, _ in expected], abs=1e-4
+        )
+
+        assert len(search.search_gallery(index, query, 10.0, limit=2)) == 2
+        assert search.search_gallery(index, query, tolerance=0.0) == []
+
+
+class TestGalleryIndex:
+    def test_interrupted_updates_are_ignored(self) -> None:
+        rng = np.random.default_rng(0)
+        matrix = rng.normal(0, 0.1, (3, 128)).astype(np.float32)
+        index = search.GalleryIndex(
+            ["image0", "image1", "image2"],
+            ["hash0", "hash1", "hash2"],
+            np.arange(4),
+            matrix,
+            np.einsum("ij,ij->i", matrix, matrix),
+        )
+        search.save_gallery_index(".", index)
+        generation = index.generation
+
+        # An update with the same number of faces, interrupted after the
+        # matrix was written
+        storage.write_encodings(
+            search.gallery_encodings_path(".", "interrupted"), matrix[::-1]
+        )
+        stored = search.read_gallery_index(".")
+        assert stored is not None
+        assert stored.generation == generation
+        np.testing.assert_array_equal(stored.encodings, matrix)
+
+        # The next update removes the matrices of other generations
+        search.save_gallery_index(".", index)
+        assert index.generation != generation
+        assert sorted(
+            os.listdir(os.path.dirname(search.gallery_index_path(".")))
+        ) == [
+            f"encodings-{index.generation}",
+            "index.npz",
+        ]
+
+        # The mapping is not used without its matrix
+        os.remove(search.gallery_encodings_path(".", index.generation))
+        assert search.read_gallery_index(".") is None
+
+    def test_build_with_few_file_descriptors(self) -> None:
+        rng = np.random.default_rng(0)
+        images = []
+        for i in range(200):
+            image_hash = f"{i:040x}"
+            cache.write_cached_encodings(
+                ".", image_hash, rng.normal(0, 0.1, (1, 128))
+            )
+            images.append((f"image{i}", image_hash))
+
+        # More cache entries than files may be opened
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        limit = len(os.listdir("/proc/self/fd")) + 50
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+        try:
+            index = search.build_gallery_index(".", images)
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+        assert len(index) == index.faces == 200
+
+
+class TestSearchImages:
+    def test_search(self) -> None:
+        write_gallery([[1], [2], [1, 3], [], [3], [1]])
+        backends.write_fake_image("query.jpg", [1], size=64)
+
+        results = search_images("query.jpg", "gallery", quiet=True)
+        assert sorted(basenames(results)) == [
+            "image0.jpg",
+            "image2.jpg",
+            "image5.jpg",
+        ]
+        distances = [distance for _, distance in results]
+        assert distances == sorted(distances)
+
+        # Any of the persons in the query image
+        backends.write_fake_image("query.jpg", [2, 3], size=64)
+        results = search_images("query.jpg", "gallery", quiet=True)
+        assert sorted(basenames(results)) == [
+            "image1.jpg",
+            "image2.jpg",
+            "image4.jpg",
+        ]
+
+        # Images of the gallery are found themselves
+        results = search_images("gallery/image4.jpg", "gallery", quiet=True)
+        assert basenames(results)[0] == "image4.jpg"
+        assert results[0][1] == pytest.approx(0.0, abs=1e-3)
+
+    def test_index_is_updated_incrementally(self, monkeypatch: Any) -> None:
+        write_gallery([[1], [2], [1]])
+        backends.write_fake_image("query.jpg", [1], size=64)
+        assert len(search_images("query.jpg", "gallery", quiet=True)) == 2
+
+        read: list[str] = []
+        read_cached_encodings = cache.read_cached_encodings
+
+        def counting_read(root_dir: str, image_hash: str) -> Any:
+            read.append(image_hash)
+            return read_cached_encodings(root_dir, image_hash)
+
+        monkeypatch.setattr(cache, "read_cached_encodings", counting_read)
+        backends.write_fake_image("gallery/new.jpg", [1], size=64)
+        os.remove("gallery/image0.jpg")
+        results = search_images("query.jpg", "gallery", quiet=True)
+        assert sorted(basenames(results)) == ["image2.jpg", "new.jpg"]
+        # Only the new image and the query image are read from the cache
+        assert len(read) == 2
+
+        # The stored index is used as is without updating
+        backends.write_fake_image("gallery/newer.jpg", [1], size=64)
+        results = search_images(
+            "query.jpg", "gallery", update=False, quiet=True
+        )
+        assert sorted(basenames(results)) == ["image2.jpg", "new.jpg"]
+
+    def test_errors(self) -> None:
+        write_gallery([[1]])
+        backends.write_fake_image("query.jpg", [1], size=64)
+        with pytest.raises(FacesException):
+            search_images("query.jpg", "gallery", update=False, quiet=True)
+
+        backends.write_fake_image("nobody.jpg", [], size=64)
+        with pytest.raises(FacesException):
+            search_images("nobody.jpg", "gallery", quiet=True)
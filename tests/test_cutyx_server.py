@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import socket
+import stat
+import threading
+from typing import Any
+
+from cutyx.lib import match_names
+from cutyx.server import (
+    ClassificationServer,
+    _UnixServer,
+    forward,
+    is_own_socket,
+    request,
+)
+from cutyx.watch import Watcher
+
+
+def touch(path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(path)
+
+
+def album_files(album_dir: str) -> list[str]:
+    return sorted(f for f in os.listdir(album_dir) if not f.startswith("."))
+
+
+def make_server() -> ClassificationServer:
+    watcher = Watcher("gallery", "albums", use_cache=False, quiet=True)
+    watcher.start(update_albums=False)
+    return ClassificationServer(watcher)
+
+
+class TestClassificationServer:
+    def test_process_images_and_rules(self) -> None:
+        touch("gallery/linus1.jpg")
+        touch("gallery/other.jpg")
+        match_names("albums/a", "linus", quiet=True)
+        server = make_server()
+
+        response = server.handle(
+            {
+                "command": "process-images",
+                "args": {
+                    "images": ["gallery/linus1.jpg", "gallery/other.jpg"],
+                    "albums_root_dir": "albums",
+                },
+            }
+        )
+        assert response["ok"]
+        assert response["result"]["unchanged"] == 0
+        assert album_files("albums/a") == ["linus1.jpg"]
+
+        # Rules added through the server are used immediately
+        response = server.handle(
+            {
+                "command": "match-names",
+                "args": {"album_dir": "albums/b", "text": "other"},
+            }
+        )
+        assert response["ok"]
+        response = server.handle(
+            {
+                "command": "classify",
+                "args": {"images": ["gallery/other.jpg"]},
+            }
+        )
+        assert response["result"] == {
+            os.path.abspath("gallery/other.jpg"): [
+                [os.path.abspath("albums/b"), "name", "'other'"]
+            ]
+        }
+
+    def test_unsupported_requests(self) -> None:
+        touch("gallery/linus1.jpg")
+        touch("elsewhere/linus2.jpg")
+        server = make_server()
+
+        for request_ in (
+            {"command": "unknown"},
+            {
+                "command": "process-images",
+                "args": {"images": ["elsewhere/linus2.jpg"]},
+            },
+            {
+                "command": "process-images",
+                "args": {
+                    "images": ["gallery/linus1.jpg"],
+                    "albums_root_dir": "other-albums",
+                },
+            },
+            {
+                "command": "match-names",
+                "args": {"album_dir": "other-albums/a", "text": "linus"},
+            },
+        ):
+            response = server.handle(request_)
+            assert not response["ok"] and response["unsupported"]
+        assert not os.path.exists("other-albums")
+
+    def test_malformed_requests(self) -> None:
+        touch("gallery/linus1.jpg")
+        server = make_server()
+
+        for request_ in (
+            {"command": "match-names", "args": {"album_dir": "albums/a"}},
+            {"command": "process-images", "args": {"images": 1}},
+            {"command": "match-names", "args": []},
+        ):
+            response = server.handle(request_)
+            assert not response["ok"] and not response["unsupported"]
+            assert response["error"].startswith("Invalid request")
+
+
+class TestSocket:
+    def test_round_trip(self) -> None:
+        touch("gallery/linus1.jpg")
+        match_names("albums/a", "linus", quiet=True)
+        socket_path = os.path.abspath("cutyx.sock")
+        assert request("ping", socket_path=socket_path) is None
+
+        unix_server = _UnixServer(socket_path, make_server())
+        thread = threading.Thread(target=unix_server.serve_forever)
+        thread.start()
+        try:
+            response = request("ping", socket_path=socket_path)
+            assert response["result"]["root_dir"] == os.path.abspath("gallery")
+            response = forward(
+                "process-images",
+                {"images": [os.path.abspath("gallery/linus1.jpg")]},
+                socket_path=socket_path,
+            )
+            assert response["result"]["added"]
+            assert album_files("albums/a") == ["linus1.jpg"]
+            assert forward("unknown", {}, socket_path=socket_path) is None
+            # Only accessible by the current user
+            assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        finally:
+            unix_server.shutdown()
+            unix_server.server_close()
+            thread.join()
+
+    def test_foreign_paths_are_not_used(self, monkeypatch: Any) -> None:
+        touch("files/not-a-socket")
+        assert not is_own_socket("files/not-a-socket")
+        assert request("ping", socket_path="files/not-a-socket") is None
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(os.path.abspath("cutyx.sock"))
+            assert is_own_socket("cutyx.sock")
+            # Sockets of other users may be used to intercept requests
+            monkeypatch.setattr(os, "getuid", lambda: os.stat(".").st_uid + 1)
+            assert not is_own_socket("cutyx.sock")
+            assert request("ping", socket_path="cutyx.sock") is None
+
+    def test_broken_servers(self, monkeypatch: Any) -> None:
+        socket_path = os.path.abspath("cutyx.sock")
+        # Malformed, truncated and unexpected responses and no response
+        replies = [b"garbage\n", b'{"ok": tr', b"[1, 2]\n", None]
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(socket_path)
+            sock.listen(1)
+
+            def answer() -> None:
+                for reply in replies:
+                    connection, _ = sock.accept()
+                    with connection:
+                        connection.recv(65536)
+                        if reply is not None:
+                            connection.sendall(reply)
+                        else:
+                            # Waits until the client gives up
+                            connection.recv(1)
+
+            thread = threading.Thread(target=answer)
+            thread.start()
+            monkeypatch.setenv("CUTYX_SERVER_TIMEOUT", "0.2")
+            try:
+                # The commands are processed locally instead
+                for _ in replies:
+                    assert forward("ping", {}, socket_path=socket_path) is None
+            finally:
+                thread.join()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sqlite3
+import time
+from typing import Any, Generator
+
+import numpy as np
+import pytest
+
+from cutyx import backends, cache, faces
+from cutyx.constants import (
+    CACHE_DATABASE_FILE_NAME,
+    FACES_CACHE_DIR_NAME,
+    FINGERPRINTS_FILE_NAME,
+)
+from cutyx.exceptions import FacesException
+from cutyx.fingerprints import FingerprintIndex
+from cutyx.lib import (
+    clear_cache,
+    collect_cache_garbage,
+    convert_cache,
+    process_directory,
+    update_cache,
+)
+from cutyx.sqlite_cache import SqliteCache
+
+FAKE = faces.DetectionOptions(backend="fake")
+
+
+@pytest.fixture(autouse=True)
+def close_databases() -> Generator[None, None, None]:
+    yield
+    cache.close_databases()
+
+
+def write_gallery(count: int) -> None:
+    os.makedirs("images", exist_ok=True)
+    os.makedirs("album/.faces.d", exist_ok=True)
+    for i in range(count):
+        backends.write_fake_image(f"images/image{i}.jpg", [i], size=64)
+        # Recently modified images are not remembered by the fingerprints
+        os.utime(f"images/image{i}.jpg", (1000000000, 1000000000))
+
+
+def cached_hashes() -> list[str]:
+    return sorted(
+        str(entry.image_hash) for entry in cache.iter_cache_entries(".")
+    )
+
+
+class TestSqliteCache:
+    def test_read_write(self) -> None:
+        database = SqliteCache("cache/cache.sqlite", backend="fake")
+        encodings = np.arange(256, dtype=np.float64).reshape((2, 128))
+
+        assert not database.contains("a")
+        assert database.read("a") is None
+        database.write("a", encodings)
+        database.write("b", [])
+        assert database.contains("a")
+        stored = database.read("a")
+        assert stored is not None
+        assert stored.tolist() == encodings.tolist()
+        stored = database.read("b")
+        assert stored is not None
+        assert stored.shape == (0, 128)
+
+        # Uncommitted writes are not visible to other connections
+        other = sqlite3.connect("cache/cache.sqlite")
+        count = "SELECT count(*) FROM encodings"
+        assert other.execute(count).fetchone()[0] == 0
+        database.flush()
+        assert other.execute(count).fetchone()[0] == 2
+        assert other.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert other.execute(
+            "SELECT DISTINCT backend FROM encodings"
+        ).fetchall() == [("fake",)]
+        other.close()
+
+        database.remove(["a"])
+        assert [entry[0] for entry in database.entries()] == ["b"]
+        database.close()
+
+    def test_removed_entries_release_space(self) -> None:
+        database = SqliteCache("cache.sqlite")
+        for i in range(100):
+            database.write(str(i), np.zeros((10, 128)))
+        # Closing the database moves the changes from the WAL into the file
+        database.close()
+        size = os.path.getsize("cache.sqlite")
+
+        database = SqliteCache("cache.sqlite")
+        database.remove([str(i) for i in range(90)])
+        database.close()
+        assert os.path.getsize("cache.sqlite") < size / 4
+
+    def test_access_times(self) -> None:
+        database = SqliteCache("cache.sqlite", access_interval=60)
+        database.write("old", [], accessed=time.time() - 3600)
+        database.write("new", [], accessed=time.time() - 10)
+        database.flush()
+
+        assert database.contains("old")
+        assert database.read("new") is not None
+        database.flush()
+        accessed = {entry[0]: entry[2] for entry in database.entries()}
+        assert time.time() - accessed["old"] < 60
+        assert 10 <= time.time() - accessed["new"] < 60
+        database.close()
+
+    def test_fingerprints(self) -> None:
+        database = SqliteCache("cache.sqlite")
+        entries = {"/a.jpg": [1, 2, 3, "x"], "/b.jpg": [4, 5, 6, "y"]}
+        database.write_fingerprints(entries)
+        assert database.read_fingerprints() == entries
+        database.write_fingerprints({"/a.jpg": [1, 2, 3, "x"]})
+        assert database.read_fingerprints() == {"/a.jpg": [1, 2, 3, "x"]}
+        database.close()
+
+    def test_unusable_database(self) -> None:
+        with open("cache.sqlite", "wb") as f:
+            f.write(b"no database" * 100)
+        with pytest.raises(FacesException):
+            SqliteCache("cache.sqlite")
+
+
+class TestSqliteStore:
+    def test_process_directory(self) -> None:
+        write_gallery(5)
+        convert_cache(store="sqlite", quiet=True)
+        assert cache.cache_store(".") == "sqlite"
+
+        process_directory(quiet=True, detection=FAKE)
+        assert len(cached_hashes()) == 5
+        assert not os.path.exists(FACES_CACHE_DIR_NAME)
+        assert not os.path.exists(FINGERPRINTS_FILE_NAME)
+        assert len(FingerprintIndex.load(".").entries) == 5
+
+        os.remove("images/image0.jpg")
+        report = collect_cache_garbage(quiet=True)
+        assert len(report.removed) == 1
+        assert len(cached_hashes()) == 4
+
+        clear_cache(quiet=True)
+        assert not os.path.exists(CACHE_DATABASE_FILE_NAME)
+        assert cached_hashes() == []
+
+    def test_convert(self) -> None:
+        write_gallery(4)
+        process_directory(quiet=True, detection=FAKE)
+        hashes = cached_hashes()
+        encodings = {}
+        for image_hash in hashes:
+            stored = cache.read_cached_encodings(".", image_hash)
+            assert stored is not None
+            encodings[image_hash] = stored.tolist()
+        old = time.time() - 100 * 24 * 60 * 60
+        os.utime(cache.cached_encodings_path(".", hashes[0]), (old, old))
+        fingerprints = FingerprintIndex.load(".").entries
+
+        convert_cache(store="sqlite", quiet=True)
+        assert os.path.exists(CACHE_DATABASE_FILE_NAME)
+        assert not os.path.exists(FACES_CACHE_DIR_NAME)
+        assert cached_hashes() == hashes
+        assert FingerprintIndex.load(".").entries == fingerprints
+
+        # The last access times are kept for the eviction order
+        report = cache.collect_garbage(
+            ".", max_age=50 * 24 * 60 * 60, dry_run=True
+        )
+        assert [entry.image_hash for entry in report.removed] == [hashes[0]]
+
+        for image_hash, expected in encodings.items():
+            actual = cache.read_cached_encodings(".", image_hash)
+            assert actual is not None
+            assert actual.tolist() == expected
+
+        convert_cache(store="files", quiet=True)
+        assert not os.path.exists(CACHE_DATABASE_FILE_NAME)
+        assert cached_hashes() == hashes
+        assert FingerprintIndex.load(".").entries == fingerprints
+
+        with pytest.raises(FacesException):
+            convert_cache(store="unknown", quiet=True)
+
+    def test_encodings_are_not_computed_again(self, monkeypatch: Any) -> None:
+        write_gallery(3)
+        convert_cache(store="sqlite", quiet=True)
+        process_directory(quiet=True, detection=FAKE)
+        cache.close_databases()
+
+        def fail(*args: Any, **kwargs: Any) -> Any:
+            raise AssertionError("encodings calculated again")
+
+        monkeypatch.setattr(backends.FakeBackend, "encode_images", fail)
+        process_directory(quiet=True, detection=FAKE)
+
+    def test_database_is_not_locked_while_encoding(
+        self, monkeypatch: Any
+    ) -> None:
+        write_gallery(40)
+        convert_cache(store="sqlite", quiet=True)
+        encode_images = backends.FakeBackend.encode_images
+        batches: list[list[str]] = []
+        unlocked: list[bool] = []
+
+        def slow_encode_images(self: Any, *args: Any) -> Any:
+            batches.append(args[0])
+            if len(batches) == 2:
+                # Another process can write while the next batch is encoded
+                other = sqlite3.connect(
+                    CACHE_DATABASE_FILE_NAME, timeout=0.1, isolation_level=None
+                )
+                deadline = time.monotonic() + 5
+                while not unlocked and time.monotonic() < deadline:
+                    try:
+                        other.execute("BEGIN IMMEDIATE")
+                        other.execute("COMMIT")
+                        unlocked.append(True)
+                    except sqlite3.OperationalError:
+                        pass
+                other.close()
+            return encode_images(self, *args)
+
+        monkeypatch.setattr(
+            backends.FakeBackend, "encode_images", slow_encode_images
+        )
+        update_cache(quiet=True, detection=FAKE)
+        assert len(batches) > 2
+        assert unlocked == [True]
+        assert len(cached_hashes()) == 40
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from cutyx import cache, storage
+from cutyx.exceptions import FacesException
+
+
+def write_legacy_encoding(directory: str, name: str, encoding: object) -> None:
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name + ".encoding"), "w") as f:
+        f.write(json.dumps(pickle.dumps(encoding).decode("latin-1")))
+
+
+class TestEncodingsFile:
+    @pytest.mark.parametrize("mmap", [True, False])
+    def test_roundtrip(self, mmap: bool) -> None:
+        encodings = np.random.default_rng(1).normal(size=(3, 128))
+        storage.write_encodings("faces.encodings", encodings)
+
+        data = storage.read_encodings("faces.encodings", mmap=mmap)
+        assert data.shape == (3, 128)
+        assert np.array_equal(data, encodings)
+        assert not data.flags.writeable
+
+    def test_roundtrip_float32(self) -> None:
+        encodings = [np.full(128, 0.25), np.full(128, 0.5)]
+        storage.write_encodings("faces.encodings", encodings, dtype="<f4")
+
+        assert os.path.getsize("faces.encodings") == 32 + 2 * 128 * 4
+        data = storage.read_encodings("faces.encodings")
+        assert data.dtype == np.float32
+        assert np.array_equal(data, np.vstack(encodings))
+
+    def test_no_faces(self) -> None:
+        storage.write_encodings("faces.encodings", [])
+
+        assert storage.read_encodings("faces.encodings").shape == (0, 128)
+
+    def test_invalid_file(self) -> None:
+        with open("faces.encodings", "wb") as f:
+            f.write(b"x" * 64)
+
+        with pytest.raises(FacesException):
+            storage.read_encodings("faces.encodings")
+
+    def test_truncated_file(self) -> None:
+        storage.write_encodings("faces.encodings", np.zeros((2, 128)))
+        with open("faces.encodings", "r+b") as f:
+            f.truncate(100)
+
+        with pytest.raises(FacesException):
+            storage.read_encodings("faces.encodings")
+
+
+class TestLegacyMigration:
+    def test_migrate_cache_entry(self) -> None:
+        encoding = np.random.default_rng(2).normal(size=128)
+        write_legacy_encoding(
+            cache.legacy_cache_dir(".", "abc"), "1", encoding
+        )
+
+        data = cache.read_cached_encodings(".", "abc")
+
+        assert data is not None
+        assert np.array_equal(data, encoding[np.newaxis, :])
+        assert not os.path.exists(cache.legacy_cache_dir(".", "abc"))
+        assert os.path.exists(cache.cached_encodings_path(".", "abc"))
+
+    def test_migrate_empty_cache_entry(self) -> None:
+        os.makedirs(cache.legacy_cache_dir(".", "abc"))
+
+        data = cache.read_cached_encodings(".", "abc")
+
+        assert data is not None
+        assert len(data) == 0
+
+    def test_missing_cache_entry(self) -> None:
+        assert cache.read_cached_encodings(".", "abc") is None
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+
+import pytest
+
+from cutyx import utils
+from cutyx.utils import clonefile, mkhardlink
+
+
+def write_file(path: str, content: bytes, mtime: int = 1000000000) -> None:
+    with open(path, "wb") as f:
+        f.write(content)
+    os.utime(path, (mtime, mtime))
+
+
+class TestCloneFile:
+    def test_clone_copies_content_and_stat(self) -> None:
+        write_file("a.jpg", b"a" * 100000)
+        write_file("b.jpg", b"old")
+
+        clonefile("a.jpg", "b.jpg")
+        with open("b.jpg", "rb") as f:
+            assert f.read() == b"a" * 100000
+        assert os.stat("b.jpg").st_mtime == 1000000000
+        assert not os.path.samefile("a.jpg", "b.jpg")
+
+    def test_clone_falls_back_to_regular_copy(
+        self, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setattr(utils, "_reflink", lambda src, dest: False)
+        monkeypatch.setattr(utils, "_copy_file_range", lambda src, dest: False)
+        write_file("a.jpg", b"abc")
+
+        clonefile("a.jpg", "b.jpg")
+        with open("b.jpg", "rb") as f:
+            assert f.read() == b"abc"
+
+
+class TestHardlink:
+    def test_hardlink_shares_the_file(self) -> None:
+        write_file("a.jpg", b"abc")
+        write_file("b.jpg", b"old")
+
+        mkhardlink("a.jpg", "b.jpg")
+        assert os.path.samefile("a.jpg", "b.jpg")
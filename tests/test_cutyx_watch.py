@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+
+from cutyx.lib import match_names
+from cutyx.watch import Watcher
+
+
+def touch(path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(path)
+
+
+def album_files(album_dir: str) -> list[str]:
+    return sorted(f for f in os.listdir(album_dir) if not f.startswith("."))
+
+
+class TestWatcher:
+    def test_images_and_rule_changes(self) -> None:
+        touch("gallery/linus1.jpg")
+        touch("gallery/other.jpg")
+        match_names("albums/a", "linus", quiet=True)
+
+        watcher = Watcher("gallery", "albums", use_cache=False, quiet=True)
+        watcher.start()
+        assert album_files("albums/a") == ["linus1.jpg"]
+
+        # New, modified and deleted images
+        touch("gallery/sub/linus2.jpg")
+        os.remove("gallery/linus1.jpg")
+        watcher.handle_changes(
+            {
+                os.path.abspath("gallery/sub/linus2.jpg"),
+                os.path.abspath("gallery/linus1.jpg"),
+            }
+        )
+        assert album_files("albums/a") == ["linus2.jpg"]
+
+        # A changed rule only re-evaluates the album
+        match_names("albums/a", "other", quiet=True)
+        match_names("albums/b", "other", quiet=True)
+        watcher.handle_changes(
+            {
+                os.path.abspath("albums/a/.cutyx-faces.d/x.names"),
+                os.path.abspath("albums/b/.cutyx-faces.d/x.names"),
+            }
+        )
+        assert album_files("albums/a") == ["linus2.jpg", "other.jpg"]
+        assert album_files("albums/b") == ["other.jpg"]
+
+        # Written album contents are ignored
+        watcher.handle_changes({os.path.abspath("albums/a/other.jpg")})
+        assert album_files("albums/a") == ["linus2.jpg", "other.jpg"]